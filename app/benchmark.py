@@ -0,0 +1,190 @@
+# app/benchmark.py
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+from tabulate import tabulate
+from synthetic_workbook import SyntheticModelSpec, write_synthetic_models
+from utils import (TRANSACTION_COLUMNS_START, HierarchyTree, load_transaction_types, read_trn_model, read_trn_model_streaming,
+                   build_hierarchy, build_hierarchy_tree, fill_hierarchical_data, generate_row_identifiers,
+                   generate_column_identifiers, generate_column_labels, create_hierarchy, process_excel_file,
+                   process_transaction_data)
+from diff_engine import compare_models, generate_difference_explanation, highlight_differences
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+
+def measure(stage, func, track_memory, results, **context):
+    # Runs func once for wall time and, if requested, once more under tracemalloc for
+    # peak allocation, so tracing overhead does not leak into the timings
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if track_memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    results.append(dict(context, stage=stage, seconds=round(elapsed, 4),
+                        peak_mb=round(peak / 1024 ** 2, 2) if peak is not None else None))
+    return result
+
+def benchmark_size(spec, workdir, track_memory, diff_types):
+    path = os.path.join(workdir, f"model_{spec.rows}.xlsx")
+    edited_path = os.path.join(workdir, f"model_{spec.rows}_edited.xlsx")
+    write_synthetic_models(spec, path, edited_path)
+    context = {'rows': spec.rows, 'types': spec.transaction_types, 'sub_columns': spec.sub_columns,
+               'file_mb': round(os.path.getsize(path) / 1024 ** 2, 2)}
+    results = []
+
+    transaction_types = measure('load_transaction_types', lambda: load_transaction_types(path), track_memory, results, **context)
+    raw_df, hierarchical_data = measure('read_trn_model', lambda: read_trn_model(path), track_memory, results, **context)
+    measure('read_trn_model_streaming', lambda: read_trn_model_streaming(path), track_memory, results, **context)
+    hierarchical_data = list(hierarchical_data)
+    hierarchy = measure('build_hierarchy', lambda: build_hierarchy(hierarchical_data), track_memory, results, **context)
+    measure('create_hierarchy', lambda: create_hierarchy(path), track_memory, results, **context)
+    measure('generate_row_identifiers', lambda: generate_row_identifiers(raw_df, hierarchy), track_memory, results, **context)
+    measure('generate_column_identifiers', lambda: generate_column_identifiers(raw_df), track_memory, results, **context)
+    df = measure('process_excel_file', lambda: process_excel_file(path, streaming=False), track_memory, results, **context)
+    measure('process_excel_file_streaming', lambda: process_excel_file(path, streaming=True), track_memory, results, **context)
+    edited_df = process_excel_file(edited_path, streaming=False)
+
+    selected = transaction_types[:diff_types]
+    measure('process_transaction_data', lambda: [process_transaction_data(df, t) for t in selected],
+            track_memory, results, **context)
+
+    def diff_all():
+        # As the diff checkers run it, including the row fingerprints each model builds on its first diff
+        for frame in (df, edited_df):
+            frame.attrs.pop('row_fingerprints', None)
+        outputs = []
+        for t in selected:
+            diff_df1, diff_df2 = compare_models(df, t, edited_df, t)
+            outputs.append((diff_df1, diff_df2, generate_difference_explanation(diff_df1, diff_df2, "Sheet 1", "Sheet 2")))
+        return outputs
+    diffs = measure('diff', diff_all, track_memory, results, **context)
+    measure('highlight_differences',
+            lambda: [highlight_differences(d1.reset_index(drop=True), d2.reset_index(drop=True)) for d1, d2, _ in diffs],
+            track_memory, results, **context)
+    return results
+
+# The per-row identifier builders that the vectorized ones in utils replaced, kept as the
+# baseline of the wide-sheet identifier benchmark
+
+def per_row_paths(hierarchical_data):
+    current_path = []
+    for value, indent in fill_hierarchical_data(hierarchical_data):
+        current_path = current_path[:indent] + [''] * (indent - len(current_path)) + [value]
+        yield tuple(filter(None, current_path))
+
+def per_row_hierarchy(hierarchical_data):
+    paths = {}
+    return [paths.setdefault(path, path) for path in ('_'.join(path) for path in per_row_paths(hierarchical_data))]
+
+def per_row_hierarchy_tree(hierarchical_data):
+    node_ids = {(): 0}
+    row_nodes = []
+    for path in per_row_paths(hierarchical_data):
+        node = node_ids.get(path)
+        if node is None:
+            for depth in range(1, len(path) + 1):
+                node = node_ids.setdefault(path[:depth], len(node_ids))
+        row_nodes.append(node)
+    return HierarchyTree(list(node_ids), row_nodes)
+
+def per_row_row_identifiers(df, hierarchy):
+    def create_identifier(row, hier_value):
+        variable = getattr(row, 'Variable', None)
+        variable = variable if pd.notna(variable) and variable != '' else None
+        return f"{hier_value}.{variable}" if variable else hier_value
+    return [create_identifier(row, hier) for row, hier in zip(df.itertuples(index=False), hierarchy)]
+
+def per_row_column_labels(df):
+    column_identifiers = []
+    column_groups = []
+    last_valid_column_name = None
+    for col in df.columns:
+        column_name = str(col).strip() if pd.notna(col) and str(col).strip() else ""
+        if "Unnamed" in str(col):
+            column_name = last_valid_column_name if pd.notna(df.iloc[0][col]) and str(df.iloc[0][col]).strip() else f"Unnamed_{col}"
+            column_groups.append(last_valid_column_name if column_name == last_valid_column_name else None)
+        else:
+            last_valid_column_name = column_name
+            column_groups.append(column_name)
+        first_row_value = str(df.iloc[0][col]).strip() if pd.notna(df.iloc[0][col]) and str(df.iloc[0][col]).strip() else ""
+        column_identifier = f"{column_name}_{first_row_value}" if column_name and first_row_value else column_name or first_row_value
+        column_identifiers.append(column_identifier if column_identifier else col)
+    return column_identifiers, column_groups
+
+def tree_outline(tree):
+    return tree.paths, tree.row_nodes.tolist()
+
+def benchmark_identifiers(rows, columns, sub_columns, workdir):
+    # Per-row against vectorized identifier generation on one wide sheet, timed once each
+    # (the per-row column labelling takes minutes at 5,000 columns), with a check that both
+    # give the same result
+    spec = SyntheticModelSpec(rows=rows, sub_columns=sub_columns,
+                              transaction_types=max(1, math.ceil((columns - TRANSACTION_COLUMNS_START) / sub_columns)))
+    path = os.path.join(workdir, f"wide_{rows}x{columns}.xlsx")
+    write_synthetic_models(spec, path)
+    raw_df, hierarchical_data = read_trn_model(path)
+    context = {'rows': spec.rows, 'types': spec.transaction_types, 'sub_columns': spec.sub_columns,
+               'file_mb': round(os.path.getsize(path) / 1024 ** 2, 2), 'columns': raw_df.shape[1]}
+    hierarchy = build_hierarchy(hierarchical_data)
+    stages = [
+        ('build_hierarchy', per_row_hierarchy, build_hierarchy, (hierarchical_data,), None),
+        ('build_hierarchy_tree', per_row_hierarchy_tree, build_hierarchy_tree, (hierarchical_data,), tree_outline),
+        ('generate_row_identifiers', per_row_row_identifiers, generate_row_identifiers, (raw_df, hierarchy), None),
+        ('generate_column_labels', per_row_column_labels, generate_column_labels, (raw_df,), None),
+    ]
+    results = []
+    for stage, per_row, vectorized, args, comparable in stages:
+        comparable = comparable or (lambda result: result)
+        expected = measure(f"{stage} (per-row)", lambda: per_row(*args), False, results, **context)
+        result = measure(f"{stage} (vectorized)", lambda: vectorized(*args), False, results, **context)
+        results[-1]['identical'] = comparable(result) == comparable(expected)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each processing stage on synthetic 'Trn Model' workbooks.")
+    parser.add_argument('--sizes', type=lambda value: [int(v) for v in value.split(',') if v], default=DEFAULT_SIZES,
+                        help="Comma-separated row counts (default: 1000,10000,50000); empty to skip")
+    parser.add_argument('--transaction-types', type=int, default=60)
+    parser.add_argument('--sub-columns', type=int, default=3)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--edit-pct', type=float, default=1.0)
+    parser.add_argument('--diff-types', type=int, default=5, help="Transaction types extracted and diffed per size")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc peak-memory runs")
+    parser.add_argument('--output', help="Write the results as JSON to this path, e.g. for release-over-release tracking")
+    parser.add_argument('--wide-columns', type=int, default=0,
+                        help="Also compare per-row and vectorized identifier generation on a sheet this wide")
+    parser.add_argument('--wide-rows', type=int, default=2000)
+    parser.add_argument('--workdir', help="Keep the generated workbooks here instead of a temporary directory")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        for rows in args.sizes:
+            spec = SyntheticModelSpec(rows=rows, depth=args.depth, transaction_types=args.transaction_types,
+                                      sub_columns=args.sub_columns, edit_pct=args.edit_pct)
+            results.extend(benchmark_size(spec, workdir, not args.no_memory, args.diff_types))
+        if args.wide_columns:
+            results.extend(benchmark_identifiers(args.wide_rows, args.wide_columns, args.sub_columns, workdir))
+
+    print(tabulate(pd.DataFrame(results), headers='keys', tablefmt='psql', showindex=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'python': platform.python_version(), 'pandas': pd.__version__, 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
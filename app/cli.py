@@ -0,0 +1,179 @@
+# app/cli.py
+
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from tabulate import tabulate
+from utils import process_excel_file, process_transaction_data, transaction_display_frame
+from diff_engine import compare_models, generate_difference_explanation
+from result_export import EXPORT_FORMATS, write_table
+
+OUTPUT_FORMATS = EXPORT_FORMATS
+
+def expand_workbooks(paths):
+    workbooks = []
+    for path in paths:
+        if os.path.isdir(path):
+            workbooks.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                    if name.endswith('.xlsx') and not name.startswith('~$')))
+        else:
+            workbooks.append(path)
+    return workbooks
+
+def pair_workbooks(base, other):
+    # Two files are compared directly; two directories are paired by file name
+    if os.path.isdir(base) and os.path.isdir(other):
+        other_names = {os.path.basename(path) for path in expand_workbooks([other])}
+        return [(path, os.path.join(other, os.path.basename(path))) for path in expand_workbooks([base])
+                if os.path.basename(path) in other_names]
+    return [(base, other)]
+
+def safe_name(name):
+    return re.sub(r'[^\w.-]+', '_', str(name)).strip('_') or 'unnamed'
+
+def output_names(file_paths):
+    # One output directory name per workbook: its stem, prefixed with as many parent directory
+    # names as it takes to tell apart workbooks with the same file name (models/2024-05/a.xlsx
+    # and models/2024-06/a.xlsx become 2024-05_a and 2024-06_a)
+    parts = [os.path.abspath(path).split(os.sep) for path in file_paths]
+    parts = [path_parts[:-1] + [os.path.splitext(path_parts[-1])[0]] for path_parts in parts]
+    depths = [1] * len(parts)
+    while True:
+        names = [safe_name('_'.join(path_parts[-depth:])) for path_parts, depth in zip(parts, depths)]
+        clashing = [i for i, name in enumerate(names) if depths[i] < len(parts[i]) and
+                    any(other == name and parts[j] != parts[i] for j, other in enumerate(names))]
+        if not clashing:
+            break
+        for i in clashing:
+            depths[i] += 1
+    # The same workbook given twice still gets two directories
+    seen = {}
+    for i, name in enumerate(names):
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            names[i] = f"{name}_{seen[name]}"
+    return names
+
+def write_frame(frame, path, output_format):
+    write_table(frame, f"{path}.{output_format}", output_format, os.path.basename(path))
+
+def selected_types(df, transaction_types):
+    available = sorted(df.attrs.get('column_index', {}))
+    if not transaction_types:
+        return available
+    return [t for t in transaction_types if t.strip() in available]
+
+def process_workbook_job(item, transaction_types, output_dir, output_format):
+    file_path, output_name = item
+    timings = {'file': file_path}
+    start = time.perf_counter()
+    df = process_excel_file(file_path)
+    timings['parse_s'] = time.perf_counter() - start
+    if df.empty:
+        raise ValueError(f"No 'Trn Model' data could be processed from {file_path}")
+
+    target_dir = os.path.join(output_dir, output_name)
+    os.makedirs(target_dir, exist_ok=True)
+    start = time.perf_counter()
+    types = selected_types(df, transaction_types)
+    rows = 0
+    for transaction_type in types:
+        extracted = transaction_display_frame(process_transaction_data(df, transaction_type))
+        write_frame(extracted, os.path.join(target_dir, safe_name(transaction_type)), output_format)
+        rows += len(extracted)
+    timings.update(types=len(types), rows=rows, work_s=time.perf_counter() - start)
+    return timings
+
+def diff_workbook_job(item, transaction_types, output_dir, output_format, match_moved=False):
+    (file_path1, file_path2), output_name = item
+    timings = {'file': f"{file_path1} -> {file_path2}"}
+    start = time.perf_counter()
+    df1 = process_excel_file(file_path1)
+    df2 = process_excel_file(file_path2)
+    timings['parse_s'] = time.perf_counter() - start
+    if df1.empty or df2.empty:
+        raise ValueError(f"No 'Trn Model' data could be processed from {file_path1} or {file_path2}")
+
+    target_dir = os.path.join(output_dir, output_name)
+    os.makedirs(target_dir, exist_ok=True)
+    start = time.perf_counter()
+    types = sorted(set(selected_types(df1, transaction_types)) & set(selected_types(df2, transaction_types)))
+    all_changes = []
+    for transaction_type in types:
+        diff_df1, diff_df2 = compare_models(df1, transaction_type, df2, transaction_type, match_moved=match_moved)
+        changes_df = generate_difference_explanation(diff_df1, diff_df2, "Sheet 1", "Sheet 2")
+        all_changes.append(changes_df.assign(**{'Transaction Type': transaction_type}))
+    changes = pd.concat(all_changes, ignore_index=True) if all_changes else pd.DataFrame()
+    write_frame(changes, os.path.join(target_dir, 'changes'), output_format)
+    timings.update(types=len(types), rows=len(changes), work_s=time.perf_counter() - start)
+    return timings
+
+def run_jobs(job, items, workers, *args):
+    results = []
+    failures = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(job, item, *args): item for item in items}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"Failed on {futures[future][0]}: {str(e)}")
+                failures += 1
+                continue
+            result['total_s'] = result['parse_s'] + result['work_s']
+            results.append(result)
+    return results, failures
+
+def print_summary(results):
+    if not results:
+        return
+    summary = pd.DataFrame(results, columns=['file', 'types', 'rows', 'parse_s', 'work_s', 'total_s'])
+    summary = summary.sort_values('total_s', ascending=False)
+    print(tabulate(summary, headers='keys', tablefmt='psql', showindex=False, floatfmt='.2f'))
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Process or diff 'Trn Model' workbooks without the Streamlit UI.")
+    parser.add_argument('--type', action='append', dest='types', help="Transaction type to include; repeat for several (default: all)")
+    parser.add_argument('--output-dir', default='output', help="Directory for the exported results")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv', dest='output_format')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Worker processes (default: CPU count)")
+    parser.add_argument('--verbose', action='store_true', help="Show INFO logging from the processing steps")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    process_parser = subparsers.add_parser('process', help="Extract transaction types from workbooks")
+    process_parser.add_argument('paths', nargs='+', help="Workbooks or directories of workbooks")
+
+    diff_parser = subparsers.add_parser('diff', help="Diff two workbooks or two directories paired by file name")
+    diff_parser.add_argument('base')
+    diff_parser.add_argument('other')
+    diff_parser.add_argument('--match-moved', action='store_true',
+                             help="Report rows that were moved or renamed as Moved rather than as removed and added")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    job_args = (args.types, args.output_dir, args.output_format)
+    if args.command == 'process':
+        job, items = process_workbook_job, expand_workbooks(args.paths)
+    else:
+        job, items = diff_workbook_job, pair_workbooks(args.base, args.other)
+        job_args += (args.match_moved,)
+    if not items:
+        logging.error("No workbooks found")
+        return 1
+    items = list(zip(items, output_names([item if args.command == 'process' else item[0] for item in items])))
+
+    results, failures = run_jobs(job, items, max(1, args.workers), *job_args)
+    print_summary(results)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
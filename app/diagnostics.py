@@ -0,0 +1,123 @@
+# app/diagnostics.py
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+STAGE_DIAGNOSTICS = os.environ.get('STAGE_DIAGNOSTICS', '').lower() in ('1', 'true', 'yes')
+STAGE_DIAGNOSTICS_HISTORY = int(os.environ.get('STAGE_DIAGNOSTICS_HISTORY', 1000))
+
+try:
+    PAGE_BYTES = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_BYTES = None
+
+def current_rss():
+    # Resident set size in bytes, or None where /proc is not available
+    if PAGE_BYTES is None:
+        return None
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_BYTES
+    except (OSError, IndexError, ValueError):
+        return None
+
+class DiscardedRecord(dict):
+    # Handed out while diagnostics are off so instrumented code can fill in details unconditionally
+    def __setitem__(self, key, value):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+class NullStage:
+    def __enter__(self):
+        return DISCARDED_RECORD
+
+    def __exit__(self, *exc_info):
+        return False
+
+DISCARDED_RECORD = DiscardedRecord()
+NULL_STAGE = NullStage()
+
+class StageRecorder:
+    # Keeps the most recent stage records in memory. Disabled, stage() returns a shared
+    # no-op context manager, so the instrumented paths cost two attribute checks.
+    # A listener set with listen() is told about every stage the current thread enters,
+    # which is how background jobs report progress.
+    def __init__(self, enabled=STAGE_DIAGNOSTICS, history=STAGE_DIAGNOSTICS_HISTORY):
+        self.enabled = enabled
+        self._records = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def stage(self, name, **details):
+        listener = getattr(self._local, 'listener', None)
+        if listener is not None:
+            listener(name, details)
+        if not self.enabled:
+            return NULL_STAGE
+        return self._measure(name, details)
+
+    def progress(self, name, **details):
+        # Progress inside a long stage; only listeners see it
+        listener = getattr(self._local, 'listener', None)
+        if listener is not None:
+            listener(name, details)
+
+    @contextmanager
+    def listen(self, listener):
+        previous = getattr(self._local, 'listener', None)
+        self._local.listener = listener
+        try:
+            yield
+        finally:
+            self._local.listener = previous
+
+    @contextmanager
+    def _measure(self, name, details):
+        record = {'stage': name, **details}
+        started_at = time.time()
+        rss_before = current_rss()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            rss_after = current_rss()
+            record.update(
+                seconds=round(seconds, 6),
+                memory_delta_mb=round((rss_after - rss_before) / 1024 ** 2, 3) if rss_before is not None and rss_after is not None else None,
+                started_at=started_at,
+                thread=threading.current_thread().name,
+            )
+            with self._lock:
+                self._records.append(record)
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def summary(self):
+        # Per-stage call count and total/mean/max duration, in first-seen order
+        totals = {}
+        for record in self.records():
+            entry = totals.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            entry['calls'] += 1
+            entry['total_seconds'] += record['seconds']
+            entry['max_seconds'] = max(entry['max_seconds'], record['seconds'])
+        for entry in totals.values():
+            entry['mean_seconds'] = entry['total_seconds'] / entry['calls']
+        return list(totals.values())
+
+    def to_json(self):
+        return json.dumps({'summary': self.summary(), 'records': self.records()}, indent=2, default=str)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+diagnostics = StageRecorder()
@@ -0,0 +1,26 @@
+# app/diagnostics_panel.py
+
+import pandas as pd
+import streamlit as st
+from diagnostics import diagnostics
+from workbook_cache import workbook_cache
+from job_runner import job_runner
+from snapshot_store import snapshot_store
+
+def render_diagnostics_panel():
+    # Only shown when STAGE_DIAGNOSTICS is set; records are shared by all sessions of this server
+    with st.sidebar.expander("Diagnostics", expanded=False):
+        summary = diagnostics.summary()
+        if not summary:
+            st.caption("No stages recorded yet.")
+        else:
+            st.dataframe(pd.DataFrame(summary).round(4), hide_index=True)
+            records = pd.DataFrame(diagnostics.records()[::-1])
+            st.dataframe(records.drop(columns=['started_at']).astype(str), hide_index=True)
+        st.json(workbook_cache.stats(), expanded=False)
+        st.json(job_runner.stats(), expanded=False)
+        st.json(snapshot_store.stats(), expanded=False)
+        st.download_button("Export as JSON", data=diagnostics.to_json, file_name="diagnostics.json",
+                           mime="application/json", key="diagnostics_export")
+        if st.button("Clear", key="diagnostics_clear"):
+            diagnostics.clear()
@@ -0,0 +1,241 @@
+# app/diff_engine.py
+
+import pandas as pd
+import numpy as np
+from diagnostics import diagnostics
+from utils import process_transaction_data, extract_transaction_data
+from row_fingerprints import rows_equal, transaction_fingerprint
+from row_matching import MOVED, MovedRows, match_moved_rows
+
+KEY_COLUMNS = ['Category', 'Variable']
+CHANGE_COLUMNS = ['Category', 'Variable', 'Column', 'Change Type', 'From', 'To']
+CHANGE_ORDER = {'Removed': 1, 'Changed': 2, 'Added': 3}
+# Moved rows only exist in explanations, never as a cell change code
+EXPLANATION_ORDER = dict(CHANGE_ORDER, **{MOVED: 4})
+
+def align_transaction_frames(processed_df1, processed_df2):
+    # Remove duplicate columns, keeping the first as the similarity matrix does
+    processed_df1 = processed_df1.loc[:, ~processed_df1.columns.duplicated()]
+    processed_df2 = processed_df2.loc[:, ~processed_df2.columns.duplicated()]
+
+    # Both frames get the union of the two types' sub-columns, so a sub-column only one type
+    # has shows up as cells removed or added rather than being dropped or raising KeyError
+    key_columns = ['Unique_ID'] + KEY_COLUMNS
+    value_columns = [col for col in processed_df1.columns if col not in key_columns]
+    seen = set(value_columns)
+    value_columns += [col for col in processed_df2.columns if col not in key_columns and col not in seen]
+    columns_order = key_columns + value_columns
+    processed_df1 = processed_df1.reindex(columns=columns_order)
+    processed_df2 = processed_df2.reindex(columns=columns_order)
+
+    # Align dataframes on Unique_ID
+    processed_df1 = processed_df1.set_index('Unique_ID')
+    processed_df2 = processed_df2.set_index('Unique_ID')
+    processed_df1, processed_df2 = processed_df1.align(processed_df2, join='outer', axis=0)
+
+    # Ensure Category and Variable are populated in both DataFrames
+    processed_df1['Category'] = processed_df1['Category'].combine_first(processed_df2['Category'])
+    processed_df1['Variable'] = processed_df1['Variable'].combine_first(processed_df2['Variable'])
+    processed_df2['Category'] = processed_df1['Category']
+    processed_df2['Variable'] = processed_df1['Variable']
+    return processed_df1, processed_df2
+
+def difference_rows(processed_df1, processed_df2):
+    # Rows where any cell differs, treating NaN and '' as the same empty value
+    filled1 = processed_df1.fillna('').to_numpy(dtype=object)
+    filled2 = processed_df2.fillna('').to_numpy(dtype=object)
+    diff_mask = ((filled1 != filled2) & ((filled1 != '') | (filled2 != ''))).any(axis=1)
+    return processed_df1[diff_mask], processed_df2[diff_mask]
+
+def compare_transaction_frames(processed_df1, processed_df2):
+    with diagnostics.stage('diff', step='compare') as record:
+        aligned_df1, aligned_df2 = align_transaction_frames(processed_df1, processed_df2)
+        diff_df1, diff_df2 = difference_rows(aligned_df1, aligned_df2)
+        record.update(rows=len(aligned_df1), columns=aligned_df1.shape[1], changed_rows=len(diff_df1))
+    return diff_df1, diff_df2
+
+def compare_models(df1, transaction_type1, df2, transaction_type2, rows1=None, rows2=None, match_moved=False):
+    # Same result as compare_transaction_frames on the two extracted types, but rows whose
+    # fingerprints match in both models are only checked cell by cell (see rows_equal), never
+    # extracted, aligned or explained. rows1/rows2 limit
+    # each side to those row positions, e.g. one hierarchy branch (see branch_rows).
+    # With match_moved, rows only one side has are paired by content (see match_moved_rows):
+    # a pair is compared cell by cell under its new Unique_ID, and the pairs are kept as
+    # MovedRows in the diff frames' attrs['moved_rows'] for the explanation.
+    moved = None
+    with diagnostics.stage('diff', step='fingerprint') as record:
+        fingerprint1 = transaction_fingerprint(df1, transaction_type1)
+        fingerprint2 = transaction_fingerprint(df2, transaction_type2)
+        if fingerprint1 is not None and rows1 is not None:
+            fingerprint1 = fingerprint1.subset(rows1)
+        if fingerprint2 is not None and rows2 is not None:
+            fingerprint2 = fingerprint2.subset(rows2)
+        usable = (fingerprint1 is not None and fingerprint2 is not None and fingerprint1.labels == fingerprint2.labels
+                  and fingerprint1.unique and fingerprint2.unique)
+        if usable:
+            matches = fingerprint2.unique_ids.get_indexer(fingerprint1.unique_ids)
+            common = matches >= 0
+            changed1 = ~common
+            changed1[common] = fingerprint1.hashes[common] != fingerprint2.hashes[matches[common]]
+            unchanged = np.flatnonzero(~changed1)
+            changed1[unchanged] = ~rows_equal(df1, transaction_type1, fingerprint1.rows[unchanged],
+                                              df2, transaction_type2, fingerprint2.rows[matches[unchanged]])
+            changed2 = np.ones(len(fingerprint2.rows), dtype=bool)
+            changed2[matches[common]] = changed1[common]
+            if match_moved:
+                only2 = np.ones(len(fingerprint2.rows), dtype=bool)
+                only2[matches[common]] = False
+                positions1, positions2, similarity = match_moved_rows(df1, transaction_type1, fingerprint1, np.flatnonzero(~common),
+                                                                      df2, transaction_type2, fingerprint2, np.flatnonzero(only2))
+                # Pairs with equal content have nothing left to compare
+                same = fingerprint1.hashes[positions1] == fingerprint2.hashes[positions2]
+                same[same] = rows_equal(df1, transaction_type1, fingerprint1.rows[positions1[same]],
+                                        df2, transaction_type2, fingerprint2.rows[positions2[same]])
+                changed1[positions1[same]] = False
+                changed2[positions2[same]] = False
+                row_keys2 = df2.attrs['row_keys']
+                rows = fingerprint2.rows[positions2]
+                moved = MovedRows(zip(fingerprint2.unique_ids[positions2], zip(
+                    fingerprint1.unique_ids[positions1], np.asarray(row_keys2.category[rows], dtype=object),
+                    np.asarray(row_keys2.variable[rows], dtype=object), similarity)))
+                rekeyed = (fingerprint1.rows[positions1[~same]], np.asarray(fingerprint2.unique_ids[positions2[~same]], dtype=object))
+            record.update(rows=len(fingerprint1.rows), changed_rows=int(changed1.sum() + changed2.sum()))
+    if not usable:
+        return compare_transaction_frames(process_transaction_data(df1, transaction_type1, rows1),
+                                          process_transaction_data(df2, transaction_type2, rows2))
+    processed_df1 = extract_transaction_data(df1, transaction_type1, df1.attrs['row_keys'], rows=fingerprint1.rows[changed1])
+    processed_df2 = extract_transaction_data(df2, transaction_type2, df2.attrs['row_keys'], rows=fingerprint2.rows[changed2])
+    if moved is None:
+        return compare_transaction_frames(processed_df1, processed_df2)
+    # Paired rows that differ are aligned with their counterpart under its Unique_ID
+    rows, unique_ids = rekeyed
+    processed_df1.loc[rows, 'Unique_ID'] = unique_ids
+    processed_df1.loc[rows, 'Category'] = [moved[unique_id][1] for unique_id in unique_ids]
+    processed_df1.loc[rows, 'Variable'] = [moved[unique_id][2] for unique_id in unique_ids]
+    diff_df1, diff_df2 = compare_transaction_frames(processed_df1, processed_df2)
+    diff_df1.attrs['moved_rows'] = diff_df2.attrs['moved_rows'] = moved
+    return diff_df1, diff_df2
+
+def cell_change_codes(values1, values2):
+    # 0 = unchanged, otherwise the CHANGE_ORDER code of the cell's change
+    na1 = pd.isna(values1)
+    na2 = pd.isna(values2)
+    codes = np.zeros(values1.shape, dtype=np.int8)
+    codes[~na1 & na2] = CHANGE_ORDER['Removed']
+    both = ~na1 & ~na2
+    codes[both & (values1 != values2)] = CHANGE_ORDER['Changed']
+    codes[na1 & ~na2] = CHANGE_ORDER['Added']
+    return codes
+
+# Same colours as RGB for the xlsx export, indexed by change code
+CHANGE_FILL_COLOURS = ['', 'F08080', 'FFFF00', '90EE90']
+CHANGE_STYLES = np.array(['', 'background-color: lightcoral', 'background-color: yellow', 'background-color: lightgreen'], dtype=object)
+
+def highlight_differences(df1, df2):
+    # Computed once per diff; both panes apply the same style frame
+    with diagnostics.stage('render', step='highlight', rows=df1.shape[0], columns=df1.shape[1]):
+        codes = cell_change_codes(df1.to_numpy(dtype=object), df2.reindex(index=df1.index, columns=df1.columns).to_numpy(dtype=object))
+        return pd.DataFrame(CHANGE_STYLES[codes], index=df1.index, columns=df1.columns)
+
+def generate_difference_explanation(df1, df2, type1, type2):
+    with diagnostics.stage('diff', step='explain', rows=len(df1)) as record:
+        changes_df = explain_differences(df1, df2, type1, type2)
+        record.update(changes=len(changes_df))
+    return changes_df
+
+def explain_differences(df1, df2, type1, type2):
+    added_rows = df2.index[~df2.index.isin(df1.index)]
+    removed_rows = df1.index[~df1.index.isin(df2.index)]
+
+    value_columns = [col for col in df1.columns if col not in KEY_COLUMNS]
+    if df1.index.equals(df2.index):
+        common1, common2 = df1, df2
+    else:
+        common1 = df1[df1.index.isin(df2.index)]
+        common2 = df2.loc[common1.index]
+    common2 = common2.reindex(columns=df1.columns)
+    matrix1 = common1[value_columns].to_numpy(dtype=object)
+    matrix2 = common2[value_columns].to_numpy(dtype=object)
+    codes = cell_change_codes(matrix1, matrix2)
+    row_pos, col_pos = np.nonzero(codes)
+    change_codes = codes[row_pos, col_pos]
+    values1 = matrix1[row_pos, col_pos]
+    values2 = matrix2[row_pos, col_pos]
+    change_names = np.array([''] + list(CHANGE_ORDER), dtype=object)[change_codes]
+
+    parts = [
+        pd.DataFrame({
+            'Category': df2.loc[added_rows, 'Category'].to_numpy(dtype=object),
+            'Variable': df2.loc[added_rows, 'Variable'].to_numpy(dtype=object),
+            'Column': 'Entire Row',
+            'Change Type': 'Added',
+            'From': '',
+            'To': f"New row in {type2}",
+        }, columns=CHANGE_COLUMNS),
+        pd.DataFrame({
+            'Category': df1.loc[removed_rows, 'Category'].to_numpy(dtype=object),
+            'Variable': df1.loc[removed_rows, 'Variable'].to_numpy(dtype=object),
+            'Column': 'Entire Row',
+            'Change Type': 'Removed',
+            'From': f"Existing row in {type1}",
+            'To': '',
+        }, columns=CHANGE_COLUMNS),
+        pd.DataFrame({
+            'Category': common1['Category'].to_numpy(dtype=object)[row_pos],
+            'Variable': common1['Variable'].to_numpy(dtype=object)[row_pos],
+            'Column': np.array(value_columns, dtype=object)[col_pos],
+            'Change Type': change_names,
+            'From': ['NaN' if code == CHANGE_ORDER['Added'] else str(val) for code, val in zip(change_codes, values1)],
+            'To': ['NaN' if code == CHANGE_ORDER['Removed'] else str(val) for code, val in zip(change_codes, values2)],
+        }, columns=CHANGE_COLUMNS),
+    ]
+    moved = df1.attrs.get('moved_rows')
+    if moved:
+        old_ids, categories, variables, _ = zip(*moved.values())
+        parts.append(pd.DataFrame({
+            'Category': np.asarray(categories, dtype=object),
+            'Variable': np.asarray(variables, dtype=object),
+            'Column': 'Entire Row',
+            'Change Type': MOVED,
+            'From': np.asarray(old_ids, dtype=object),
+            'To': np.asarray(list(moved), dtype=object),
+        }, columns=CHANGE_COLUMNS))
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.DataFrame(columns=CHANGE_COLUMNS)
+    changes_df = pd.concat(parts, ignore_index=True)
+
+    # Order the changes_df; the multi-key sort is stable, so ties keep row/column order
+    changes_df['Change Order'] = changes_df['Change Type'].map(EXPLANATION_ORDER)
+    changes_df.sort_values(by=['Change Order', 'Category', 'Variable'], inplace=True)
+    changes_df.drop(columns=['Change Order'], inplace=True)
+    return changes_df
+
+def change_rollup(changes_df, df1, df2, branch=()):
+    # Change counts per hierarchy node from branch down, each node counting every change in
+    # its own branch, in outline order; None when neither model carries a hierarchy tree
+    trees = [(df.attrs['hierarchy_tree'], df.attrs['row_keys']) for df in (df1, df2)
+             if 'hierarchy_tree' in df.attrs and 'row_keys' in df.attrs]
+    if not trees:
+        return None
+    category_paths = {}
+    outline = {}
+    for tree, row_keys in trees:
+        for category, path in tree.category_paths(row_keys).items():
+            category_paths.setdefault(category, path)
+        for path in tree.preorder():
+            outline.setdefault(path, len(outline))
+
+    change_types = list(CHANGE_ORDER) + ([MOVED] if (changes_df['Change Type'] == MOVED).any() else [])
+    counts = pd.crosstab(changes_df['Category'], changes_df['Change Type']).reindex(columns=change_types, fill_value=0)
+    totals = {}
+    for category, row in zip(counts.index, counts.to_numpy()):
+        path = category_paths.get(category, ())
+        for depth in range(min(len(branch), len(path)), len(path) + 1):
+            totals[path[:depth]] = totals.get(path[:depth], 0) + row
+    paths = sorted(totals, key=lambda path: (outline.get(path, len(outline)), path))
+    rollup = pd.DataFrame([totals[path] for path in paths], columns=change_types, dtype=np.int64)
+    rollup.insert(0, 'Branch', [' > '.join(path) or '(whole model)' for path in paths])
+    rollup.insert(1, 'Depth', [len(path) for path in paths])
+    rollup['Total'] = rollup[change_types].sum(axis=1)
+    return rollup
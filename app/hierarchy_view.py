@@ -0,0 +1,47 @@
+# app/hierarchy_view.py
+
+import streamlit as st
+from workbook_cache import workbook_cache
+from job_runner import JOB_STAGES
+from job_view import start_job, job_result
+
+def branch_label(path):
+    return ' > '.join(path) or '(whole model)'
+
+def branch_options(trees):
+    # Every branch of the given trees in outline order; branches only the later trees have come last
+    options = {}
+    for tree in trees:
+        if tree is not None:
+            for path in tree.preorder():
+                options.setdefault(path, None)
+    return list(options) or [()]
+
+def workbook_trees_job(*file_bytes_list):
+    return [df.attrs.get('hierarchy_tree') for df, _ in workbook_cache.get_processed_workbooks(*file_bytes_list)]
+
+def select_branch(key, selection, load_trees, *args):
+    # Optional "one branch only" scope. The trees need parsed workbooks, so they are read in a
+    # job (load_trees(*args) returns a list of HierarchyTree or None) only once the box is
+    # ticked. Returns the chosen branch's label path, () for the whole model.
+    if not st.checkbox("Limit to one hierarchy branch", key=f"{key}_enabled"):
+        return ()
+    stored = st.session_state.get(f"{key}_job")
+    if not stored or stored[0] != selection:
+        start_job(f"{key}_job", selection, "Reading the hierarchy", JOB_STAGES[:3], load_trees, *args)
+    trees = job_result(f"{key}_job", selection)
+    if trees is None:
+        return ()
+    if all(tree is None for tree in trees):
+        st.info("This model has no hierarchy tree to choose a branch from.")
+        return ()
+    branches = {branch_label(path): path for path in branch_options(trees)}
+    return branches[st.selectbox("Hierarchy branch", list(branches), key=f"{key}_path")]
+
+def render_change_rollup(rollup):
+    # Changes per hierarchy node, each node counting its whole branch
+    if rollup is None or rollup.empty:
+        return
+    st.subheader("Changes by Hierarchy Branch")
+    st.caption("Each branch counts the changes of every row under it.")
+    st.dataframe(rollup, hide_index=True, width=2000)
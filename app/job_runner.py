@@ -0,0 +1,110 @@
+# app/job_runner.py
+
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from diagnostics import diagnostics
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_STAGES = ['parse', 'hierarchy', 'identifiers', 'filter', 'diff']
+
+class JobCancelled(BaseException):
+    # A BaseException, like asyncio.CancelledError, so the broad `except Exception`
+    # handlers in the processing code let it through
+    pass
+
+class Job:
+    def __init__(self, job_id, description, stages, func, args):
+        self.id = job_id
+        self.description = description
+        self.stages = list(stages)
+        self.func = func
+        self.args = args
+        self.status = 'queued'
+        self.stage = None
+        self.details = {}
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._cancel_requested = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    @property
+    def fraction(self):
+        if self.status == 'done':
+            return 1.0
+        if self.stage not in self.stages:
+            return 0.0
+        return self.stages.index(self.stage) / len(self.stages)
+
+    def cancel(self):
+        # Takes effect at the next stage or progress update; a queued job never starts
+        self._cancel_requested.set()
+        if self.future is not None and self.future.cancel():
+            self._finish('cancelled')
+
+    def report(self, stage, details):
+        if self._cancel_requested.is_set():
+            raise JobCancelled()
+        if stage in self.stages:
+            self.stage = stage
+            self.details = details
+
+    def run(self):
+        if self._cancel_requested.is_set():
+            self._finish('cancelled')
+            return
+        self.started_at = time.time()
+        self.status = 'running'
+        try:
+            with diagnostics.listen(self.report):
+                self.result = self.func(*self.args)
+            self._finish('done')
+        except JobCancelled:
+            self._finish('cancelled')
+        except Exception as e:
+            logging.error(f"Job '{self.description}' failed: {str(e)}")
+            self.error = str(e)
+            self._finish('failed')
+
+    def _finish(self, status):
+        self.finished_at = time.time()
+        self.status = status
+
+class JobRunner:
+    # One bounded thread pool for the background jobs of every session; jobs beyond
+    # max_workers wait in submission order
+    def __init__(self, max_workers=JOB_WORKERS):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._ids = itertools.count(1)
+        self._active = []
+        self._lock = threading.Lock()
+
+    def submit(self, description, stages, func, *args):
+        with self._lock:
+            job = Job(next(self._ids), description, stages, func, args)
+            self._active = [active for active in self._active if not active.finished] + [job]
+            job.future = self._pool.submit(job.run)
+        return job
+
+    def queue_position(self, job):
+        # Number of queued jobs submitted before this one
+        with self._lock:
+            return sum(1 for active in self._active if active.status == 'queued' and active.id < job.id)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._active]
+        return {'running': statuses.count('running'), 'queued': statuses.count('queued'), 'workers': self.max_workers}
+
+job_runner = JobRunner()
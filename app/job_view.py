@@ -0,0 +1,53 @@
+# app/job_view.py
+
+import time
+import streamlit as st
+from job_runner import job_runner
+
+POLL_SECONDS = 0.25
+
+def start_job(state_key, selection, description, stages, func, *args):
+    # Replaces (and cancels) the job this widget started before
+    stored = st.session_state.get(state_key)
+    if stored and not stored[1].finished:
+        stored[1].cancel()
+    st.session_state[state_key] = (selection, job_runner.submit(description, stages, func, *args))
+
+def job_result(state_key, selection):
+    # Returns the result of the job started for selection, or None while it runs. The job
+    # lives in session state, so a rerun from any widget re-attaches to it here.
+    stored = st.session_state.get(state_key)
+    if not stored or stored[0] != selection:
+        return None
+    job = stored[1]
+    if not job.finished:
+        job_progress(state_key, job)
+        return None
+    if job.status == 'failed':
+        st.error(f"{job.description} failed: {job.error}")
+        return None
+    if job.status == 'cancelled':
+        st.info(f"{job.description} was cancelled.")
+        return None
+    return job.result
+
+@st.fragment(run_every=POLL_SECONDS)
+def job_progress(state_key, job):
+    # Only this fragment reruns while the job is in progress, so the rest of the page (and
+    # every other tab) stays responsive; once the job ends the whole page reruns to show it
+    if job.finished:
+        st.rerun()
+    st.progress(job.fraction, text=progress_text(job))
+    if st.button("Cancel", key=f"{state_key}_cancel"):
+        job.cancel()
+
+def progress_text(job):
+    if job.status == 'queued':
+        return f"{job.description}: waiting for a free worker ({job_runner.queue_position(job)} ahead)"
+    if job.stage is None:
+        return f"{job.description}: starting"
+    step = f"{job.stages.index(job.stage) + 1}/{len(job.stages)}"
+    rows = job.details.get('rows')
+    pairs = job.details.get('pairs')
+    detail = f", {rows:,} rows" if rows else f", {pairs:,} pairs" if pairs else ""
+    return f"{job.description}: {job.stage} ({step}{detail}), {time.time() - job.started_at:.0f}s"
@@ -4,19 +4,34 @@ import streamlit as st
 from transaction_processor import transaction_processor
 from transaction_diff_checker import transaction_diff_checker
 from single_file_transaction_diff_checker import single_file_transaction_diff_checker
+from model_query import model_query
+from diagnostics import diagnostics
+from diagnostics_panel import render_diagnostics_panel
 
-st.set_page_config(layout="wide")
+def main():
+    st.set_page_config(layout="wide")
 
-st.title("Excel Transaction Processor")
+    st.title("Excel Transaction Processor")
 
-# Add tabs
-tab1, tab2, tab3 = st.tabs(["Transaction Processor", "Sheet Diff Checker", "Transaction Diff Checker"])
+    # Add tabs
+    tab1, tab2, tab3, tab4 = st.tabs(["Transaction Processor", "Sheet Diff Checker", "Transaction Diff Checker", "Model Query"])
 
-with tab1:
-    transaction_processor()
+    with tab1:
+        transaction_processor()
 
-with tab2:
-    transaction_diff_checker()
+    with tab2:
+        transaction_diff_checker()
 
-with tab3:
-    single_file_transaction_diff_checker()
+    with tab3:
+        single_file_transaction_diff_checker()
+
+    with tab4:
+        model_query()
+
+    if diagnostics.enabled:
+        render_diagnostics_panel()
+
+# Streamlit runs this script as __main__; parse and similarity workers are spawned and import
+# it again as __mp_main__, where the page must not be rendered
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# app/model_index.py
+
+import numpy as np
+import pandas as pd
+from diagnostics import diagnostics
+from row_fingerprints import cell_kind
+from utils import restore_numeric_values
+
+INDEX_COLUMNS = ['Unique_ID', 'Category', 'Variable', 'Transaction Type', 'Sub-column', 'Value']
+NO_TEXT = -1
+OTHER_VALUE = -2
+
+class ModelIndexCache:
+    # Holds the ModelIndex of one processed model in df.attrs, shared by every copy of the
+    # attrs like the other load-time indexes
+    def __init__(self):
+        self.index = None
+
+    def __deepcopy__(self, memo):
+        return self
+
+def model_index(df):
+    # The long-format index of a frame built by process_workbook, built on first use
+    cache = df.attrs.setdefault('model_index', ModelIndexCache())
+    if cache.index is None:
+        cache.index = ModelIndex(df)
+    return cache.index
+
+def text_matches(labels, pattern):
+    # Strings are case-insensitive substring filters and lists are exact value sets, as in
+    # table_view.filter_table; returns a mask over labels
+    labels = pd.Index(labels, dtype=object)
+    if isinstance(pattern, str):
+        return np.asarray(labels.astype(str).str.contains(pattern, case=False, regex=False), dtype=bool)
+    return labels.isin(list(pattern))
+
+class ModelIndex:
+    # Every populated cell of every transaction type as one row of a long table, stored as
+    # parallel code arrays in sheet row order; queries filter the codes, never extract a type
+    def __init__(self, df):
+        with diagnostics.stage('index') as record:
+            row_keys = df.attrs['row_keys']
+            column_index = df.attrs['column_index']
+            numeric_columns = df.attrs.get('numeric_columns', {})
+            self.unique_ids = np.asarray(df.index, dtype=object)
+            self.category = row_keys.category
+            self.variable = row_keys.variable
+            self.transaction_types = sorted(column_index)
+            sub_column_codes = {}
+            parts = []
+            for type_code, transaction_type in enumerate(self.transaction_types):
+                diagnostics.progress('index', transaction_types=type_code)
+                for position, label in zip(*column_index[transaction_type]):
+                    rows, kinds, numbers, objects = column_cells(df.iloc[:, position].to_numpy(), position in numeric_columns,
+                                                                 numeric_columns.get(position))
+                    keep = row_keys.has_variable[rows]
+                    sub_column_code = sub_column_codes.setdefault(label, len(sub_column_codes))
+                    parts.append((rows[keep], type_code, sub_column_code, kinds[keep], numbers[keep], objects[keep]))
+            self.sub_columns = list(sub_column_codes)
+            self._store(parts)
+            record.update(rows=len(row_keys), cells=len(self.rows), transaction_types=len(self.transaction_types))
+
+    def _store(self, parts):
+        sizes = [len(part[0]) for part in parts]
+
+        def combined(field, dtype):
+            if not parts:
+                return np.zeros(0, dtype=dtype)
+            if np.ndim(parts[0][field]) == 0:
+                return np.repeat([part[field] for part in parts], sizes).astype(dtype)
+            return np.concatenate([part[field] for part in parts]).astype(dtype, copy=False)
+        order = np.argsort(combined(0, np.int32), kind='stable')
+        self.rows = combined(0, np.int32)[order]
+        self.type_codes = combined(1, np.int16)[order]
+        self.sub_column_codes = combined(2, np.int16)[order]
+        kinds = combined(3, np.int8)[order]
+        self.numbers = combined(4, np.float64)[order]
+        objects = combined(5, object)[order]
+        # Distinct texts are kept once and cells refer to them by code; the rare values that
+        # are neither numbers float64 holds nor text (dates, booleans, huge ints) are kept aside
+        self.text_codes = np.full(len(kinds), NO_TEXT, dtype=np.int32)
+        is_text = kinds == 2
+        codes, texts = pd.factorize(objects[is_text])
+        self.text_codes[is_text] = codes
+        self.texts = np.asarray(texts, dtype=object)
+        other = np.flatnonzero(kinds == 3)
+        self.text_codes[other] = OTHER_VALUE
+        self.others = dict(zip(other.tolist(), objects[other]))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def mask(self, category=None, variable=None, transaction_types=None, sub_columns=None, value=None):
+        mask = np.ones(len(self.rows), dtype=bool)
+        if category:
+            mask &= text_matches(self.category.categories, category)[self.category.codes][self.rows]
+        if variable:
+            # Rows without a Variable have code -1, which picks the appended False
+            matches = np.append(text_matches(self.variable.categories, variable), False)
+            mask &= matches[self.variable.codes][self.rows]
+        if transaction_types:
+            mask &= text_matches(self.transaction_types, transaction_types)[self.type_codes]
+        if sub_columns:
+            mask &= text_matches(self.sub_columns, sub_columns)[self.sub_column_codes]
+        if value not in (None, ''):
+            mask &= self.value_mask(value)
+        return mask
+
+    def value_mask(self, value):
+        # A number matches cells holding that number; any text is also matched as a
+        # case-insensitive substring of text cells
+        value = str(value).strip()
+        # NO_TEXT and OTHER_VALUE codes index the two appended False entries
+        matches = np.append(text_matches(self.texts, value), [False, False])[self.text_codes]
+        try:
+            number = float(value)
+        except ValueError:
+            return matches
+        return matches | (self.numbers == number)
+
+    def query(self, limit=None, **filters):
+        # Long-format cells matching the filters (see mask), in sheet row order
+        cells = np.flatnonzero(self.mask(**filters))
+        if limit is not None:
+            cells = cells[:limit]
+        return self.frame(cells)
+
+    def frame(self, cells):
+        rows = self.rows[cells]
+        return pd.DataFrame({
+            'Unique_ID': self.unique_ids[rows],
+            'Category': np.asarray(self.category[rows], dtype=object),
+            'Variable': np.asarray(self.variable[rows], dtype=object),
+            'Transaction Type': np.asarray(self.transaction_types, dtype=object)[self.type_codes[cells]],
+            'Sub-column': np.asarray(self.sub_columns, dtype=object)[self.sub_column_codes[cells]],
+            'Value': self.values(cells),
+        }, columns=INDEX_COLUMNS)
+
+    def values(self, cells):
+        text_codes = self.text_codes[cells]
+        values = restore_numeric_values(self.numbers[cells])
+        is_text = text_codes >= 0
+        values[is_text] = self.texts[text_codes[is_text]]
+        for i in np.flatnonzero(text_codes == OTHER_VALUE):
+            values[i] = self.others[cells[i]]
+        return values
+
+    def type_summary(self, **filters):
+        # Per transaction type, the number of matching cells and of distinct rows holding them
+        cells = np.flatnonzero(self.mask(**filters))
+        summary = pd.DataFrame({'type': self.type_codes[cells], 'row': self.rows[cells]}).groupby('type').agg(
+            Cells=('row', 'size'), Rows=('row', 'nunique'))
+        summary.insert(0, 'Transaction Type', np.asarray(self.transaction_types, dtype=object)[summary.index])
+        return summary.sort_values(['Cells', 'Transaction Type'], ascending=[False, True]).reset_index(drop=True)
+
+    def row_cells(self, unique_id):
+        # Every populated cell of the rows with this Unique_ID, across all types
+        positions = np.flatnonzero(self.unique_ids == unique_id)
+        starts = np.searchsorted(self.rows, positions, side='left')
+        stops = np.searchsorted(self.rows, positions, side='right')
+        cells = np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)]) if len(positions) else np.zeros(0, dtype=np.intp)
+        return self.frame(cells)
+
+def column_cells(values, numeric, header):
+    # Row positions of a column's populated cells with their cell_kind, their value as a
+    # float (NaN unless a number) and as an object (None for numbers)
+    if numeric:
+        rows = np.flatnonzero(~np.isnan(values))
+        kinds = np.ones(len(rows), dtype=np.int8)
+        numbers = values[rows]
+        objects = np.full(len(rows), None, dtype=object)
+        header_kind = cell_kind(header)
+        if header_kind == 0:
+            return rows, kinds, numbers, objects
+        # The first row of a compacted column holds its sub-column label
+        return (np.concatenate([[0], rows]), np.concatenate([[header_kind], kinds]).astype(np.int8),
+                np.concatenate([[float(header) if header_kind == 1 else np.nan], numbers]),
+                np.concatenate([np.array([None if header_kind == 1 else header], dtype=object), objects]))
+    values = np.asarray(values, dtype=object)
+    candidates = np.flatnonzero(~pd.isna(values))
+    kinds = np.fromiter((cell_kind(v) for v in values[candidates]), dtype=np.int8, count=len(candidates))
+    populated = kinds != 0
+    rows = candidates[populated]
+    kinds = kinds[populated]
+    objects = values[rows]
+    numbers = np.full(len(rows), np.nan)
+    numbers[kinds == 1] = objects[kinds == 1].astype(np.float64)
+    objects[kinds == 1] = None
+    return rows, kinds, numbers, objects
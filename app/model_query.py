@@ -0,0 +1,65 @@
+# app/model_query.py
+
+import streamlit as st
+from workbook_cache import workbook_cache
+from upload_store import persist_upload, workbook_uploader
+from model_index import model_index
+from table_view import render_paginated_table
+from job_runner import JOB_STAGES
+from job_view import start_job, job_result
+
+QUERY_RESULT_LIMIT = 200000
+
+def build_index_job(file_bytes):
+    df, _ = workbook_cache.get_processed_workbook(file_bytes)
+    if df.empty:
+        raise ValueError("No 'Trn Model' data could be processed from this workbook")
+    return model_index(df)
+
+def model_query():
+    st.header("Model Query")
+
+    uploaded_file = workbook_uploader("Choose an Excel file", "query_uploader")
+
+    if uploaded_file is not None:
+        file_bytes = persist_upload(uploaded_file)
+        workbook_cache.prefetch(file_bytes)
+
+        # The index is built once per workbook and kept with the cached model
+        selection = workbook_cache.key_for(file_bytes)
+        stored = st.session_state.get("model_query_job")
+        if not stored or stored[0] != selection:
+            start_job("model_query_job", selection, "Indexing all transaction types", JOB_STAGES[:3] + ['index'],
+                      build_index_job, file_bytes)
+        index = job_result("model_query_job", selection)
+        if index is None:
+            return
+        st.caption(f"{len(index):,} populated cells across {len(index.transaction_types)} transaction types")
+
+        col1, col2, col3 = st.columns(3)
+        category = col1.text_input("Category contains", key="query_category")
+        variable = col2.text_input("Variable contains", key="query_variable")
+        value = col3.text_input("Value (number, or text the cell contains)", key="query_value")
+        col1, col2 = st.columns(2)
+        transaction_types = col1.multiselect("Transaction Types (default: all)", index.transaction_types, key="query_types")
+        sub_columns = col2.multiselect("Non-empty sub-columns (default: any)", index.sub_columns, key="query_sub_columns")
+
+        filters = dict(category=category.strip(), variable=variable.strip(), transaction_types=transaction_types,
+                       sub_columns=sub_columns, value=value.strip())
+        if not any(filters.values()):
+            st.info("Set at least one filter to search the model.")
+            return
+
+        summary = index.type_summary(**filters)
+        st.subheader(f"Matching Transaction Types ({len(summary)})")
+        st.dataframe(summary, hide_index=True, width=2000)
+
+        st.subheader("Matching Cells")
+        cells = summary['Cells'].sum()
+        if cells > QUERY_RESULT_LIMIT:
+            st.caption(f"Showing the first {QUERY_RESULT_LIMIT:,} of {cells:,} matching cells; narrow the filters to see the rest.")
+        render_paginated_table(index.query(limit=QUERY_RESULT_LIMIT, **filters), "query_results",
+                               export_name="model_query.txt")
+
+if __name__ == "__main__":
+    model_query()
@@ -0,0 +1,142 @@
+# app/result_export.py
+
+import math
+import os
+import re
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles import Font, PatternFill
+from diagnostics import diagnostics
+from diff_engine import CHANGE_FILL_COLOURS, cell_change_codes
+
+EXPORT_FORMATS = ['xlsx', 'csv', 'parquet']
+EXPORT_MIME_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+EXPORT_CHUNK_ROWS = 10000
+XLSX_MAX_ROWS = 1048576
+
+def chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+def chunk_bounds(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(df), chunk_rows):
+        yield start, min(start + chunk_rows, len(df))
+
+def excel_value(value):
+    # Blanks become empty cells; text loses the control characters xlsx cannot store
+    if isinstance(value, str):
+        return ILLEGAL_CHARACTERS_RE.sub('', value)
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, (int, float, np.integer, np.floating, bool, np.bool_)):
+        return value
+    return str(value)
+
+def sheet_title(name):
+    return re.sub(r'[\[\]:*?/\\]', '_', str(name))[:31] or 'Sheet'
+
+def header_cells(sheet, columns):
+    cells = []
+    for column in columns:
+        cell = WriteOnlyCell(sheet, value=excel_value(column))
+        cell.font = Font(bold=True)
+        cells.append(cell)
+    return cells
+
+def check_xlsx_rows(df):
+    if len(df) + 1 > XLSX_MAX_ROWS:
+        raise ValueError(f"{len(df)} rows do not fit in an xlsx sheet; export as CSV or Parquet instead")
+
+def write_xlsx_sheet(workbook, title, df, codes=None):
+    # codes, if given, maps a (start, stop) row range to its cell_change_codes; changed cells
+    # are filled with the diff highlight colours and the rest are written as plain values
+    sheet = workbook.create_sheet(sheet_title(title))
+    sheet.append(header_cells(sheet, df.columns))
+    fills = [None] + [PatternFill(fill_type='solid', start_color=colour, end_color=colour) for colour in CHANGE_FILL_COLOURS[1:]]
+    for start, stop in chunk_bounds(df):
+        values = df.iloc[start:stop].to_numpy(dtype=object)
+        chunk_codes = codes(start, stop) if codes is not None else None
+        for row_position, row in enumerate(values):
+            cells = [excel_value(value) for value in row]
+            if chunk_codes is not None:
+                for column_position in np.flatnonzero(chunk_codes[row_position]):
+                    cell = WriteOnlyCell(sheet, value=cells[column_position])
+                    cell.fill = fills[chunk_codes[row_position, column_position]]
+                    cells[column_position] = cell
+            sheet.append(cells)
+
+def write_xlsx(df, path, sheet_name='Sheet'):
+    check_xlsx_rows(df)
+    workbook = Workbook(write_only=True)
+    write_xlsx_sheet(workbook, sheet_name, df)
+    workbook.save(path)
+
+def write_csv(df, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for position, chunk in enumerate(chunks(df)):
+            chunk.to_csv(f, index=False, header=position == 0)
+        if len(df) == 0:
+            df.to_csv(f, index=False)
+
+def parquet_chunk(chunk):
+    # Sheet columns mix numbers and text, which Parquet cannot store in one column
+    chunk = chunk.copy()
+    for column in chunk.columns[chunk.dtypes == object]:
+        chunk[column] = chunk[column].astype('string')
+    return chunk
+
+def write_parquet(df, path):
+    first = parquet_chunk(df.iloc[:EXPORT_CHUNK_ROWS])
+    schema = pa.Schema.from_pandas(first, preserve_index=False)
+    with pq.ParquetWriter(path, schema) as writer:
+        writer.write_table(pa.Table.from_pandas(first, schema=schema, preserve_index=False))
+        for chunk in chunks(df.iloc[EXPORT_CHUNK_ROWS:]):
+            writer.write_table(pa.Table.from_pandas(parquet_chunk(chunk), schema=schema, preserve_index=False))
+
+def write_table(df, path, output_format, sheet_name='Sheet'):
+    # Writes df chunk by chunk, so the output is never built in memory as a whole
+    with diagnostics.stage('export', format=output_format, rows=len(df), columns=df.shape[1]):
+        if output_format == 'xlsx':
+            write_xlsx(df, path, sheet_name)
+        elif output_format == 'parquet':
+            write_parquet(df, path)
+        else:
+            write_csv(df, path)
+
+def write_highlighted_diff(diff_df1, diff_df2, path, label1, label2):
+    # One sheet per side, cells filled like the on-screen highlight_differences styles
+    with diagnostics.stage('export', format='xlsx', rows=len(diff_df1), columns=diff_df1.shape[1]):
+        check_xlsx_rows(diff_df1)
+        aligned_df2 = diff_df2.reindex(index=diff_df1.index, columns=diff_df1.columns)
+
+        def codes(start, stop):
+            return cell_change_codes(diff_df1.iloc[start:stop].to_numpy(dtype=object),
+                                     aligned_df2.iloc[start:stop].to_numpy(dtype=object))
+        workbook = Workbook(write_only=True)
+        write_xlsx_sheet(workbook, label1, diff_df1, codes)
+        write_xlsx_sheet(workbook, label2 if sheet_title(label2) != sheet_title(label1) else f"{sheet_title(label2)[:27]} (2)", aligned_df2, codes)
+        workbook.save(path)
+
+def export_bytes(write):
+    # Runs write(path) into a temporary file and returns its contents, for download buttons
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'export')
+        write(path)
+        with open(path, 'rb') as f:
+            return f.read()
+
+def table_bytes(df, output_format, sheet_name='Sheet'):
+    return export_bytes(lambda path: write_table(df, path, output_format, sheet_name))
+
+def highlighted_diff_bytes(diff_df1, diff_df2, label1, label2):
+    return export_bytes(lambda path: write_highlighted_diff(diff_df1, diff_df2, path, label1, label2))
@@ -0,0 +1,147 @@
+# app/row_fingerprints.py
+
+import numpy as np
+import pandas as pd
+from utils import MAX_EXACT_FLOAT_INT, is_blank, is_blank_text, transaction_columns
+
+MISSING_HASH = np.uint64(0)
+NUMBER_HASH_TAG = np.uint64(0x85EBCA77C2B2AE63)
+TEXT_HASH_TAG = np.uint64(0x9E3779B97F4A7C15)
+OTHER_HASH_TAG = np.uint64(0xC2B2AE3D27D4EB4F)
+ROW_HASH_MULTIPLIER = np.uint64(0x100000001B3)
+
+class FingerprintCache(dict):
+    # Per transaction type fingerprints of one processed model, filled on first use and
+    # shared by every copy of df.attrs like the other load-time indexes
+    def __deepcopy__(self, memo):
+        return self
+
+class TransactionFingerprint:
+    def __init__(self, labels, rows, hashes, unique_ids):
+        self.labels = labels
+        self.rows = rows
+        self.hashes = hashes
+        self.unique_ids = unique_ids
+        self.unique = unique_ids.is_unique
+
+    def subset(self, rows):
+        # The fingerprint limited to the given row positions
+        keep = np.isin(self.rows, rows)
+        return TransactionFingerprint(self.labels, self.rows[keep], self.hashes[keep], self.unique_ids[keep])
+
+def cell_hashes(values):
+    # Cells equal under the diff's comparison hash equal: blanks and NaN share one hash,
+    # ints and floats of the same value share one. Each kind is tagged so 0 or '' never hash
+    # like a blank and text never hashes like a number.
+    if values.dtype.kind in 'biuf':
+        numbers = values.astype(np.float64)
+        hashes = pd.util.hash_array(numbers) ^ NUMBER_HASH_TAG
+        hashes[np.isnan(numbers)] = MISSING_HASH
+        return hashes
+
+    values = np.asarray(values, dtype=object)
+    kinds = np.fromiter((cell_kind(v) for v in values), dtype=np.int8, count=len(values))
+    hashes = np.full(len(values), MISSING_HASH, dtype=np.uint64)
+    numeric = kinds == 1
+    if numeric.any():
+        hashes[numeric] = pd.util.hash_array(values[numeric].astype(np.float64)) ^ NUMBER_HASH_TAG
+    text = kinds == 2
+    if text.any():
+        hashes[text] = pd.util.hash_array(values[text]) ^ TEXT_HASH_TAG
+    other = kinds == 3
+    if other.any():
+        described = np.array([f"{type(v).__name__}:{v!r}" for v in values[other]], dtype=object)
+        hashes[other] = pd.util.hash_array(described) ^ OTHER_HASH_TAG
+    return hashes
+
+def cell_kind(value):
+    # 0 = blank, 1 = number float64 holds exactly, 2 = text, 3 = anything else
+    if isinstance(value, str):
+        return 0 if is_blank_text(value) else 2
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        if value != value:
+            return 0
+        return 1 if isinstance(value, (float, np.floating)) or abs(value) <= MAX_EXACT_FLOAT_INT else 3
+    return 0 if pd.isna(value) else 3
+
+def transaction_fingerprint(df, transaction_type):
+    # Returns the fingerprint of each row process_transaction_data keeps for this type, or
+    # None for frames that were not built by process_workbook
+    row_keys = df.attrs.get('row_keys')
+    if row_keys is None or len(row_keys) != len(df):
+        return None
+    cache = df.attrs.setdefault('row_fingerprints', FingerprintCache())
+    fingerprint = cache.get(transaction_type)
+    if fingerprint is None:
+        fingerprint = cache[transaction_type] = compute_fingerprint(df, transaction_type, row_keys)
+    return fingerprint
+
+def column_hashes(df, position, rows=None):
+    # cell_hashes of one column of a processed frame, for all rows or the given row positions
+    values = df.iloc[:, position].to_numpy()
+    hashes = cell_hashes(values if rows is None else values[rows])
+    numeric_columns = df.attrs.get('numeric_columns', {})
+    first = 0 if rows is None else np.flatnonzero(np.asarray(rows) == 0)[:1]
+    if position in numeric_columns and len(hashes) and (rows is None or len(first)):
+        # Compacted columns keep their first-row label aside
+        header = numeric_columns[position]
+        if not is_blank(header):
+            hashes[first] = cell_hashes(np.array([header], dtype=object))[0]
+    return hashes
+
+def cell_hash_matrix(df, transaction_type, rows):
+    # The cell hashes of the given rows of a type, one column per sub-column
+    positions, _ = transaction_columns(df, transaction_type)
+    matrix = np.zeros((len(rows), len(positions)), dtype=np.uint64)
+    for i, position in enumerate(positions):
+        matrix[:, i] = column_hashes(df, position, rows)
+    return matrix
+
+def column_values(df, position, rows):
+    # The cells of one column at the given row positions, as extraction sees them
+    values = df.iloc[:, position].to_numpy()[rows]
+    header = df.attrs.get('numeric_columns', {}).get(position)
+    first = np.flatnonzero(np.asarray(rows) == 0)
+    if len(first) and not is_blank(header):
+        values = values.astype(object)
+        values[first] = header
+    return values
+
+def blank_cells(values):
+    blank = np.asarray(pd.isna(values), dtype=bool)
+    if values.dtype == object:
+        blank |= np.fromiter((is_blank_text(v) for v in values), dtype=bool, count=len(values))
+    return blank
+
+def cells_equal(values1, values2):
+    # The diff's equality: blanks and NaN are all the same empty cell, anything else compares with ==
+    blank1 = blank_cells(values1)
+    blank2 = blank_cells(values2)
+    equal = blank1 & blank2
+    both = ~blank1 & ~blank2
+    if values1.dtype != values2.dtype:
+        values1, values2 = values1.astype(object), values2.astype(object)
+    equal[both] = np.asarray(values1[both] == values2[both], dtype=bool)
+    return equal
+
+def rows_equal(df1, transaction_type1, rows1, df2, transaction_type2, rows2):
+    # Confirms fingerprint matches cell by cell, so a hash collision can never hide a change;
+    # the two types must have the same sub-column labels in the same order
+    positions1, _ = transaction_columns(df1, transaction_type1)
+    positions2, _ = transaction_columns(df2, transaction_type2)
+    equal = np.ones(len(rows1), dtype=bool)
+    for position1, position2 in zip(positions1, positions2):
+        equal &= cells_equal(column_values(df1, position1, rows1), column_values(df2, position2, rows2))
+    return equal
+
+def compute_fingerprint(df, transaction_type, row_keys):
+    positions, labels = transaction_columns(df, transaction_type)
+    row_hashes = np.zeros(len(df), dtype=np.uint64)
+    populated = np.zeros(len(df), dtype=bool)
+    for position in positions:
+        hashes = column_hashes(df, position)
+        populated |= hashes != MISSING_HASH
+        row_hashes = row_hashes * ROW_HASH_MULTIPLIER + hashes
+    rows = np.flatnonzero(populated & row_keys.has_variable)
+    unique_ids = pd.Index(np.asarray(df.index[rows], dtype=object), dtype=object)
+    return TransactionFingerprint(list(labels), rows, row_hashes[rows], unique_ids)
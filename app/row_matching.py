@@ -0,0 +1,116 @@
+# app/row_matching.py
+
+from collections import defaultdict, deque
+import numpy as np
+import pandas as pd
+from diagnostics import diagnostics
+from row_fingerprints import MISSING_HASH, cell_hash_matrix
+
+MOVED = 'Moved'
+# Unmatched rows are paired as moved when at least this share of their populated cells agree
+MOVE_SIMILARITY_THRESHOLD = 0.5
+# ... and at least this many of them are equal, so sparse rows do not pair by coincidence
+MOVE_MIN_EQUAL_CELLS = 2
+# Similarity is only scored among rows with the same Variable, and only for Variables with at
+# most this many unmatched rows on each side, so the pass stays linear in the unmatched rows
+MOVE_CANDIDATES = 64
+
+class MovedRows(dict):
+    # Maps the Unique_ID of a moved or renamed row in the second model to (its Unique_ID in the
+    # first model, Category, Variable, similarity). Kept in the diff frames' attrs and never
+    # mutated, so copies of the attrs share it.
+    def __deepcopy__(self, memo):
+        return self
+
+def match_moved_rows(df1, transaction_type1, fingerprint1, removed, df2, transaction_type2, fingerprint2, added):
+    # Pairs rows only the first model has (removed, positions in fingerprint1) with rows only
+    # the second has (added, positions in fingerprint2). A moved row or renamed label keeps its
+    # Variable, and a renamed Variable keeps its Category, so rows with the same content are
+    # paired by hash within a Variable in sheet order, then within a Category where that
+    # content occurs once on each side. The rest are paired by the share of equal cells within
+    # a Variable, best pairs first. Returns (positions1, positions2, similarity) arrays.
+    with diagnostics.stage('diff', step='match', removed=len(removed), added=len(added)) as record:
+        row_keys1 = df1.attrs['row_keys']
+        row_keys2 = df2.attrs['row_keys']
+        rows1 = fingerprint1.rows[removed]
+        rows2 = fingerprint2.rows[added]
+        variables1 = np.asarray(row_keys1.variable[rows1], dtype=object)
+        variables2 = np.asarray(row_keys2.variable[rows2], dtype=object)
+        hashes1 = fingerprint1.hashes[removed]
+        hashes2 = fingerprint2.hashes[added]
+        matrix1 = cell_hash_matrix(df1, transaction_type1, rows1)
+        matrix2 = cell_hash_matrix(df2, transaction_type2, rows2)
+        pairs = []
+        same_content(pairs, variables1, hashes1, variables2, hashes2)
+        # Across Variables a match on one or two cells is too likely to be chance
+        categories1 = np.asarray(row_keys1.category[rows1], dtype=object)
+        categories2 = np.asarray(row_keys2.category[rows2], dtype=object)
+        categories1[(matrix1 != MISSING_HASH).sum(axis=1) < MOVE_MIN_EQUAL_CELLS] = None
+        categories2[(matrix2 != MISSING_HASH).sum(axis=1) < MOVE_MIN_EQUAL_CELLS] = None
+        same_content(pairs, categories1, hashes1, categories2, hashes2, unique=True)
+        record['same_content'] = len(pairs)
+
+        left1, left2 = unpaired(len(removed), len(added), pairs)
+        if len(left1) and len(left2):
+            matrix1 = matrix1[left1]
+            matrix2 = matrix2[left2]
+            codes, _ = pd.factorize(np.concatenate([variables1[left1], variables2[left2]]))
+            codes1, codes2 = codes[:len(left1)], codes[len(left1):]
+            groups1 = pd.Series(np.arange(len(left1))).groupby(codes1).indices
+            for code, members2 in pd.Series(np.arange(len(left2))).groupby(codes2).indices.items():
+                members1 = groups1.get(code)
+                if members1 is None or len(members1) > MOVE_CANDIDATES or len(members2) > MOVE_CANDIDATES:
+                    continue
+                for a, b, score in best_pairs(similarity(matrix1[members1], matrix2[members2])):
+                    pairs.append((left1[members1[a]], left2[members2[b]], score))
+        record.update(pairs=len(pairs))
+
+    pairs = np.array(pairs, dtype=object).reshape(-1, 3)
+    return (removed[pairs[:, 0].astype(np.intp)], added[pairs[:, 1].astype(np.intp)], pairs[:, 2].astype(np.float64))
+
+def same_content(pairs, groups1, hashes1, groups2, hashes2, unique=False):
+    # Adds (i, j, 1.0) for rows not yet paired whose group and content hash are equal; rows
+    # without a group are skipped. With unique, only for keys that a single unpaired row has
+    # on each side.
+    paired1 = {i for i, _, _ in pairs}
+    paired2 = {j for _, j, _ in pairs}
+    waiting = defaultdict(deque)
+    for i, key in enumerate(zip(groups1, hashes1)):
+        if i not in paired1 and key[0] is not None:
+            waiting[key].append(i)
+    candidates = defaultdict(list)
+    for j, key in enumerate(zip(groups2, hashes2)):
+        if j not in paired2 and key[0] is not None and key in waiting:
+            candidates[key].append(j)
+    for key, found in candidates.items():
+        if unique and (len(found) > 1 or len(waiting[key]) > 1):
+            continue
+        pairs.extend((i, j, 1.0) for i, j in zip(waiting[key], found))
+
+def unpaired(count1, count2, pairs):
+    paired1 = np.zeros(count1, dtype=bool)
+    paired2 = np.zeros(count2, dtype=bool)
+    for i, j, _ in pairs:
+        paired1[i] = paired2[j] = True
+    return np.flatnonzero(~paired1), np.flatnonzero(~paired2)
+
+def similarity(matrix1, matrix2):
+    # Equal populated cells over the cells populated in either row, for every pair of rows;
+    # 0 for pairs with fewer than MOVE_MIN_EQUAL_CELLS equal cells
+    populated1 = matrix1 != MISSING_HASH
+    populated2 = matrix2 != MISSING_HASH
+    equal = ((matrix1[:, None, :] == matrix2[None, :, :]) & populated1[:, None, :]).sum(axis=2)
+    union = populated1.sum(axis=1)[:, None] + populated2.sum(axis=1)[None, :] - equal
+    return np.where(equal >= MOVE_MIN_EQUAL_CELLS, equal / np.maximum(union, 1), 0.0)
+
+def best_pairs(scores):
+    # Greedy one-to-one pairing, highest similarity first, ties in sheet order
+    used1 = np.zeros(scores.shape[0], dtype=bool)
+    used2 = np.zeros(scores.shape[1], dtype=bool)
+    for flat in np.argsort(-scores, axis=None, kind='stable'):
+        a, b = divmod(int(flat), scores.shape[1])
+        if scores[a, b] < MOVE_SIMILARITY_THRESHOLD:
+            break
+        if not used1[a] and not used2[b]:
+            used1[a] = used2[b] = True
+            yield a, b, float(scores[a, b])
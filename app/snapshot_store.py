@@ -0,0 +1,320 @@
+# app/snapshot_store.py
+
+import datetime
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from diagnostics import diagnostics
+from utils import HierarchyTree, NumericColumns, RowKeys, TransactionColumnIndex, MAX_EXACT_FLOAT_INT
+
+SNAPSHOT_STORE_ROOT = os.environ.get('SNAPSHOT_STORE_ROOT', 'snapshots')
+SNAPSHOT_STORE_MAX_BYTES = int(os.environ.get('SNAPSHOT_STORE_MAX_BYTES', 10 * 1024 ** 3))
+SNAPSHOT_STORE_MAX_AGE_SECONDS = int(os.environ.get('SNAPSHOT_STORE_MAX_AGE_SECONDS', 400 * 24 * 3600))
+SNAPSHOT_STORE_MAX_VERSIONS = int(os.environ.get('SNAPSHOT_STORE_MAX_VERSIONS', 24))
+# Loaded snapshots kept open between reruns
+SNAPSHOT_CACHE_ENTRIES = 4
+
+FORMAT_VERSION = 2
+KIND_BLANK, KIND_INT, KIND_FLOAT, KIND_TEXT, KIND_OTHER = range(5)
+
+def object_column_arrays(values):
+    # Mixed sheet columns cannot be one Arrow type, so each is stored as a kind byte, a
+    # float for numbers and a dictionary-encoded text per cell. Values neither fits
+    # (dates, booleans, ints a float cannot hold) are returned separately by row.
+    kinds = np.zeros(len(values), dtype=np.int8)
+    numbers = np.full(len(values), np.nan)
+    texts = np.full(len(values), None, dtype=object)
+    others = {}
+    for row, value in enumerate(values):
+        if isinstance(value, str):
+            kinds[row] = KIND_TEXT
+            texts[row] = value
+        elif isinstance(value, (float, np.floating)):
+            if value == value:
+                kinds[row] = KIND_FLOAT
+                numbers[row] = value
+        elif isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)) and abs(value) <= MAX_EXACT_FLOAT_INT:
+            kinds[row] = KIND_INT
+            numbers[row] = value
+        elif value is not None and not (value is pd.NA or value is pd.NaT):
+            kinds[row] = KIND_OTHER
+            others[row] = value
+    return kinds, numbers, pa.array(texts, type=pa.large_string()).dictionary_encode(), others
+
+def json_value(value):
+    # Cells JSON has no type for (dates, times, durations) are written as {'type', 'value'};
+    # bools and ints of any size round-trip through JSON as they are
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return json_value(value.item())
+    if isinstance(value, pd.Timestamp):
+        return {'type': 'timestamp', 'value': value.isoformat()}
+    if isinstance(value, datetime.datetime):
+        return {'type': 'datetime', 'value': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'type': 'date', 'value': value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {'type': 'time', 'value': value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {'type': 'timedelta', 'value': [value.days, value.seconds, value.microseconds]}
+    raise TypeError(f"Cannot store a {type(value).__name__} cell in a snapshot")
+
+def cell_value(stored):
+    # Inverse of json_value
+    if not isinstance(stored, dict):
+        return stored
+    kind, value = stored['type'], stored['value']
+    if kind == 'timestamp':
+        return pd.Timestamp(value)
+    if kind == 'datetime':
+        return datetime.datetime.fromisoformat(value)
+    if kind == 'date':
+        return datetime.date.fromisoformat(value)
+    if kind == 'time':
+        return datetime.time.fromisoformat(value)
+    return datetime.timedelta(days=value[0], seconds=value[1], microseconds=value[2])
+
+def object_column_values(kinds, numbers, texts, others):
+    values = np.full(len(kinds), np.nan, dtype=object)
+    is_int = kinds == KIND_INT
+    values[is_int] = numbers[is_int].astype(np.int64).tolist()
+    is_float = kinds == KIND_FLOAT
+    values[is_float] = numbers[is_float].tolist()
+    is_text = kinds == KIND_TEXT
+    if is_text.any():
+        dictionary = np.asarray(texts.dictionary.to_pylist(), dtype=object)
+        indices = texts.indices.fill_null(0).to_numpy()
+        values[is_text] = dictionary[indices[is_text]]
+    for row, value in others.items():
+        values[row] = value
+    return values
+
+def frame_table(df):
+    # Returns the Arrow table of a processed frame and the values kept outside it. Number
+    # columns are stored as they are, so loading them from a memory map copies nothing.
+    arrays = {'index': pa.array(np.asarray(df.index, dtype=object), type=pa.large_string())}
+    encodings = []
+    others = {}
+    for position in range(df.shape[1]):
+        column = df.iloc[:, position]
+        if column.dtype == object:
+            kinds, numbers, texts, column_others = object_column_arrays(column.to_numpy())
+            arrays[f"{position}.kind"] = kinds
+            arrays[f"{position}.number"] = numbers
+            arrays[f"{position}.text"] = texts
+            if column_others:
+                others[position] = column_others
+            encodings.append('object')
+        elif column.dtype.kind in 'iuf':
+            # Kept as plain values, so NaN stays a float rather than becoming an Arrow null
+            arrays[str(position)] = pa.array(column.to_numpy(), from_pandas=False)
+            encodings.append('number')
+        else:
+            arrays[str(position)] = pa.array(column)
+            encodings.append('plain')
+    return pa.table(arrays), encodings, others
+
+def column_numpy(table, name):
+    # Zero-copy view of a single-chunk number column
+    column = table.column(name)
+    return column.chunk(0).to_numpy() if column.num_chunks == 1 else column.to_numpy()
+
+def table_frame(table, meta):
+    others = {int(position): {row: cell_value(value) for row, value in cells}
+              for position, cells in meta.get('others', {}).items()}
+    data = {}
+    for position, encoding in enumerate(meta['encodings']):
+        if encoding == 'object':
+            data[position] = object_column_values(
+                column_numpy(table, f"{position}.kind"), column_numpy(table, f"{position}.number"),
+                table.column(f"{position}.text").combine_chunks(), others.get(position, {}))
+        elif encoding == 'number':
+            data[position] = column_numpy(table, str(position))
+        else:
+            data[position] = table.column(str(position)).to_pandas()
+    df = pd.DataFrame(data, copy=False)
+    df.columns = meta['columns']
+    df.index = pd.Index(table.column('index').to_pandas(), name='Unique_ID')
+    column_index = TransactionColumnIndex()
+    for transaction_type, (positions, labels) in meta['column_index'].items():
+        column_index[transaction_type] = (positions, labels)
+    df.attrs['column_index'] = column_index
+    df.attrs['row_keys'] = RowKeys(df.index)
+    if meta['numeric_columns']:
+        df.attrs['numeric_columns'] = NumericColumns((int(position), cell_value(header)) for position, header in meta['numeric_columns'])
+    if meta.get('hierarchy_tree'):
+        df.attrs['hierarchy_tree'] = HierarchyTree(meta['hierarchy_tree']['paths'], meta['hierarchy_tree']['row_nodes'])
+    return df
+
+def hierarchy_tree_meta(tree):
+    if tree is None:
+        return None
+    return {'paths': [list(path) for path in tree.paths], 'row_nodes': tree.row_nodes.tolist()}
+
+def safe_name(name):
+    return re.sub(r'[^\w.-]+', '_', str(name)).strip('_') or 'snapshot'
+
+class SnapshotStore:
+    # Processed models saved as <root>/<name>/<version>/ with the frame as an uncompressed
+    # Arrow IPC file and its indexes, hierarchy, description and the cells Arrow does not
+    # hold (see object_column_arrays) in meta.json. Snapshots are
+    # shared by every session: they are the baselines the team diffs against. A name keeps
+    # at most max_versions versions; past max_bytes or max_age the least recently used
+    # versions are removed.
+    def __init__(self, root=SNAPSHOT_STORE_ROOT, max_bytes=SNAPSHOT_STORE_MAX_BYTES, max_age=SNAPSHOT_STORE_MAX_AGE_SECONDS,
+                 max_versions=SNAPSHOT_STORE_MAX_VERSIONS, cache_entries=SNAPSHOT_CACHE_ENTRIES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_versions = max_versions
+        self.cache_entries = cache_entries
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()
+
+    def _path(self, name, version, *filename):
+        return os.path.join(self.root, safe_name(name), version, *filename)
+
+    def save(self, name, df, hierarchy, source_name=None, content_key=None):
+        # Saving the same content under a name again only refreshes that version
+        name = safe_name(name)
+        for meta in self.versions(name):
+            if content_key is not None and meta.get('content_key') == content_key:
+                os.utime(self._path(name, meta['version'], 'meta.json'))
+                return meta
+        with diagnostics.stage('snapshot', step='save', rows=df.shape[0], columns=df.shape[1]) as record:
+            table, encodings, others = frame_table(df)
+            created_at = time.time()
+            # The random suffix keeps two saves in the same second apart, even of the same content
+            version = (time.strftime('%Y%m%d-%H%M%S', time.gmtime(created_at)) + (f"-{content_key[:8]}" if content_key else '')
+                       + f"-{uuid.uuid4().hex[:8]}")
+            meta = {
+                'format': FORMAT_VERSION,
+                'name': name,
+                'version': version,
+                'source_name': source_name,
+                'content_key': content_key,
+                'created_at': created_at,
+                'rows': df.shape[0],
+                'columns': [str(column) for column in df.columns],
+                'encodings': encodings,
+                'transaction_types': sorted(df.attrs.get('column_index', {})),
+                'column_index': {t: (list(map(int, positions)), list(labels)) for t, (positions, labels) in df.attrs.get('column_index', {}).items()},
+                'numeric_columns': [(int(position), json_value(header)) for position, header in df.attrs.get('numeric_columns', {}).items()],
+                'others': {str(position): [(row, json_value(value)) for row, value in cells.items()] for position, cells in others.items()},
+                'hierarchy': list(hierarchy),
+                'hierarchy_tree': hierarchy_tree_meta(df.attrs.get('hierarchy_tree')),
+            }
+            final_dir = self._path(name, version)
+            temp_dir = f"{final_dir}.{threading.get_ident()}.tmp"
+            os.makedirs(temp_dir, exist_ok=True)
+            with pa.OSFile(os.path.join(temp_dir, 'frame.arrow'), 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table, max_chunksize=max(len(table), 1))
+            meta['bytes'] = sum(entry.stat().st_size for entry in os.scandir(temp_dir))
+            with open(os.path.join(temp_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f, default=str)
+            os.replace(temp_dir, final_dir)
+            record.update(bytes=meta['bytes'])
+        self._evict(keep=(name, version))
+        return meta
+
+    def names(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(entry.name for entry in os.scandir(self.root) if entry.is_dir() and self.versions(entry.name))
+
+    def versions(self, name):
+        # Newest first; each is the snapshot's meta.json without the bulky hierarchy and index
+        name_dir = os.path.join(self.root, safe_name(name))
+        if not os.path.isdir(name_dir):
+            return []
+        found = []
+        for entry in os.scandir(name_dir):
+            meta_path = os.path.join(entry.path, 'meta.json')
+            if entry.is_dir() and not entry.name.endswith('.tmp') and os.path.exists(meta_path):
+                found.append(self._describe(meta_path))
+        return sorted(found, key=lambda meta: meta['created_at'], reverse=True)
+
+    def _describe(self, meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        for key in ('hierarchy', 'hierarchy_tree', 'column_index', 'numeric_columns', 'others', 'columns', 'encodings'):
+            meta.pop(key, None)
+        meta['last_used'] = os.path.getmtime(meta_path)
+        return meta
+
+    def load(self, name, version):
+        # Returns (df, hierarchy). Number columns are read-only views of the memory-mapped
+        # file; like the workbook cache, callers must not mutate the frame.
+        key = (safe_name(name), version)
+        with self._lock:
+            if key in self._loaded:
+                self._loaded.move_to_end(key)
+                return self._loaded[key]
+        with diagnostics.stage('snapshot', step='load', snapshot=key[0], version=version) as record:
+            with open(self._path(*key, 'meta.json')) as f:
+                meta = json.load(f)
+            if os.path.exists(self._path(*key, 'others.pkl')):
+                # Format 1 pickled these cells; unpickling a file from disk can run code
+                raise ValueError(f"Snapshot {key[0]} version {version} was stored in an older format; save it again")
+            os.utime(self._path(*key, 'meta.json'))
+            table = pa.ipc.open_file(pa.memory_map(self._path(*key, 'frame.arrow'))).read_all()
+            df = table_frame(table, meta)
+            record.update(rows=df.shape[0], columns=df.shape[1])
+        loaded = (df, meta['hierarchy'])
+        with self._lock:
+            self._loaded[key] = loaded
+            while len(self._loaded) > self.cache_entries:
+                self._loaded.popitem(last=False)
+        return loaded
+
+    def delete(self, name, version):
+        key = (safe_name(name), version)
+        with self._lock:
+            self._loaded.pop(key, None)
+            shutil.rmtree(self._path(*key), ignore_errors=True)
+            name_dir = os.path.join(self.root, key[0])
+            if os.path.isdir(name_dir) and not os.listdir(name_dir):
+                os.rmdir(name_dir)
+
+    def _evict(self, keep=None):
+        now = time.time()
+        snapshots = [meta for name in self.names() for meta in self.versions(name)]
+        removed = []
+        for name in {meta['name'] for meta in snapshots}:
+            removed.extend(meta for meta in self.versions(name)[self.max_versions:])
+        remaining = sorted((meta for meta in snapshots if meta not in removed), key=lambda meta: meta['last_used'])
+        total = sum(meta['bytes'] for meta in remaining)
+        for meta in remaining:
+            if total <= self.max_bytes and now - meta['last_used'] <= self.max_age:
+                break
+            if (meta['name'], meta['version']) == keep:
+                continue
+            removed.append(meta)
+            total -= meta['bytes']
+        for meta in removed:
+            self.delete(meta['name'], meta['version'])
+        if removed:
+            logging.info(f"Evicted {len(removed)} stored snapshots")
+
+    def stats(self):
+        snapshots = [meta for name in self.names() for meta in self.versions(name)]
+        return {
+            'snapshots': len(snapshots),
+            'bytes': sum(meta['bytes'] for meta in snapshots),
+            'loaded': len(self._loaded),
+            'max_bytes': self.max_bytes,
+            'max_versions': self.max_versions,
+        }
+
+snapshot_store = SnapshotStore()
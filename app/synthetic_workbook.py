@@ -0,0 +1,135 @@
+# app/synthetic_workbook.py
+
+import argparse
+import random
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment
+from utils import TRANSACTION_COLUMNS_START
+
+METADATA_COLUMNS = ['Line Item', 'Code', 'Description', 'Variable', 'Unit', 'Source', 'Owner', 'Notes']
+SUB_COLUMN_NAMES = ['Dr', 'Cr', 'Amount', 'Account', 'Rate', 'Basis', 'Memo', 'Flag']
+INDENT_PATTERNS = ['nested', 'random', 'flat']
+HIERARCHY_WORDS = ['Assets', 'Liabilities', 'Revenue', 'Expenses', 'Current', 'Non Current', 'Cash', 'Receivables',
+                   'Payables', 'Tax', 'Payroll', 'Accruals', 'Provisions', 'Inventory', 'Equity', 'Fees']
+
+class SyntheticModelSpec:
+    def __init__(self, rows=1000, depth=4, indent_pattern='nested', transaction_types=20, sub_columns=3,
+                 fill_ratio=0.35, edit_pct=1.0, seed=0):
+        self.rows = rows
+        self.depth = depth
+        self.indent_pattern = indent_pattern
+        self.transaction_types = transaction_types
+        self.sub_columns = sub_columns
+        self.fill_ratio = fill_ratio
+        self.edit_pct = edit_pct
+        self.seed = seed
+
+    def type_names(self):
+        return [f"Transaction {i:03d}" for i in range(self.transaction_types)]
+
+    def sub_column_names(self):
+        return [SUB_COLUMN_NAMES[i % len(SUB_COLUMN_NAMES)] + ('' if i < len(SUB_COLUMN_NAMES) else str(i))
+                for i in range(self.sub_columns)]
+
+def header_rows(spec):
+    header = list(METADATA_COLUMNS[:TRANSACTION_COLUMNS_START])
+    sub_header = [None] * TRANSACTION_COLUMNS_START
+    for type_name in spec.type_names():
+        for i, sub_column in enumerate(spec.sub_column_names()):
+            # Only the first column of a type is named; the rest come back as 'Unnamed: n'
+            header.append(type_name if i == 0 else None)
+            sub_header.append(sub_column)
+    return header, sub_header
+
+def random_value(rnd):
+    roll = rnd.random()
+    if roll < 0.5:
+        return rnd.randint(1, 9999)
+    if roll < 0.8:
+        return round(rnd.uniform(-1000, 1000), 2)
+    return rnd.choice(['GL100', 'GL200', 'Y', 'N', 'Pro rata', 'Fixed'])
+
+def next_indent(spec, rnd, indent):
+    if spec.indent_pattern == 'flat':
+        return 0
+    if spec.indent_pattern == 'random':
+        return rnd.randint(0, spec.depth - 1)
+    # nested: walk a tree, going one level deeper or back up to any ancestor
+    if indent < spec.depth - 1 and rnd.random() < 0.5:
+        return indent + 1
+    return rnd.randint(0, indent)
+
+def generate_rows(spec):
+    # Yields (column A indent, row values) for the original model and its edited copy
+    rnd = random.Random(spec.seed)
+    edit_rnd = random.Random(spec.seed + 1)
+    value_columns = spec.transaction_types * spec.sub_columns
+    indent = 0
+    variables_left = 0
+    for row_number in range(spec.rows):
+        metadata = [None] * TRANSACTION_COLUMNS_START
+        metadata[1] = row_number
+        if variables_left == 0:
+            # Hierarchy label row, followed by a run of variable rows under it
+            indent = next_indent(spec, rnd, indent)
+            metadata[0] = f"{rnd.choice(HIERARCHY_WORDS)} {row_number}"
+            variables_left = rnd.randint(1, 8)
+            values = [None] * value_columns
+        else:
+            metadata[3] = f"var_{row_number}"
+            metadata[2] = "Generated variable"
+            variables_left -= 1
+            values = [random_value(rnd) if rnd.random() < spec.fill_ratio else None for _ in range(value_columns)]
+
+        edited = list(values)
+        if metadata[3] is not None:
+            for i in range(value_columns):
+                if edit_rnd.random() * 100 < spec.edit_pct:
+                    edited[i] = None if edited[i] is not None and edit_rnd.random() < 0.3 else random_value(edit_rnd)
+        yield indent, metadata + values, metadata + edited
+
+def write_cells(sheet, values, indent=None):
+    cells = []
+    for position, value in enumerate(values):
+        cell = WriteOnlyCell(sheet, value=value)
+        if position == 0 and indent:
+            cell.alignment = Alignment(indent=indent)
+        cells.append(cell)
+    sheet.append(cells)
+
+def write_synthetic_models(spec, path, edited_path=None):
+    # Writes the model to path and, if edited_path is given, the edited version alongside it
+    workbooks = [Workbook(write_only=True)] + ([Workbook(write_only=True)] if edited_path else [])
+    sheets = [workbook.create_sheet('Trn Model') for workbook in workbooks]
+    header, sub_header = header_rows(spec)
+    for sheet in sheets:
+        sheet.append(header)
+        sheet.append(sub_header)
+    for indent, values, edited in generate_rows(spec):
+        write_cells(sheets[0], values, indent)
+        if edited_path:
+            write_cells(sheets[1], edited, indent)
+    workbooks[0].save(path)
+    if edited_path:
+        workbooks[1].save(edited_path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic 'Trn Model' workbook, optionally with an edited copy.")
+    parser.add_argument('path')
+    parser.add_argument('--edited-path')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--indent-pattern', choices=INDENT_PATTERNS, default='nested')
+    parser.add_argument('--transaction-types', type=int, default=20)
+    parser.add_argument('--sub-columns', type=int, default=3)
+    parser.add_argument('--fill-ratio', type=float, default=0.35)
+    parser.add_argument('--edit-pct', type=float, default=1.0, help="Percentage of value cells changed in the edited copy")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    spec = SyntheticModelSpec(args.rows, args.depth, args.indent_pattern, args.transaction_types, args.sub_columns,
+                              args.fill_ratio, args.edit_pct, args.seed)
+    write_synthetic_models(spec, args.path, args.edited_path)
+
+if __name__ == "__main__":
+    main()
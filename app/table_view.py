@@ -0,0 +1,78 @@
+# app/table_view.py
+
+import math
+import os
+import numpy as np
+import streamlit as st
+from diagnostics import diagnostics
+from result_export import EXPORT_FORMATS, EXPORT_MIME_TYPES, highlighted_diff_bytes, table_bytes
+
+PAGE_SIZES = [100, 500, 1000, 5000]
+SORTABLE_COLUMNS = ['Category', 'Variable', 'Change Type']
+
+def filter_table(df, filters):
+    # Substring filters for text inputs, membership filters for lists of allowed values
+    mask = np.ones(len(df), dtype=bool)
+    for column, value in filters.items():
+        if not value:
+            continue
+        if isinstance(value, list):
+            mask &= df[column].isin(value).to_numpy()
+        else:
+            mask &= df[column].astype(str).str.contains(value, case=False, regex=False, na=False).to_numpy()
+    return df[mask]
+
+def sort_table(df, sort_column, ascending=True):
+    if not sort_column:
+        return df
+    return df.sort_values(sort_column, ascending=ascending, kind='stable', na_position='last')
+
+def page_slice(df, page, page_size):
+    start = (page - 1) * page_size
+    return df.iloc[start:start + page_size]
+
+def render_paginated_table(df, key, export_text=None, export_name="table.txt"):
+    # Filters, sorting and paging run on the server; only the current page is sent to the browser
+    filter_columns = [column for column in ['Category', 'Variable'] if column in df.columns]
+    has_change_type = 'Change Type' in df.columns
+    controls = st.columns(len(filter_columns) + has_change_type + 1)
+    filters = {}
+    for control, column in zip(controls, filter_columns):
+        filters[column] = control.text_input(f"Filter {column}", key=f"{key}_filter_{column}")
+    if has_change_type:
+        change_types = sorted(df['Change Type'].dropna().unique())
+        filters['Change Type'] = controls[-2].multiselect("Change Type", change_types, key=f"{key}_filter_change_type")
+    sort_column = controls[-1].selectbox("Sort by", [""] + [column for column in SORTABLE_COLUMNS if column in df.columns],
+                                         key=f"{key}_sort")
+    ascending = controls[-1].checkbox("Ascending", value=True, key=f"{key}_ascending")
+
+    view = sort_table(filter_table(df, filters), sort_column, ascending)
+
+    page_controls = st.columns(3)
+    page_size = page_controls[0].selectbox("Rows per page", PAGE_SIZES, key=f"{key}_page_size")
+    pages = max(1, math.ceil(len(view) / page_size))
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    page = page_controls[1].number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=page_key)
+    page_controls[2].caption(f"{len(view)} of {len(df)} rows")
+
+    # Mixed numeric/text sheet columns are shown as text, like the tabulate output was
+    with diagnostics.stage('render', step='table', table=key, rows=len(view), page_rows=min(page_size, len(view))):
+        st.dataframe(page_slice(view, page, page_size).fillna('').astype(str), hide_index=True, width=2000)
+
+    # Exports cover every filtered row, not just the current page, and are only written on click
+    export_controls = st.columns(3)
+    basename = os.path.splitext(export_name)[0]
+    output_format = export_controls[0].selectbox("Export format", EXPORT_FORMATS, key=f"{key}_export_format")
+    export_controls[1].download_button(f"Download as {output_format}", data=lambda: table_bytes(view, output_format, basename),
+                                       file_name=f"{basename}.{output_format}", mime=EXPORT_MIME_TYPES[output_format],
+                                       key=f"{key}_export_file")
+    if export_text is not None:
+        export_controls[2].download_button("Download as text", data=export_text, file_name=export_name, mime="text/plain",
+                                           key=f"{key}_export_text")
+
+def render_diff_download(diff_df1, diff_df2, label1, label2, file_name, key):
+    # Both sides of the differences-only view, one sheet each, with the on-screen highlight colours
+    st.download_button("Download highlighted differences as xlsx", data=lambda: highlighted_diff_bytes(diff_df1, diff_df2, label1, label2),
+                       file_name=file_name, mime=EXPORT_MIME_TYPES['xlsx'], key=key)
@@ -1,126 +1,271 @@
 # app/transaction_diff_checker.py
 
 import streamlit as st
-import pandas as pd
-import numpy as np
 import os
-import logging
-from utils import load_transaction_types, process_excel_file, process_transaction_data
+import time
+from utils import branch_rows, process_transaction_data
+from workbook_cache import workbook_cache
+from snapshot_store import snapshot_store
+from upload_store import persist_upload, workbook_uploader
+from diff_engine import change_rollup, compare_models, generate_difference_explanation, highlight_differences
 from tabulate import tabulate
+from table_view import render_paginated_table, render_diff_download
+from version_timeline import VersionTimeline
+from job_runner import JOB_STAGES
+from job_view import start_job, job_result
+from hierarchy_view import branch_label, render_change_rollup, select_branch, workbook_trees_job
 
-def highlight_differences(df1, df2):
-    def style_cell(val1, val2):
-        if pd.isna(val1) and not pd.isna(val2):
-            return 'background-color: lightgreen'  # Added
-        elif not pd.isna(val1) and pd.isna(val2):
-            return 'background-color: lightcoral'  # Removed
-        elif not pd.isna(val1) and not pd.isna(val2) and val1 != val2:
-            return 'background-color: yellow'  # Changed
-        return ''
-
-    # Create a DataFrame of styles
-    styles = pd.DataFrame('', index=df1.index, columns=df1.columns)
-    
-    for col in df1.columns:
-        styles[col] = [style_cell(val1, val2) for val1, val2 in zip(df1[col], df2[col])]
-    
-    return styles
+def diff_models(df1, df2, transaction_type, branch=(), match_moved=False):
+    # Only rows whose fingerprints differ between the two models are extracted and compared,
+    # and with a branch only the rows under it
+    diff_df1, diff_df2 = compare_models(df1, transaction_type, df2, transaction_type,
+                                        branch_rows(df1, branch), branch_rows(df2, branch), match_moved)
 
-def generate_difference_explanation(df1, df2, type1, type2):
-    changes = []
-    
-    # Check for added or removed rows
-    df1_rows = set(df1.index)
-    df2_rows = set(df2.index)
-    added_rows = df2_rows - df1_rows
-    removed_rows = df1_rows - df2_rows
-    
-    for row in added_rows:
-        changes.append({
-            'Category': df2.loc[row, 'Category'],
-            'Variable': df2.loc[row, 'Variable'],
-            'Column': 'Entire Row',
-            'Change Type': 'Added',
-            'From': '',
-            'To': f"New row in {type2}"
-        })
-    
-    for row in removed_rows:
-        changes.append({
-            'Category': df1.loc[row, 'Category'],
-            'Variable': df1.loc[row, 'Variable'],
-            'Column': 'Entire Row',
-            'Change Type': 'Removed',
-            'From': f"Existing row in {type1}",
-            'To': ''
-        })
-    
-    # Check for changes in existing rows
-    common_rows = df1_rows.intersection(df2_rows)
-    for row in common_rows:
-        for col in df1.columns:
-            if col not in ['Category', 'Variable']:
-                val1 = df1.loc[row, col]
-                val2 = df2.loc[row, col]
-                if pd.isna(val1) and not pd.isna(val2):
-                    changes.append({
-                        'Category': df1.loc[row, 'Category'],
-                        'Variable': df1.loc[row, 'Variable'],
-                        'Column': col,
-                        'Change Type': 'Added',
-                        'From': 'NaN',
-                        'To': str(val2)
-                    })
-                elif not pd.isna(val1) and pd.isna(val2):
-                    changes.append({
-                        'Category': df1.loc[row, 'Category'],
-                        'Variable': df1.loc[row, 'Variable'],
-                        'Column': col,
-                        'Change Type': 'Removed',
-                        'From': str(val1),
-                        'To': 'NaN'
-                    })
-                elif not pd.isna(val1) and not pd.isna(val2) and val1 != val2:
-                    changes.append({
-                        'Category': df1.loc[row, 'Category'],
-                        'Variable': df1.loc[row, 'Variable'],
-                        'Column': col,
-                        'Change Type': 'Changed',
-                        'From': str(val1),
-                        'To': str(val2)
-                    })
-    
-    changes_df = pd.DataFrame(changes)
-    
-    # Order the changes_df
-    changes_df['Change Order'] = changes_df['Change Type'].map({'Removed': 1, 'Changed': 2, 'Added': 3})
-    changes_df.sort_values(by=['Change Order', 'Category', 'Variable'], inplace=True)
-    changes_df.drop(columns=['Change Order'], inplace=True)
-    
-    return changes_df
+    # Generate explanation of differences
+    changes_df = generate_difference_explanation(diff_df1, diff_df2, "Sheet 1", "Sheet 2")
+    rollup = change_rollup(changes_df, df1, df2, branch)
+
+    # Reset index to remove Unique_ID completely
+    return changes_df, diff_df1.reset_index(drop=True), diff_df2.reset_index(drop=True), rollup
+
+def sheet_diff_job(file_bytes1, file_bytes2, transaction_type, branch=(), match_moved=False):
+    (df1, _), (df2, _) = workbook_cache.get_processed_workbooks(file_bytes1, file_bytes2)
+    return diff_models(df1, df2, transaction_type, branch, match_moved)
+
+def snapshot_diff_job(snapshot, file_bytes, transaction_type, branch=(), match_moved=False):
+    # The stored snapshot is the first (older) side, the upload the second
+    df1, _ = snapshot_store.load(*snapshot)
+    df2, _ = workbook_cache.get_processed_workbook(file_bytes)
+    return diff_models(df1, df2, transaction_type, branch, match_moved)
+
+def match_moved_checkbox(key):
+    return st.checkbox("Match moved and renamed rows", key=key,
+                       help="Pairs rows that only one file has by their values, and reports them as Moved "
+                            "instead of as removed and added")
+
+def snapshot_trees_job(snapshot, file_bytes):
+    df1, _ = snapshot_store.load(*snapshot)
+    df2, _ = workbook_cache.get_processed_workbook(file_bytes)
+    return [df1.attrs.get('hierarchy_tree'), df2.attrs.get('hierarchy_tree')]
+
+def save_snapshot_job(name, file_bytes, source_name):
+    df, hierarchy = workbook_cache.get_processed_workbook(file_bytes)
+    if df.empty:
+        raise ValueError("No 'Trn Model' data could be processed from this workbook")
+    return snapshot_store.save(name, df, hierarchy, source_name, workbook_cache.key_for(file_bytes))
+
+def render_sheet_diff(selected_transaction_type, result, comparison_title, label1, label2, branch=()):
+    changes_df, diff_df1, diff_df2, rollup = result
+    if branch:
+        comparison_title = f"{comparison_title}, branch {branch_label(branch)}"
+
+    # Display explanation of differences with title
+    st.subheader("Explanation of Differences")
+    st.caption(comparison_title)
+    if changes_df.empty:
+        st.success("No differences found.")
+        return
+    render_change_rollup(rollup)
+    render_paginated_table(changes_df, "sheet_diff_changes",
+                           export_text=lambda: f"{comparison_title}\n\n{tabulate(changes_df, headers='keys', tablefmt='grid', showindex=False)}",
+                           export_name=f"{selected_transaction_type}_differences.txt")
+
+    # Remove Unique_ID from display; both panes share one style matrix
+    styles = highlight_differences(diff_df1, diff_df2)
+    styled_df1 = diff_df1.style.apply(lambda x: styles, axis=None)
+    styled_df2 = diff_df2.style.apply(lambda x: styles, axis=None)
+
+    # Display dataframes after the explanation
+    st.subheader(f"Transaction Type: {selected_transaction_type} Output (Differences Only)")
+    col1, col2 = st.columns(2)
+
+    col1.subheader(f"{label1} Output")
+    col1.dataframe(styled_df1, width=2000, height=800)
+
+    col2.subheader(f"{label2} Output")
+    col2.dataframe(styled_df2, width=2000, height=800)
+
+    render_diff_download(diff_df1, diff_df2, label1, label2,
+                         f"{selected_transaction_type}_differences.xlsx", "sheet_diff_highlighted_export")
+
+def describe_snapshot(meta):
+    created = time.strftime('%Y-%m-%d %H:%M', time.localtime(meta['created_at']))
+    return f"{created} · {meta['source_name'] or meta['version']} · {len(meta['transaction_types'])} types"
+
+def snapshot_view():
+    uploaded_file = workbook_uploader("Choose the Excel file to compare", "snapshot_uploader")
+    if not uploaded_file:
+        return
+
+    file_bytes = persist_upload(uploaded_file)
+    workbook_cache.prefetch(file_bytes)
+    transaction_types = workbook_cache.get_transaction_types(file_bytes)
+    upload_key = workbook_cache.key_for(file_bytes)
+
+    with st.expander("Save this upload as a snapshot"):
+        snapshot_name = st.text_input("Snapshot name", value=os.path.splitext(uploaded_file.name)[0], key="snapshot_save_name")
+        if st.button("Save Snapshot"):
+            start_job("snapshot_save_job", (upload_key, snapshot_name), f"Saving snapshot {snapshot_name}",
+                      JOB_STAGES[:3] + ['snapshot'], save_snapshot_job, snapshot_name, file_bytes, uploaded_file.name)
+        saved = job_result("snapshot_save_job", (upload_key, snapshot_name))
+        if saved is not None:
+            st.success(f"Stored as {saved['name']}, version {saved['version']}.")
+
+    names = snapshot_store.names()
+    if not names:
+        st.info("No stored snapshots yet. Save an upload as a snapshot to compare later versions against it.")
+        return
+    col1, col2 = st.columns(2)
+    name = col1.selectbox("Stored snapshot", names, key="snapshot_select_name")
+    versions = {meta['version']: meta for meta in snapshot_store.versions(name)}
+    version = col2.selectbox("Version", list(versions), format_func=lambda v: describe_snapshot(versions[v]),
+                             key="snapshot_select_version")
+    if version is None:
+        return
+    if col2.button("Delete this version"):
+        snapshot_store.delete(name, version)
+        st.rerun()
+
+    common_transaction_types = sorted(set(transaction_types) & set(versions[version]['transaction_types']))
+    selected_transaction_type = st.selectbox(
+        "Search and select Transaction Type",
+        [""] + common_transaction_types,
+        index=0,
+        key="snapshot_transaction_select"
+    )
+
+    branch = select_branch("snapshot_branch", (name, version, upload_key), snapshot_trees_job, (name, version), file_bytes)
+
+    match_moved = match_moved_checkbox("snapshot_match_moved")
+
+    selection = (name, version, upload_key, selected_transaction_type, branch, match_moved)
+    if st.button("Process"):
+        if selected_transaction_type in common_transaction_types:
+            start_job("snapshot_diff_job", selection, f"Comparing {selected_transaction_type} with snapshot {name}", JOB_STAGES,
+                      snapshot_diff_job, (name, version), file_bytes, selected_transaction_type, branch, match_moved)
+        else:
+            st.warning("Transaction type not found. Please check the selected transaction type.")
+
+    result = job_result("snapshot_diff_job", selection)
+    if result is not None:
+        render_sheet_diff(selected_transaction_type, result,
+                          f"Comparison of Transaction Types: {selected_transaction_type} between snapshot {name} and {uploaded_file.name}",
+                          "Snapshot", "Uploaded File", branch)
+
+def timeline_job(timeline, versions, file_bytes_by_key):
+    # Syncs a copy, so a cancelled or superseded job leaves the stored timeline as it was
+    timeline = timeline.copy()
+    timeline.sync(versions, lambda key: process_transaction_data(
+        workbook_cache.get_processed_workbook(file_bytes_by_key[key])[0], timeline.transaction_type))
+    return timeline
+
+def version_timeline_view():
+    uploaded_files = st.file_uploader("Choose two or more versions of the workbook", type="xlsx",
+                                      accept_multiple_files=True, key="timeline_uploader")
+    if len(uploaded_files) < 2:
+        return
+
+    order_by_name = st.checkbox("Order versions by file name (otherwise upload order)", value=True, key="timeline_order_by_name")
+    if order_by_name:
+        uploaded_files = sorted(uploaded_files, key=lambda f: f.name)
+    file_bytes_by_key = {}
+    versions = []
+    for uploaded_file in uploaded_files:
+        file_bytes = persist_upload(uploaded_file)
+        key = workbook_cache.key_for(file_bytes)
+        file_bytes_by_key[key] = file_bytes
+        versions.append((key, uploaded_file.name))
+
+    for file_bytes in file_bytes_by_key.values():
+        workbook_cache.prefetch(file_bytes)
+    common_transaction_types = set(workbook_cache.get_transaction_types(file_bytes_by_key[versions[0][0]]))
+    for key, _ in versions[1:]:
+        common_transaction_types &= set(workbook_cache.get_transaction_types(file_bytes_by_key[key]))
+
+    selected_transaction_type = st.selectbox(
+        "Search and select Transaction Type",
+        [""] + sorted(common_transaction_types),
+        index=0,
+        key="timeline_transaction_select"
+    )
+    compare_to_baseline = st.checkbox("Also compare every version against the first one", key="timeline_baseline")
+
+    selection = (selected_transaction_type, compare_to_baseline)
+    build = st.button("Build Timeline")
+    if build:
+        if selected_transaction_type in common_transaction_types:
+            st.session_state["timeline_selection"] = selection
+        else:
+            st.warning("Transaction type not found. Please check the selected transaction type.")
+    if st.session_state.get("timeline_selection") != selection:
+        return
+
+    # The timeline survives reruns; adding a version only extracts and diffs the new upload
+    timeline = st.session_state.get("version_timeline")
+    if timeline is None or (timeline.transaction_type, timeline.compare_to_baseline) != selection:
+        timeline = VersionTimeline(selected_transaction_type, compare_to_baseline)
+    job_selection = (selection, tuple(versions))
+    stored = st.session_state.get("timeline_job")
+    if not stored or stored[0] != job_selection or (build and stored[1].status != 'done'):
+        start_job("timeline_job", job_selection, f"Building the {selected_transaction_type} timeline", JOB_STAGES,
+                  timeline_job, timeline, versions, file_bytes_by_key)
+    timeline = job_result("timeline_job", job_selection)
+    if timeline is None:
+        return
+    st.session_state["version_timeline"] = timeline
+
+    st.subheader(f"Transaction Type: {selected_transaction_type} across {len(versions)} versions")
+    st.dataframe(timeline.summary(), hide_index=True, width=2000)
+
+    st.subheader("Cell Change Timeline")
+    st.caption("One row per cell that changed in at least one step; each step column shows that step's change.")
+    render_paginated_table(timeline.cell_timeline(), "timeline_cells",
+                           export_name=f"{selected_transaction_type}_cell_timeline.txt")
+
+    st.subheader("All Changes Between Consecutive Versions")
+    render_paginated_table(timeline.changes(), "timeline_changes",
+                           export_name=f"{selected_transaction_type}_timeline_changes.txt")
+
+    if compare_to_baseline:
+        st.subheader(f"Changes Against {versions[0][1]}")
+        render_paginated_table(timeline.changes(baseline=True), "timeline_baseline_changes",
+                               export_name=f"{selected_transaction_type}_baseline_changes.txt")
 
 def transaction_diff_checker():
     st.header("Sheet Diff Checker")
 
+    mode = st.radio("Comparison mode", ["Two files", "Version timeline", "Against stored snapshot"], horizontal=True,
+                    key="sheet_diff_mode")
+    if mode == "Version timeline":
+        version_timeline_view()
+        return
+    if mode == "Against stored snapshot":
+        snapshot_view()
+        return
+
     col1, col2 = st.columns(2)
 
     with col1:
-        uploaded_file1 = st.file_uploader("Choose the first Excel file", type="xlsx", key="file_uploader1")
+        uploaded_file1 = workbook_uploader("Choose the first Excel file", "file_uploader1")
     
     with col2:
-        uploaded_file2 = st.file_uploader("Choose the second Excel file", type="xlsx", key="file_uploader2")
+        uploaded_file2 = workbook_uploader("Choose the second Excel file", "file_uploader2")
 
-    if uploaded_file1 and uploaded_file2:
-        file_path1 = os.path.join('uploads', uploaded_file1.name)
-        with open(file_path1, "wb") as f:
-            f.write(uploaded_file1.getbuffer())
-        
-        file_path2 = os.path.join('uploads', uploaded_file2.name)
-        with open(file_path2, "wb") as f:
-            f.write(uploaded_file2.getbuffer())
+    # Each upload starts parsing in a worker process as soon as it arrives, so the two files
+    # parse in parallel and type discovery for one never waits on the other
+    if uploaded_file1:
+        file_bytes1 = persist_upload(uploaded_file1)
+        workbook_cache.prefetch(file_bytes1)
+        transaction_types1 = workbook_cache.get_transaction_types(file_bytes1)
+        col1.caption(f"{len(transaction_types1)} transaction types")
+
+    if uploaded_file2:
+        file_bytes2 = persist_upload(uploaded_file2)
+        workbook_cache.prefetch(file_bytes2)
+        transaction_types2 = workbook_cache.get_transaction_types(file_bytes2)
+        col2.caption(f"{len(transaction_types2)} transaction types")
 
-        transaction_types1 = load_transaction_types(file_path1)
-        transaction_types2 = load_transaction_types(file_path2)
+    if uploaded_file1 and uploaded_file2:
         common_transaction_types = sorted(set(transaction_types1) & set(transaction_types2))
         
         selected_transaction_type = st.selectbox(
@@ -130,75 +275,25 @@ def transaction_diff_checker():
             key="transaction_select"
         )
 
+        file_keys = (workbook_cache.key_for(file_bytes1), workbook_cache.key_for(file_bytes2))
+        branch = select_branch("sheet_diff_branch", file_keys, workbook_trees_job, file_bytes1, file_bytes2)
+
+        match_moved = match_moved_checkbox("sheet_diff_match_moved")
+
+        selection = file_keys + (selected_transaction_type, branch, match_moved)
         if st.button("Process"):
             if selected_transaction_type in common_transaction_types:
-                df1 = process_excel_file(file_path1)
-                df2 = process_excel_file(file_path2)
-                
-                processed_df1 = process_transaction_data(df1, selected_transaction_type)
-                processed_df2 = process_transaction_data(df2, selected_transaction_type)
-                
-                # Ensure the same column order with Unique_ID for processing
-                columns_order = ['Unique_ID', 'Category', 'Variable'] + [col for col in processed_df1.columns if col not in ['Unique_ID', 'Category', 'Variable']]
-                processed_df1 = processed_df1[columns_order]
-                processed_df2 = processed_df2[columns_order]
-
-                # Align dataframes on Unique_ID
-                processed_df1.set_index('Unique_ID', inplace=True)
-                processed_df2.set_index('Unique_ID', inplace=True)
-                processed_df1, processed_df2 = processed_df1.align(processed_df2, join='outer', axis=0)
-
-                # Ensure Category and Variable are populated in both DataFrames
-                processed_df1['Category'] = processed_df1['Category'].combine_first(processed_df2['Category'])
-                processed_df1['Variable'] = processed_df1['Variable'].combine_first(processed_df2['Variable'])
-                processed_df2['Category'] = processed_df1['Category']
-                processed_df2['Variable'] = processed_df1['Variable']
-
-                # Remove duplicate columns
-                processed_df1 = processed_df1.loc[:, ~processed_df1.columns.duplicated()]
-                processed_df2 = processed_df2.loc[:, ~processed_df2.columns.duplicated()]
-
-                # Fill NaN for comparison and styling purposes
-                filled_df1 = processed_df1.fillna('')
-                filled_df2 = processed_df2.fillna('')
-
-                # Filter rows with differences
-                diff_mask = ((filled_df1 != filled_df2) & ((filled_df1 != '') | (filled_df2 != ''))).any(axis=1)
-                diff_df1 = processed_df1[diff_mask]
-                diff_df2 = processed_df2[diff_mask]
-
-                # Generate explanation of differences
-                changes_df = generate_difference_explanation(diff_df1, diff_df2, "Sheet 1", "Sheet 2")
-
-                # Display explanation of differences with title
-                st.subheader("Explanation of Differences")
-                comparison_title = f"Comparison of Transaction Types: {selected_transaction_type} between two sheets"
-                comparison_result = tabulate(changes_df, headers='keys', tablefmt='grid', showindex=False)
-                st.text(f"{comparison_title}\n\n{comparison_result}")
-                
-                # Reset index to remove Unique_ID completely
-                diff_df1.reset_index(drop=True, inplace=True)
-                diff_df2.reset_index(drop=True, inplace=True)
-                
-                # Remove Unique_ID from display
-                styled_df1 = diff_df1.style.apply(lambda x: highlight_differences(diff_df1, diff_df2), axis=None)
-                styled_df2 = diff_df2.style.apply(lambda x: highlight_differences(diff_df1, diff_df2), axis=None)
-
-                # Display dataframes after the explanation
-                st.subheader(f"Transaction Type: {selected_transaction_type} Output (Differences Only)")
-                col1, col2 = st.columns(2)
-                
-                col1.subheader("First File Output")
-                col1.dataframe(styled_df1, width=2000, height=800)
-                
-                col2.subheader("Second File Output")
-                col2.dataframe(styled_df2, width=2000, height=800)
-
+                start_job("sheet_diff_job", selection, f"Comparing {selected_transaction_type}", JOB_STAGES,
+                          sheet_diff_job, file_bytes1, file_bytes2, selected_transaction_type, branch, match_moved)
             else:
                 st.warning("Transaction type not found. Please check the selected transaction type.")
 
-    if not os.path.exists('uploads'):
-        os.makedirs('uploads')
+        # The job and its result stay in session state, so paging/filtering reruns do not recompute the diff
+        result = job_result("sheet_diff_job", selection)
+        if result is not None:
+            render_sheet_diff(selected_transaction_type, result,
+                              f"Comparison of Transaction Types: {selected_transaction_type} between two sheets",
+                              "First File", "Second File", branch)
 
 if __name__ == "__main__":
     transaction_diff_checker()
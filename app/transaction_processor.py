@@ -1,26 +1,36 @@
 # app/transaction_processor.py
 
 import streamlit as st
-import pandas as pd
-import os
 import logging
-from utils import load_transaction_types, process_excel_file, present_transaction_data
+from utils import branch_rows, present_transaction_data, process_transaction_data, transaction_display_frame
+from workbook_cache import workbook_cache
+from upload_store import persist_upload, workbook_uploader
+from table_view import render_paginated_table
+from job_runner import JOB_STAGES
+from job_view import start_job, job_result
+from hierarchy_view import branch_label, select_branch, workbook_trees_job
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def extract_transaction_job(file_bytes, transaction_type, branch=()):
+    df, _ = workbook_cache.get_processed_workbook(file_bytes)
+    if df.empty:
+        logging.warning("Processed DataFrame is empty")
+    return transaction_display_frame(process_transaction_data(df, transaction_type, branch_rows(df, branch)))
+
+def present_branch_data(file_bytes, transaction_type, branch):
+    df, _ = workbook_cache.get_processed_workbook(file_bytes)
+    return present_transaction_data(df, transaction_type, branch_rows(df, branch))
+
 def transaction_processor():
     st.header("Transaction Processor")
     
-    uploaded_file = st.file_uploader("Choose an Excel file", type="xlsx", key="file_uploader")
+    uploaded_file = workbook_uploader("Choose an Excel file", "file_uploader")
 
     if uploaded_file is not None:
-        file_path = os.path.join('uploads', uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        logging.info(f"Uploaded file: {uploaded_file.name}")
+        file_bytes = persist_upload(uploaded_file)
 
-        transaction_types = load_transaction_types(file_path)
-        logging.info(f"Transaction types loaded: {transaction_types}")
+        transaction_types = workbook_cache.get_transaction_types(file_bytes)
 
         selected_transaction_type = st.selectbox(
             "Search and select Transaction Type",
@@ -29,18 +39,26 @@ def transaction_processor():
             key="transaction_select"
         )
 
+        file_key = workbook_cache.key_for(file_bytes)
+        branch = select_branch("processor_branch", file_key, workbook_trees_job, file_bytes)
+
+        selection = (file_key, selected_transaction_type, branch)
         if st.button("Process"):
             if selected_transaction_type in transaction_types:
-                df = process_excel_file(file_path)
-                if df.empty:
-                    logging.warning("Processed DataFrame is empty")
-                result = present_transaction_data(df, selected_transaction_type)
-                st.text(result)
+                start_job("processor_job", selection, f"Processing {selected_transaction_type}", JOB_STAGES[:4],
+                          extract_transaction_job, file_bytes, selected_transaction_type, branch)
             else:
                 st.warning("Transaction type not found. Please check the selected transaction type.")
 
-    if not os.path.exists('uploads'):
-        os.makedirs('uploads')
+        # Keep showing the processed result while the table's paging/filter widgets rerun the script
+        result_df = job_result("processor_job", selection)
+        if result_df is not None:
+            st.subheader(f"Transaction Type: {selected_transaction_type}")
+            if branch:
+                st.caption(f"Branch: {branch_label(branch)}")
+            render_paginated_table(result_df, "processor_table",
+                                   export_text=lambda: present_branch_data(file_bytes, selected_transaction_type, branch),
+                                   export_name=f"{selected_transaction_type}.txt")
 
 if __name__ == "__main__":
     transaction_processor()
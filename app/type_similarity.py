@@ -0,0 +1,133 @@
+# app/type_similarity.py
+
+import os
+import logging
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from diagnostics import diagnostics
+from utils import transaction_columns
+
+NEAR_IDENTICAL_THRESHOLD = 0.95
+# Spawning the worker pool costs a second or two, about what a single thread needs for a
+# billion cell comparisons; smaller matrices are computed in process
+SIMILARITY_PARALLEL_MIN_CELLS = int(os.environ.get('SIMILARITY_PARALLEL_MIN_CELLS', 1_000_000_000))
+
+_encoded_types = None
+
+def encode_transaction_types(df, transaction_types):
+    # Only rows that process_transaction_data keeps (Unique_IDs with a Variable part)
+    row_keys = df.attrs.get('row_keys')
+    if row_keys is not None and len(row_keys) == len(df):
+        row_mask = row_keys.has_variable
+    else:
+        row_mask = np.asarray(df.index.to_series().astype(str).str.contains('.', regex=False), dtype=bool)
+    type_columns = {t: transaction_columns(df, t) for t in transaction_types}
+    all_positions = sorted({p for positions, _ in type_columns.values() for p in positions})
+    values = df.iloc[row_mask, all_positions].to_numpy(dtype=object)
+    # Columns stored as float64 at load keep their first-row label aside
+    numeric_columns = df.attrs.get('numeric_columns', {})
+    if len(row_mask) and row_mask[0]:
+        for i, position in enumerate(all_positions):
+            if position in numeric_columns:
+                values[0, i] = numeric_columns[position]
+
+    # Factorize every value once so pairwise comparisons become integer equality checks;
+    # 1 and 1.0 share a code, blanks and whitespace-only strings map to -1 like NaN
+    codes, uniques = pd.factorize(values.ravel())
+    blank = np.array([isinstance(u, str) and not u.strip() for u in uniques], dtype=bool)
+    if blank.any():
+        codes[blank[np.maximum(codes, 0)] & (codes >= 0)] = -1
+    codes = codes.reshape(values.shape).astype(np.int32)
+
+    matrix_column = {p: i for i, p in enumerate(all_positions)}
+    encoded = []
+    for t in transaction_types:
+        positions, labels = type_columns[t]
+        label_columns = {}
+        for position, label in zip(positions, labels):
+            label_columns.setdefault(label, matrix_column[position])
+        encoded.append((list(label_columns), codes[:, list(label_columns.values())]))
+    return encoded
+
+def compare_encoded(type1, type2):
+    labels1, codes1 = type1
+    labels2, codes2 = type2
+    missing = np.full(codes1.shape[0], -1, dtype=np.int32)
+    index1 = {label: i for i, label in enumerate(labels1)}
+    index2 = {label: i for i, label in enumerate(labels2)}
+    differences = 0
+    populated = 0
+    for label in list(labels1) + [label for label in labels2 if label not in index1]:
+        a = codes1[:, index1[label]] if label in index1 else missing
+        b = codes2[:, index2[label]] if label in index2 else missing
+        differences += int(np.count_nonzero(a != b))
+        populated += int(np.count_nonzero((a >= 0) | (b >= 0)))
+    return differences, populated
+
+def _init_worker(encoded):
+    global _encoded_types
+    _encoded_types = encoded
+
+def compare_row(encoded, i):
+    results = [compare_encoded(encoded[i], encoded[j]) for j in range(i + 1, len(encoded))]
+    return i, results
+
+def _compare_row(i):
+    return compare_row(_encoded_types, i)
+
+def report_pairs(rows):
+    # Collects the compared rows, reporting the pairs done so far to a job listening for progress
+    collected = []
+    done = 0
+    for i, results in rows:
+        collected.append((i, results))
+        done += len(results)
+        diagnostics.progress('diff', pairs=done)
+    return collected
+
+def compute_similarity_matrix(df, transaction_types, max_workers=None):
+    # Returns (difference counts, similarity ratios) as type x type DataFrames
+    with diagnostics.stage('diff', step='similarity', transaction_types=len(transaction_types)) as record:
+        encoded = encode_transaction_types(df, transaction_types)
+        n = len(transaction_types)
+        differences = np.zeros((n, n), dtype=np.int64)
+        populated = np.zeros((n, n), dtype=np.int64)
+        max_workers = max_workers or os.cpu_count() or 1
+        pairs = n * (n - 1) // 2
+        cells = pairs * sum(codes.size for _, codes in encoded) // max(n, 1)
+        if max_workers < 2 or n < 3 or cells < SIMILARITY_PARALLEL_MIN_CELLS:
+            max_workers = 1
+        record.update(pairs=pairs, cells=cells, workers=max_workers)
+
+        if max_workers > 1:
+            # Spawned rather than forked, as this runs on a thread of the Streamlit server
+            executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_worker, initargs=(encoded,))
+            try:
+                rows = report_pairs(executor.map(_compare_row, range(n - 1), chunksize=max(1, n // (max_workers * 4))))
+            finally:
+                # A cancelled job stops here without waiting for the rows still queued
+                executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            # No module global here: jobs from several sessions may run this at once
+            rows = report_pairs(compare_row(encoded, i) for i in range(n - 1))
+
+        for i, results in rows:
+            for offset, (diff_count, populated_count) in enumerate(results):
+                j = i + 1 + offset
+                differences[i, j] = differences[j, i] = diff_count
+                populated[i, j] = populated[j, i] = populated_count
+        logging.info(f"Compared {pairs} transaction type pairs using {max_workers} workers")
+
+        similarity = np.where(populated > 0, 1 - differences / np.maximum(populated, 1), 1.0)
+        np.fill_diagonal(similarity, 1.0)
+        return (pd.DataFrame(differences, index=transaction_types, columns=transaction_types),
+                pd.DataFrame(similarity, index=transaction_types, columns=transaction_types))
+
+def similarity_styles(similarity):
+    styles = np.where(similarity.to_numpy() >= 1.0, 'background-color: lightgreen',
+                      np.where(similarity.to_numpy() >= NEAR_IDENTICAL_THRESHOLD, 'background-color: yellow',
+                               'background-color: lightcoral'))
+    return pd.DataFrame(styles, index=similarity.index, columns=similarity.columns)
@@ -0,0 +1,163 @@
+# app/upload_store.py
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from workbook_cache import workbook_cache
+
+UPLOAD_STORE_ROOT = os.environ.get('UPLOAD_STORE_ROOT', 'uploads')
+UPLOAD_STORE_MAX_BYTES = int(os.environ.get('UPLOAD_STORE_MAX_BYTES', 2 * 1024 ** 3))
+UPLOAD_STORE_MAX_AGE_SECONDS = int(os.environ.get('UPLOAD_STORE_MAX_AGE_SECONDS', 7 * 24 * 3600))
+
+class UploadStore:
+    # Uploads are stored once per content hash under objects/; each session only sees the
+    # hashes it registered itself under sessions/<session_id>/, so two users uploading
+    # files with the same name never touch each other's data.
+    def __init__(self, root=UPLOAD_STORE_ROOT, max_bytes=UPLOAD_STORE_MAX_BYTES, max_age=UPLOAD_STORE_MAX_AGE_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._registered = set()
+
+    def _object_path(self, key):
+        return os.path.join(self.root, 'objects', f"{key}.xlsx")
+
+    def _ref_path(self, session_id, key):
+        return os.path.join(self.root, 'sessions', re.sub(r'[^\w-]', '_', session_id), f"{key}.json")
+
+    def put(self, session_id, key, file_bytes, name):
+        if (session_id, key) in self._registered:
+            return self._object_path(key)
+        object_path = self._object_path(key)
+        with self._lock:
+            if os.path.exists(object_path):
+                os.utime(object_path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                temp_path = f"{object_path}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(file_bytes)
+                os.replace(temp_path, object_path)
+            ref_path = self._ref_path(session_id, key)
+            os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+            with open(ref_path, "w") as f:
+                json.dump({'name': name, 'size': len(file_bytes), 'stored_at': time.time()}, f)
+            self._registered.add((session_id, key))
+            self._evict(keep=key)
+        return object_path
+
+    def get(self, session_id, key):
+        # Returns the stored path only if this session registered the upload
+        object_path = self._object_path(key)
+        if not os.path.exists(self._ref_path(session_id, key)) or not os.path.exists(object_path):
+            return None
+        os.utime(object_path)
+        return object_path
+
+    def uploads(self, session_id):
+        # [(key, name, size, stored_at), ...] of the uploads this session registered, newest first
+        session_dir = os.path.dirname(self._ref_path(session_id, 'key'))
+        found = []
+        if os.path.isdir(session_dir):
+            for file_name in os.listdir(session_dir):
+                key = file_name[:-len('.json')]
+                if not file_name.endswith('.json') or not os.path.exists(self._object_path(key)):
+                    continue
+                try:
+                    with open(os.path.join(session_dir, file_name)) as f:
+                        ref = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                found.append((key, ref['name'], ref['size'], ref['stored_at']))
+        return sorted(found, key=lambda upload: upload[3], reverse=True)
+
+    def _evict(self, keep=None):
+        objects_dir = os.path.join(self.root, 'objects')
+        now = time.time()
+        objects = []
+        for name in os.listdir(objects_dir):
+            if not name.endswith('.xlsx'):
+                continue
+            stat = os.stat(os.path.join(objects_dir, name))
+            objects.append((stat.st_mtime, stat.st_size, name[:-len('.xlsx')]))
+        objects.sort()
+        total = sum(size for _, size, _ in objects)
+        removed = set()
+        for mtime, size, key in objects:
+            if total <= self.max_bytes and now - mtime <= self.max_age:
+                break
+            if key == keep:
+                continue
+            os.remove(self._object_path(key))
+            total -= size
+            removed.add(key)
+        if removed:
+            self._remove_refs(removed)
+            logging.info(f"Evicted {len(removed)} stored uploads")
+
+    def _remove_refs(self, keys):
+        sessions_dir = os.path.join(self.root, 'sessions')
+        for session in os.listdir(sessions_dir):
+            session_dir = os.path.join(sessions_dir, session)
+            for key in keys:
+                ref_path = os.path.join(session_dir, f"{key}.json")
+                if os.path.exists(ref_path):
+                    os.remove(ref_path)
+            if not os.listdir(session_dir):
+                os.rmdir(session_dir)
+        self._registered = {(session_id, key) for session_id, key in self._registered if key not in keys}
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else 'local'
+
+def persist_upload(uploaded_file):
+    # Returns the upload's bytes without copying them and records the upload in the
+    # content-addressed store for this session
+    file_bytes = uploaded_file.getvalue()
+    upload_store.put(current_session_id(), workbook_cache.key_for(file_bytes), file_bytes, uploaded_file.name)
+    return file_bytes
+
+class StoredUpload:
+    # An earlier upload read back from the store, standing in for st.file_uploader's
+    # UploadedFile (name and getvalue) so the pages handle both the same way
+    def __init__(self, name, file_bytes):
+        self.name = name
+        self.file_bytes = file_bytes
+
+    def getvalue(self):
+        return self.file_bytes
+
+def workbook_uploader(label, key):
+    # st.file_uploader that, while empty, offers this session's earlier uploads again, so a
+    # workbook uploaded in one tab (or cleared from the uploader) is reopened from the store
+    # rather than uploaded twice. Returns the UploadedFile, a StoredUpload or None.
+    uploaded_file = st.file_uploader(label, type="xlsx", key=key)
+    if uploaded_file is not None:
+        return uploaded_file
+    session_id = current_session_id()
+    earlier = {f"{name} ({size / 1024:,.0f} KB, {time.strftime('%H:%M', time.localtime(stored_at))})": (upload_key, name)
+               for upload_key, name, size, stored_at in upload_store.uploads(session_id)}
+    if not earlier:
+        return None
+    choice = st.selectbox("Or reopen an earlier upload", [""] + list(earlier), key=f"{key}_earlier")
+    if not choice:
+        return None
+    upload_key, name = earlier[choice]
+    # The bytes are kept in the session so reruns hand back the same object, as the uploader does
+    restored = st.session_state.get(f"{key}_restored")
+    if restored is None or restored[0] != upload_key:
+        path = upload_store.get(session_id, upload_key)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            restored = st.session_state[f"{key}_restored"] = (upload_key, f.read())
+    return StoredUpload(name, restored[1])
+
+upload_store = UploadStore()
@@ -4,60 +4,611 @@ import pandas as pd
 import numpy as np
 from tabulate import tabulate
 from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from openpyxl.cell.read_only import EMPTY_CELL
+from pandas.io.parsers import TextParser
 import logging
+import os
+import posixpath
+import re
+import zipfile
+from array import array
+from xml.etree.ElementTree import ParseError, iterparse
+from diagnostics import diagnostics
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+TRANSACTION_COLUMNS_START = 8
+
+# Workbooks at least this large are read with the bounded-memory streaming reader
+STREAMING_MIN_FILE_BYTES = int(os.environ.get('STREAMING_INGEST_MIN_BYTES', 25 * 1024 ** 2))
+# Upper bound on cells turned back into Python objects at once when the streamed frame is built
+STREAMING_BATCH_CELLS = 1_000_000
+PROGRESS_ROWS = 5000
+
+CELL_EMPTY, CELL_INT, CELL_FLOAT, CELL_TEXT, CELL_ERROR, CELL_OTHER = range(6)
+MAX_EXACT_FLOAT_INT = 2 ** 53
+
+class TransactionColumnIndex(dict):
+    # Maps a transaction type to (column positions, sub-column labels). It is never
+    # mutated after build, so pandas' deep copy of df.attrs can share the instance.
+    def __deepcopy__(self, memo):
+        return self
+
+class RowKeys:
+    # The Category/Variable split of every Unique_ID, done once at load. Like the column
+    # index it is never mutated, so copies of df.attrs share it.
+    def __init__(self, unique_ids):
+        parts = [str(unique_id).split('.', 2) for unique_id in unique_ids]
+        self.category = pd.Categorical([p[0] for p in parts])
+        self.variable = pd.Categorical([p[1] if len(p) > 1 else None for p in parts])
+        self.has_variable = np.fromiter((len(p) > 1 for p in parts), dtype=bool, count=len(parts))
+
+    def __len__(self):
+        return len(self.has_variable)
+
+    def __deepcopy__(self, memo):
+        return self
+
+class NumericColumns(dict):
+    # Maps the position of each column stored as float64 by compact_value_columns to the
+    # original value of its first row, which holds the sub-column label rather than a number
+    def __deepcopy__(self, memo):
+        return self
+
+class HierarchyTree:
+    # The column-A outline as a tree: each node is a label path built from the indent levels,
+    # with node 0 the root (rows before the first label). Rows point at the node of their
+    # label, and nodes are numbered in pre-order with the span of their subtree, so the rows
+    # of a branch are found with array comparisons rather than by parsing Unique_IDs. Never
+    # mutated after build, so copies of df.attrs share it.
+    def __init__(self, paths, row_nodes):
+        self.paths = [tuple(path) for path in paths]
+        self.row_nodes = np.asarray(row_nodes, dtype=np.int32)
+        self.node_ids = {path: node for node, path in enumerate(self.paths)}
+        children = [[] for _ in self.paths]
+        for node, path in enumerate(self.paths[1:], start=1):
+            children[self.node_ids[path[:-1]]].append(node)
+        # Pre-order position of every node and the position just past its subtree
+        self.enter = np.zeros(len(self.paths), dtype=np.int32)
+        self.exit = np.zeros(len(self.paths), dtype=np.int32)
+        position = 0
+        stack = [(0, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                self.exit[node] = position
+                continue
+            self.enter[node] = position
+            position += 1
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children[node]))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def preorder(self):
+        # Node paths in outline order
+        return [self.paths[node] for node in np.argsort(self.enter)]
+
+    def subtree_rows(self, path):
+        # Sorted positions of the rows in the branch at path; empty if the model has no such branch
+        node = self.node_ids.get(tuple(path))
+        if node is None:
+            return np.zeros(0, dtype=np.intp)
+        in_subtree = (self.enter >= self.enter[node]) & (self.enter < self.exit[node])
+        return np.flatnonzero(in_subtree[self.row_nodes])
+
+    def category_paths(self, row_keys):
+        # {Category: node path} taken from the first row of each Category
+        codes = np.asarray(row_keys.category.codes)[:len(self.row_nodes)]
+        found, first_rows = np.unique(codes, return_index=True)
+        return {row_keys.category.categories[code]: self.paths[self.row_nodes[row]] for code, row in zip(found, first_rows)}
+
+def branch_rows(df, branch):
+    # Row positions of a branch of a processed frame's hierarchy, or None (all rows) when no
+    # branch is given or the frame has no hierarchy tree
+    tree = df.attrs.get('hierarchy_tree')
+    if not branch or tree is None or len(tree.row_nodes) != len(df):
+        return None
+    return tree.subtree_rows(branch)
+
 def load_transaction_types(file_path):
     try:
-        df = pd.read_excel(file_path, sheet_name='Trn Model', nrows=0)
-        all_columns = df.columns.tolist()
-        transaction_types = [col for col in all_columns[8:] if not col.startswith('Unnamed')]
-        transaction_types = sorted(set(transaction_types))
-        logging.info(f"Transaction types loaded: {transaction_types}")
+        with diagnostics.stage('transaction_types') as record:
+            try:
+                columns = read_header_columns(file_path)
+                record['reader'] = 'header'
+            except (zipfile.BadZipFile, KeyError, ParseError, ValueError) as e:
+                logging.debug(f"Header-only read failed, reading with pandas: {str(e)}")
+                if hasattr(file_path, 'seek'):
+                    file_path.seek(0)
+                columns = pd.read_excel(file_path, sheet_name='Trn Model', nrows=0).columns.tolist()
+                record['reader'] = 'pandas'
+            transaction_types = extract_transaction_types(columns)
+            record.update(columns=len(columns), transaction_types=len(transaction_types))
         return transaction_types
     except Exception as e:
         logging.error(f"Failed to load transaction types: {str(e)}")
         return []
 
-def process_excel_file(file_path):
+def read_header_columns(file_path, sheet_name='Trn Model'):
+    # Column names of the sheet's first row, as pd.read_excel(nrows=0) would return them,
+    # read straight from the xlsx archive: the sheet XML is parsed only up to the end of
+    # its first row, and shared strings only up to the highest index that row uses
+    with zipfile.ZipFile(file_path) as archive:
+        sheet_path, shared_strings_path = workbook_parts(archive, sheet_name)
+        cells = first_row_cells(archive, sheet_path)
+        shared = [int(value) for kind, value in cells.values() if kind == 's']
+        strings = shared_strings(archive, shared_strings_path, max(shared) + 1) if shared else []
+    header = [""] * (max(cells) + 1 if cells else 0)
+    for position, (kind, value) in cells.items():
+        header[position] = header_value(kind, value, strings)
+    while header and header[-1] == "":
+        header.pop()
+    if not header:
+        return []
+    return list(TextParser([header], header=0, skip_blank_lines=False).read().columns)
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def relationships(archive, rels_path):
+    # [(type, part path), ...] of a part's relationships file
+    found = []
+    base_path = posixpath.dirname(posixpath.dirname(rels_path))
+    with archive.open(rels_path) as f:
+        for _, element in iterparse(f):
+            if local_name(element.tag) == 'Relationship':
+                target = element.get('Target')
+                path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(base_path, target))
+                found.append((element.get('Id'), element.get('Type', '').rsplit('/', 1)[-1], path))
+    return found
+
+def workbook_parts(archive, sheet_name):
+    # Paths of the named worksheet and of the shared strings table (None if there is none)
+    workbook_path = next((path for _, kind, path in relationships(archive, '_rels/.rels') if kind == 'officeDocument'),
+                         'xl/workbook.xml')
+    with archive.open(workbook_path) as f:
+        for _, element in iterparse(f):
+            if local_name(element.tag) == 'sheet' and element.get('name') == sheet_name:
+                relationship_id = next(value for key, value in element.attrib.items() if local_name(key) == 'id')
+                break
+        else:
+            raise KeyError(f"Worksheet named '{sheet_name}' not found")
+    workbook_dir, workbook_file = posixpath.split(workbook_path)
+    parts = relationships(archive, posixpath.join(workbook_dir, '_rels', workbook_file + '.rels'))
+    sheet_path = next(path for part_id, _, path in parts if part_id == relationship_id)
+    shared_strings_path = next((path for _, kind, path in parts if kind == 'sharedStrings'), None)
+    return sheet_path, shared_strings_path
+
+CELL_REFERENCE = re.compile(r'([A-Z]+)')
+
+def column_position(reference):
+    position = 0
+    for letter in CELL_REFERENCE.match(reference).group(1):
+        position = position * 26 + ord(letter) - 64
+    return position - 1
+
+def first_row_cells(archive, sheet_path):
+    # {column position: (cell type, raw value)} for the cells of sheet row 1
+    cells = {}
+    position = -1
+    with archive.open(sheet_path) as f:
+        for event, element in iterparse(f, events=('start', 'end')):
+            tag = local_name(element.tag)
+            if event == 'start':
+                if tag == 'row' and element.get('r', '1') != '1':
+                    break
+                continue
+            if tag == 'c':
+                reference = element.get('r')
+                position = column_position(reference) if reference else position + 1
+                kind = element.get('t', 'n')
+                if kind == 'inlineStr':
+                    value = text_content(element)
+                else:
+                    value = next((child.text for child in element if local_name(child.tag) == 'v'), None)
+                if value is not None:
+                    cells[position] = (kind, value)
+                element.clear()
+            elif tag == 'row' or tag == 'sheetData':
+                break
+    return cells
+
+def text_content(element):
+    # Text of a string item: plain or rich text runs joined, phonetic runs skipped
+    phonetic = {t for run in element if local_name(run.tag) == 'rPh' for t in run.iter()}
+    return ''.join(t.text or '' for t in element.iter() if local_name(t.tag) == 't' and t not in phonetic)
+
+def shared_strings(archive, path, count):
+    # The first count shared strings
+    if path is None:
+        raise KeyError("Workbook has no shared strings table")
+    strings = []
+    with archive.open(path) as f:
+        for _, element in iterparse(f):
+            if local_name(element.tag) != 'si':
+                continue
+            strings.append(text_content(element))
+            element.clear()
+            if len(strings) >= count:
+                break
+    return strings
+
+def header_value(kind, value, strings):
+    # Mirrors convert_cell on the raw XML value
+    if kind == 's':
+        return strings[int(value)]
+    if kind in ('str', 'inlineStr'):
+        return value
+    if kind == 'b':
+        return value == '1'
+    if kind == 'e':
+        return np.nan
+    if kind == 'n':
+        if not any(marker in value for marker in '.Ee'):
+            return int(value)
+        number = float(value)
+        return int(number) if number.is_integer() else number
+    raise ValueError(f"Unsupported header cell type '{kind}'")
+
+def extract_transaction_types(all_columns):
+    transaction_types = [col for col in all_columns[TRANSACTION_COLUMNS_START:] if not col.startswith('Unnamed')]
+    return sorted(set(transaction_types))
+
+def process_excel_file(file_path, streaming=None):
+    df, _ = process_workbook(file_path, streaming)
+    return df
+
+def process_workbook(file_path, streaming=None):
     try:
-        logging.info(f"Loading data from {file_path}")
-        df = pd.read_excel(file_path, sheet_name='Trn Model')
-        logging.info("Processing Excel file")
-        hierarchy = create_hierarchy(file_path)
-        row_identifiers = generate_row_identifiers(df, hierarchy)
-        df.index = row_identifiers
-        df.index.name = 'Unique_ID'
-        column_identifiers = generate_column_identifiers(df)
-        df.columns = column_identifiers
-        df = df.loc[:, ~df.columns.str.startswith('Unnamed_Unnamed')]
-        logging.info("Finished processing Excel file.")
-        return df
+        if streaming is None:
+            streaming = use_streaming_reader(file_path)
+        reader = read_trn_model_streaming if streaming else read_trn_model
+        with diagnostics.stage('parse', reader='streaming' if streaming else 'eager') as record:
+            df, hierarchical_data = reader(file_path)
+            record.update(rows=df.shape[0], columns=df.shape[1])
+        with diagnostics.stage('hierarchy') as record:
+            hierarchy = build_hierarchy(hierarchical_data)
+            hierarchy_tree = build_hierarchy_tree(hierarchical_data[:df.shape[0]])
+            record.update(rows=len(hierarchy), nodes=len(hierarchy_tree))
+        with diagnostics.stage('identifiers') as record:
+            row_identifiers = generate_row_identifiers(df, hierarchy)
+            df.index = row_identifiers
+            df.index.name = 'Unique_ID'
+            header_columns = df.columns.tolist()
+            column_identifiers, column_groups = generate_column_labels(df)
+            df.columns = column_identifiers
+            keep = ~df.columns.str.startswith('Unnamed_Unnamed')
+            df = df.loc[:, keep]
+            kept = [(position, group) for position, (group, k) in enumerate(zip(column_groups, keep)) if k]
+            df.attrs['column_index'] = build_column_index(extract_transaction_types(header_columns), kept, df.columns)
+            df.attrs['row_keys'] = RowKeys(df.index)
+            df.attrs['hierarchy_tree'] = hierarchy_tree
+            record.update(rows=df.shape[0], columns=df.shape[1], transaction_types=len(df.attrs['column_index']))
+        with diagnostics.stage('compact') as record:
+            df = compact_value_columns(df)
+            record.update(numeric_columns=len(df.attrs.get('numeric_columns', ())))
+        return df, hierarchy
     except Exception as e:
         logging.error(f"Error processing Excel file: {str(e)}")
-        return pd.DataFrame()
+        return pd.DataFrame(), []
+
+def read_trn_model(file_path):
+    # Single read-only pass over the sheet: collects the cell values the same way
+    # pd.read_excel does and the column-A text/indent pairs for the hierarchy.
+    workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook['Trn Model']
+        sheet.reset_dimensions()
+        data = []
+        hierarchical_data = []
+        last_row_with_data = -1
+        for row_number, row in enumerate(sheet.rows):
+            if row_number % PROGRESS_ROWS == 0:
+                diagnostics.progress('parse', rows=row_number)
+            hierarchical_data.append(extract_cell_hierarchy(row[0] if row else EMPTY_CELL))
+            converted_row = [convert_cell(cell) for cell in row]
+            while converted_row and converted_row[-1] == "":
+                converted_row.pop()
+            if converted_row:
+                last_row_with_data = row_number
+            data.append(converted_row)
+    finally:
+        workbook.close()
+
+    data = data[:last_row_with_data + 1]
+    if data:
+        max_width = max(len(data_row) for data_row in data)
+        data = [data_row + [""] * (max_width - len(data_row)) for data_row in data]
+    df = TextParser(data, header=0, skip_blank_lines=False).read()
+    return df, hierarchical_data
+
+def use_streaming_reader(file_path):
+    try:
+        if hasattr(file_path, 'seek'):
+            position = file_path.tell()
+            size = file_path.seek(0, os.SEEK_END)
+            file_path.seek(position)
+        else:
+            size = os.path.getsize(file_path)
+        return size >= STREAMING_MIN_FILE_BYTES
+    except (OSError, TypeError):
+        return False
+
+class ColumnBuffer:
+    # One sheet column held as typed arrays: a kind byte per cell plus a float slot for
+    # the number or string-table code. Values a double cannot hold exactly (large ints,
+    # dates, booleans) are rare and kept in a sparse dict keyed by row.
+    __slots__ = ('kinds', 'numbers', 'others')
+
+    def __init__(self, rows=0):
+        self.kinds = array('b', bytes(rows))
+        self.numbers = array('d', bytes(8 * rows))
+        self.others = {}
+
+    def append(self, value, strings):
+        if value is None or value == "":
+            self.kinds.append(CELL_EMPTY)
+            self.numbers.append(0.0)
+        elif isinstance(value, str):
+            self.kinds.append(CELL_TEXT)
+            self.numbers.append(strings.setdefault(value, len(strings)))
+        elif type(value) is int and -MAX_EXACT_FLOAT_INT <= value <= MAX_EXACT_FLOAT_INT:
+            self.kinds.append(CELL_INT)
+            self.numbers.append(value)
+        elif type(value) is float:
+            if value != value:
+                self.kinds.append(CELL_ERROR)
+            else:
+                self.kinds.append(CELL_FLOAT)
+            self.numbers.append(value)
+        else:
+            self.others[len(self.kinds)] = value
+            self.kinds.append(CELL_OTHER)
+            self.numbers.append(0.0)
+
+    def truncate(self, rows):
+        del self.kinds[rows:]
+        del self.numbers[rows:]
+
+    def value(self, row, strings):
+        kind, number = self.kinds[row], self.numbers[row]
+        if kind == CELL_EMPTY:
+            return ""
+        elif kind == CELL_TEXT:
+            return strings[int(number)]
+        elif kind == CELL_INT:
+            return int(number)
+        elif kind == CELL_FLOAT:
+            return number
+        elif kind == CELL_ERROR:
+            return np.nan
+        return self.others[row]
+
+    def values(self, strings, start=0):
+        return [self.value(row, strings) for row in range(start, len(self.kinds))]
+
+def read_trn_model_streaming(file_path):
+    # Same result as read_trn_model without a list-of-rows copy of the sheet. Rows are
+    # streamed into per-column typed buffers (9 bytes per cell plus one copy of each
+    # distinct string); the frame is then built STREAMING_BATCH_CELLS at a time, so the
+    # transient Python objects never exceed one batch on top of the final frame.
+    workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    strings = {}
+    columns = []
+    label_codes = array('i')
+    indents = array('H')
+    rows = 0
+    max_width = 0
+    last_row_with_data = -1
+    try:
+        sheet = workbook['Trn Model']
+        sheet.reset_dimensions()
+        for row_number, row in enumerate(sheet.rows):
+            if row_number % PROGRESS_ROWS == 0:
+                diagnostics.progress('parse', rows=row_number)
+            label, indent = extract_cell_hierarchy(row[0] if row else EMPTY_CELL)
+            label_codes.append(strings.setdefault(label, len(strings)) if label else -1)
+            indents.append(indent)
+
+            width = 0
+            for position, cell in enumerate(row):
+                if position == len(columns):
+                    columns.append(ColumnBuffer(rows))
+                value = convert_cell(cell)
+                columns[position].append(value, strings)
+                if not (isinstance(value, str) and value == ""):
+                    width = position + 1
+            for buffer in columns[len(row):]:
+                buffer.append(None, strings)
+            if width:
+                last_row_with_data = row_number
+                max_width = max(max_width, width)
+            rows += 1
+    finally:
+        workbook.close()
+
+    rows = last_row_with_data + 1
+    columns = columns[:max_width]
+    for buffer in columns:
+        buffer.truncate(rows)
+    string_table = list(strings)
+    hierarchical_data = [(string_table[code] if code >= 0 else None, indent)
+                         for code, indent in zip(label_codes, indents)]
+    if not columns:
+        raise pd.errors.EmptyDataError("No columns to parse from file")
+
+    header = [buffer.value(0, string_table) for buffer in columns]
+    names = list(TextParser([header], header=0, skip_blank_lines=False).read().columns)
+    frames = []
+    batch_columns = max(1, STREAMING_BATCH_CELLS // max(rows, 1))
+    for start in range(0, len(columns), batch_columns):
+        batch = columns[start:start + batch_columns]
+        data = [list(values) for values in zip(*(buffer.values(string_table, 1) for buffer in batch))]
+        frames.append(TextParser(data, header=None, names=names[start:start + batch_columns],
+                                 skip_blank_lines=False).read())
+        del data
+    df = pd.concat(frames, axis=1) if len(frames) > 1 else frames[0]
+    return df, hierarchical_data
+
+def convert_cell(cell):
+    # Mirrors pandas' openpyxl reader so values match pd.read_excel output
+    if cell.value is None:
+        return ""
+    elif cell.data_type == TYPE_ERROR:
+        return np.nan
+    elif cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        return val if val == cell.value else float(cell.value)
+    return cell.value
+
+def compact_value_columns(df):
+    # Transaction columns holding only numbers (below the sub-column label in the first row)
+    # are stored as float64 instead of boxed Python objects. Blank cells become NaN, which is
+    # what process_transaction_data turns them into anyway.
+    positions = sorted({p for positions, _ in df.attrs.get('column_index', {}).values() for p in positions})
+    numeric_columns = NumericColumns()
+    arrays = {}
+    for position in positions:
+        column = df.iloc[:, position]
+        if column.dtype != object or len(column) == 0:
+            continue
+        values = column.to_numpy()
+        numbers = numeric_values(values[1:])
+        if numbers is not None:
+            numeric_columns[position] = values[0]
+            arrays[position] = np.concatenate([[np.nan], numbers])
+    if not arrays:
+        return df
+    data = {i: arrays[i] if i in arrays else df.iloc[:, i].array for i in range(df.shape[1])}
+    compact = pd.DataFrame(data, index=df.index, copy=False)
+    compact.columns = df.columns
+    compact.attrs = dict(df.attrs, numeric_columns=numeric_columns)
+    return compact
+
+def numeric_values(values):
+    # Returns values as float64 if every non-blank one is an int or float that float64 holds
+    # exactly, else None
+    blank = pd.isna(values) | (values == '')
+    rest = values[~blank]
+    kind = pd.api.types.infer_dtype(rest, skipna=False)
+    if kind in ('mixed', 'mixed-integer', 'string'):
+        whitespace = np.fromiter((isinstance(v, str) and v.isspace() for v in rest), dtype=bool, count=len(rest))
+        if not whitespace.any():
+            return None
+        blank[np.flatnonzero(~blank)[whitespace]] = True
+        rest = rest[~whitespace]
+        kind = pd.api.types.infer_dtype(rest, skipna=False)
+    if kind not in ('integer', 'floating', 'mixed-integer-float', 'empty'):
+        return None
+    try:
+        numbers = rest.astype(np.float64)
+    except OverflowError:
+        return None
+    if len(numbers) and kind != 'floating' and np.abs(numbers).max() > MAX_EXACT_FLOAT_INT:
+        return None
+    result = np.full(len(values), np.nan)
+    result[~blank] = numbers
+    return result
+
+def restore_numeric_values(numbers):
+    # Inverse of compact_value_columns for extracted cells: the reader only yields floats
+    # for non-integral numbers, so integral values go back to being ints
+    values = numbers.astype(object)
+    integral = np.isfinite(numbers) & (numbers == np.floor(numbers))
+    values[integral] = numbers[integral].astype(np.int64).tolist()
+    return values
 
 def create_hierarchy(file_path):
     try:
         workbook = load_workbook(file_path, data_only=True)
         sheet = workbook['Trn Model']
         hierarchical_data = extract_hierarchical_data(sheet)
-        filled_data = fill_hierarchical_data(hierarchical_data)
-        hierarchy = []
-        current_path = []
-        for value, indent in filled_data:
-            current_path = current_path[:indent] + [''] * (indent - len(current_path)) + [value]
-            hierarchy.append('_'.join(filter(None, current_path)))
-        logging.info(f"Hierarchy created with {len(hierarchy)} elements")
-        return hierarchy
+        return build_hierarchy(hierarchical_data)
+    except Exception as e:
+        logging.error(f"Error creating hierarchy: {str(e)}")
+        return []
+
+def hierarchy_levels(hierarchical_data):
+    # (codes, labels): for every indent level used in the sheet, each row's label at that
+    # level as a code into labels, -1 where it has none; a (levels, rows) array built over
+    # whole arrays. A row's label at a shallower level is the label of the last row at that
+    # level, unless a row at an even shallower level came in between.
+    values, indents = zip(*fill_hierarchical_data(hierarchical_data))
+    label_codes, labels = pd.factorize(np.array([value or None for value in values], dtype=object))
+    indents = np.asarray(indents, dtype=np.int64)
+    positions = np.arange(len(indents))
+    used_levels = np.unique(indents)
+    codes = np.full((len(used_levels), len(indents)), -1, dtype=np.int64)
+    for codes_at_level, level in zip(codes, used_levels):
+        last_at_level = np.maximum.accumulate(np.where(indents == level, positions, -1))
+        last_above_level = np.maximum.accumulate(np.where(indents < level, positions, -1))
+        inherited = (indents > level) & (last_at_level > last_above_level)
+        codes_at_level[inherited] = label_codes[last_at_level[inherited]]
+        codes_at_level[indents == level] = label_codes[indents == level]
+    return codes, np.asarray(labels, dtype=object)
+
+def build_hierarchy(hierarchical_data):
+    # The underscore-joined label path of every row. Rows under the same label share one
+    # path string.
+    try:
+        if not hierarchical_data:
+            return []
+        codes, labels = hierarchy_levels(hierarchical_data)
+        # Code -1 picks the appended ''
+        components = np.append(labels, '')[codes]
+        paths = np.full(codes.shape[1], '', dtype=object)
+        for components_at_level in components:
+            # '_'.join of the non-empty components, one level at a time
+            join = (paths != '') & (components_at_level != '')
+            paths[join] = paths[join] + '_' + components_at_level[join]
+            start = (paths == '') & (components_at_level != '')
+            paths[start] = components_at_level[start]
+        path_codes, uniques = pd.factorize(paths)
+        return np.asarray(uniques, dtype=object)[path_codes].tolist()
     except Exception as e:
         logging.error(f"Error creating hierarchy: {str(e)}")
         return []
 
+def build_hierarchy_tree(hierarchical_data):
+    # Same paths as build_hierarchy, kept as a tree instead of joined strings. Rows are grouped
+    # by their label codes at every level, so only the first row of each distinct path is
+    # turned into a tuple; nodes are numbered in the order their paths first occur.
+    try:
+        if not hierarchical_data:
+            return HierarchyTree([()], np.zeros(0, dtype=np.int32))
+        codes, labels = hierarchy_levels(hierarchical_data)
+        # One code per distinct combination of labels, numbered in order of first occurrence
+        row_paths = np.zeros(codes.shape[1], dtype=np.int64)
+        for codes_at_level in codes:
+            row_paths, _ = pd.factorize(row_paths * (len(labels) + 1) + codes_at_level + 1)
+        first_rows = np.zeros(row_paths.max() + 1, dtype=np.intp)
+        first_rows[row_paths[::-1]] = np.arange(len(row_paths))[::-1]
+        labels = labels.tolist()
+        node_ids = {(): 0}
+        path_nodes = np.zeros(len(first_rows), dtype=np.int32)
+        for distinct, path_codes in enumerate(codes[:, first_rows].T.tolist()):
+            path = tuple(labels[code] for code in path_codes if code >= 0)
+            node = node_ids.get(path)
+            if node is None:
+                for depth in range(1, len(path) + 1):
+                    node = node_ids.setdefault(path[:depth], len(node_ids))
+            path_nodes[distinct] = node
+        return HierarchyTree(list(node_ids), path_nodes[row_paths])
+    except Exception as e:
+        logging.error(f"Error creating hierarchy tree: {str(e)}")
+        return HierarchyTree([()], np.zeros(len(hierarchical_data), dtype=np.int32))
+
 def extract_hierarchical_data(sheet):
-    return [(cell.value.strip() if cell.value else None, get_indentation_level(cell))
-            for row in sheet.iter_rows(min_row=1, max_col=1) for cell in row]
+    return [extract_cell_hierarchy(cell) for row in sheet.iter_rows(min_row=1, max_col=1) for cell in row]
+
+def extract_cell_hierarchy(cell):
+    return (cell.value.strip() if cell.value else None, get_indentation_level(cell))
 
 def get_indentation_level(cell):
     return int(cell.alignment.indent) if cell.alignment and cell.alignment.indent else 0
@@ -72,82 +623,193 @@ def fill_hierarchical_data(hierarchical_data):
     return filled_data
 
 def generate_row_identifiers(df, hierarchy):
+    # Hierarchy path plus '.Variable' for rows whose Variable is set (not blank, NaN or 0),
+    # built over whole columns
     try:
-        def create_identifier(row, hier_value):
-            variable = getattr(row, 'Variable', None)
-            variable = variable if pd.notna(variable) and variable != '' else None
-            return f"{hier_value}.{variable}" if variable else hier_value
-        row_identifiers = [create_identifier(row, hier) for row, hier in zip(df.itertuples(index=False), hierarchy)]
-        logging.info(f"Generated {len(row_identifiers)} row identifiers")
-        return row_identifiers
+        rows = min(len(df), len(hierarchy))
+        row_identifiers = np.array(hierarchy[:rows], dtype=object)
+        if 'Variable' in df.columns:
+            variables = df.iloc[:rows, list(df.columns).index('Variable')].to_numpy(dtype=object)
+            has_variable = ~pd.isna(variables)
+            has_variable[has_variable] = variables[has_variable].astype(bool)
+            row_identifiers[has_variable] = row_identifiers[has_variable] + '.' + TO_STRING(variables[has_variable])
+        return row_identifiers.tolist()
     except Exception as e:
         logging.error(f"Error generating row identifiers: {str(e)}")
         return []
 
 def generate_column_identifiers(df):
+    column_identifiers, _ = generate_column_labels(df)
+    return column_identifiers
+
+def generate_column_labels(df):
+    # Returns the column identifiers and, per column, the header group it belongs to. The
+    # first row is read once; an 'Unnamed' column whose first cell is set belongs to the
+    # last named column before it.
     try:
-        column_identifiers = []
-        last_valid_column_name = None
-        for col in df.columns:
-            column_name = str(col).strip() if pd.notna(col) and str(col).strip() else ""
-            if "Unnamed" in str(col):
-                column_name = last_valid_column_name if pd.notna(df.iloc[0][col]) and str(df.iloc[0][col]).strip() else f"Unnamed_{col}"
-            else:
-                last_valid_column_name = column_name
-            first_row_value = str(df.iloc[0][col]).strip() if pd.notna(df.iloc[0][col]) and str(df.iloc[0][col]).strip() else ""
-            column_identifier = f"{column_name}_{first_row_value}" if column_name and first_row_value else column_name or first_row_value
-            column_identifiers.append(column_identifier if column_identifier else col)
-        logging.info(f"Generated {len(column_identifiers)} column identifiers")
-        return column_identifiers
+        columns = df.columns.to_numpy(dtype=object)
+        first_row = df.iloc[0].to_numpy(dtype=object)
+        names = stripped_text(columns)
+        first_values = stripped_text(first_row)
+        unnamed = np.array(['Unnamed' in text for text in TO_STRING(columns)], dtype=bool)
+
+        # The last named column at or before each position; None before the first one
+        named_positions = np.maximum.accumulate(np.where(~unnamed, np.arange(len(columns)), -1))
+        last_named = np.append(names, None)[named_positions]
+        column_names = names.copy()
+        grouped = unnamed & (first_values != '')
+        column_names[grouped] = last_named[grouped]
+        orphan = unnamed & (first_values == '')
+        column_names[orphan] = 'Unnamed_' + TO_STRING(columns[orphan])
+        column_groups = np.where(unnamed & ~grouped, None, column_names)
+
+        column_identifiers = np.where(pd.isna(column_names), '', column_names)
+        both = (column_identifiers != '') & (first_values != '')
+        column_identifiers[both] = column_identifiers[both] + '_' + first_values[both]
+        first_only = (column_identifiers == '') & (first_values != '')
+        column_identifiers[first_only] = first_values[first_only]
+        unlabelled = column_identifiers == ''
+        column_identifiers[unlabelled] = columns[unlabelled]
+        return column_identifiers.tolist(), column_groups.tolist()
     except Exception as e:
         logging.error(f"Error generating column identifiers: {str(e)}")
-        return []
+        return [], []
+
+TO_STRING = np.frompyfunc(str, 1, 1)
+STRIP = np.frompyfunc(str.strip, 1, 1)
+
+def stripped_text(values):
+    # str(value).strip() of each value, '' for missing values
+    text = np.full(len(values), '', dtype=object)
+    present = ~pd.isna(values)
+    text[present] = STRIP(TO_STRING(values[present]))
+    return text
+
+def build_column_index(transaction_types, kept_columns, column_identifiers):
+    # kept_columns holds (original sheet position, header group) for each remaining column
+    wanted = {transaction_type.strip() for transaction_type in transaction_types}
+    column_index = TransactionColumnIndex()
+    for position, (sheet_position, group) in enumerate(kept_columns):
+        if sheet_position < TRANSACTION_COLUMNS_START or group not in wanted:
+            continue
+        positions, labels = column_index.setdefault(group, ([], []))
+        positions.append(position)
+        labels.append(sub_column_label(column_identifiers[position], group))
+    return column_index
 
-def present_transaction_data(df, transaction_type):
+def sub_column_label(column_identifier, transaction_type):
+    prefix = f"{transaction_type}_"
+    column_identifier = str(column_identifier)
+    return column_identifier[len(prefix):] if column_identifier.startswith(prefix) else column_identifier
+
+def transaction_columns(df, transaction_type):
+    transaction_type = transaction_type.strip()
+    column_index = df.attrs.get('column_index')
+    if column_index is not None:
+        return column_index.get(transaction_type, ([], []))
+    # Frames built outside process_excel_file carry no index; fall back to exact name matching
+    positions, labels = [], []
+    for position, col in enumerate(df.columns):
+        col = str(col)
+        if col == transaction_type or col.startswith(f"{transaction_type}_"):
+            positions.append(position)
+            labels.append(sub_column_label(col, transaction_type))
+    return positions, labels
+
+def present_transaction_data(df, transaction_type, rows=None):
     try:
-        processed_df = process_transaction_data(df, transaction_type)
-        columns = ['Category', 'Variable'] + [col for col in processed_df.columns if col not in ['Unique_ID', 'Category', 'Variable']]
-        processed_df = processed_df[columns].fillna('')
+        processed_df = transaction_display_frame(process_transaction_data(df, transaction_type, rows)).fillna('')
         table = tabulate(processed_df, headers='keys', tablefmt='psql', disable_numparse=True, showindex=False)
         table_lines = table.split('\n')
         header = table_lines[1]
         header_underline = table_lines[2]
         data_rows = [line for line in table_lines[3:] if not set(line).issubset(set('+-|'))]
         cleaned_table = '\n'.join([f"Transaction Type: {transaction_type}\n", header, header_underline] + data_rows)
-        logging.info(f"Presented transaction data for type: {transaction_type}")
         return cleaned_table
     except Exception as e:
         logging.error(f"Error presenting transaction data: {str(e)}")
         return "Error presenting transaction data."
 
-def process_transaction_data(df, transaction_type):
-    try:
-        logging.info(f"Initial DataFrame shape: {df.shape}")
-        pattern = f'(?i){transaction_type.strip()}'
-        logging.info(f"Using regex pattern: {pattern}")
-
-        # Log the column names to inspect if there's any discrepancy
-        logging.info(f"Column names: {df.columns.tolist()}")
-
-        filtered_df = df.filter(regex=pattern)
-        logging.info(f"Filtered DataFrame shape (after regex): {filtered_df.shape}")
+def transaction_display_frame(processed_df):
+    columns = ['Category', 'Variable'] + [col for col in processed_df.columns if col not in ['Unique_ID', 'Category', 'Variable']]
+    return processed_df[columns]
 
-        filtered_df = filtered_df.replace(r'^\s*$', np.nan, regex=True)
-        logging.info(f"Filtered DataFrame shape (after replacing empty strings): {filtered_df.shape}")
+def process_transaction_data(df, transaction_type, rows=None):
+    # rows, if given, limits the extraction to those row positions (see branch_rows)
+    try:
+        row_keys = df.attrs.get('row_keys')
+        if row_keys is not None and len(row_keys) == len(df):
+            return extract_transaction_data(df, transaction_type, row_keys, rows)
+        with diagnostics.stage('filter', transaction_type=transaction_type) as record:
+            positions, labels = transaction_columns(df, transaction_type)
+            filtered_df = df.iloc[:, positions] if rows is None else df.iloc[rows, positions]
+            filtered_df.columns = labels
 
-        filtered_df = filtered_df.dropna(how='all')
-        logging.info(f"Filtered DataFrame shape (after dropping all-NaN rows): {filtered_df.shape}")
+            filtered_df = filtered_df.replace(r'^\s*$', np.nan, regex=True)
 
-        filtered_df = filtered_df.rename(columns=lambda x: x.split('_', 1)[-1])
-        filtered_df = filtered_df.reset_index()
+            filtered_df = filtered_df.dropna(how='all')
 
-        filtered_df = filtered_df.assign(
-            Category=lambda x: x['Unique_ID'].str.split('.').str[0],
-            Variable=lambda x: x['Unique_ID'].str.split('.').str[1]
-        ).dropna(subset=['Category', 'Variable'])
+            filtered_df = filtered_df.reset_index()
 
-        logging.info(f"Processed transaction data for type: {transaction_type} with {filtered_df.shape[0]} rows")
+            filtered_df = filtered_df.assign(
+                Category=lambda x: x['Unique_ID'].str.split('.').str[0],
+                Variable=lambda x: x['Unique_ID'].str.split('.').str[1]
+            ).dropna(subset=['Category', 'Variable'])
+            record.update(input_rows=df.shape[0], rows=filtered_df.shape[0], columns=len(positions))
         return filtered_df
     except Exception as e:
         logging.error(f"Error processing transaction data: {str(e)}")
         return pd.DataFrame()
+
+def is_blank_text(value):
+    # Strings process_transaction_data treats as empty cells
+    return isinstance(value, str) and (not value or value.isspace())
+
+def is_blank(value):
+    return is_blank_text(value) or (not isinstance(value, str) and pd.isna(value))
+
+def extract_transaction_data(df, transaction_type, row_keys, rows=None):
+    # Same result as the generic path in process_transaction_data, but works column by column
+    # on the stored arrays and reuses the Category/Variable split made at load. rows limits the
+    # extraction to those row positions, which then also serve as the index.
+    with diagnostics.stage('filter', transaction_type=transaction_type) as record:
+        positions, labels = transaction_columns(df, transaction_type)
+        numeric_columns = df.attrs.get('numeric_columns', {})
+        row_positions = np.arange(len(df)) if rows is None else np.asarray(rows, dtype=np.intp)
+        first_row = len(row_positions) > 0 and row_positions[0] == 0
+        columns = []
+        populated = np.zeros(len(row_positions), dtype=bool)
+        for position in positions:
+            column = df.iloc[:, position] if rows is None else df.iloc[row_positions, position]
+            values = column.to_numpy()
+            if values.dtype == object:
+                blank = np.fromiter((is_blank_text(v) for v in values), dtype=bool, count=len(values))
+                if blank.any():
+                    values = values.copy()
+                    values[blank] = np.nan
+            populated |= ~pd.isna(values)
+            if position in numeric_columns and first_row:
+                populated[0] |= not is_blank(numeric_columns[position])
+            columns.append(values)
+
+        keep = populated & row_keys.has_variable[row_positions]
+        kept_rows = row_positions[keep]
+        if rows is None:
+            # The generic path numbers rows after dropping blank ones and before dropping those without a Variable
+            index = (np.cumsum(populated) - 1)[keep]
+        else:
+            index = kept_rows
+        data = {'Unique_ID': df.index[kept_rows]}
+        for i, (position, values) in enumerate(zip(positions, columns)):
+            values = values[keep]
+            if position in numeric_columns:
+                values = restore_numeric_values(values)
+                if first_row and keep[0] and not is_blank(numeric_columns[position]):
+                    values[0] = numeric_columns[position]
+            data[i] = values
+        filtered_df = pd.DataFrame(data, index=index)
+        filtered_df.columns = ['Unique_ID'] + list(labels)
+        filtered_df['Category'] = pd.Series(np.asarray(row_keys.category[kept_rows], dtype=object), index=index, dtype=object)
+        filtered_df['Variable'] = pd.Series(np.asarray(row_keys.variable[kept_rows], dtype=object), index=index, dtype=object)
+        record.update(input_rows=len(row_positions), rows=filtered_df.shape[0], columns=len(positions))
+    return filtered_df
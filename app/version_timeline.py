@@ -0,0 +1,106 @@
+# app/version_timeline.py
+
+import pandas as pd
+from diff_engine import CHANGE_COLUMNS, CHANGE_ORDER, compare_transaction_frames, generate_difference_explanation
+
+STEP_COLUMNS = ['Step', 'From Version', 'To Version']
+
+def diff_versions(processed_df1, processed_df2, label1, label2, step):
+    diff_df1, diff_df2 = compare_transaction_frames(processed_df1, processed_df2)
+    changes_df = generate_difference_explanation(diff_df1, diff_df2, label1, label2)
+    changes_df.insert(0, 'Step', step)
+    changes_df.insert(1, 'From Version', label1)
+    changes_df.insert(2, 'To Version', label2)
+    return changes_df.reset_index(drop=True)
+
+def describe_change(change_type, column, old, new):
+    if column == 'Entire Row':
+        return f"row {change_type.lower()}"
+    if change_type == 'Added':
+        return f"+ {new}"
+    if change_type == 'Removed':
+        return f"- {old}"
+    return f"{old} → {new}"
+
+class VersionTimeline:
+    # Versions of one transaction type in upload order. Each added version is diffed against
+    # the previous one (and against the first one when compare_to_baseline is set); earlier
+    # frames and diffs are kept, so adding a version costs one extraction and one diff.
+    def __init__(self, transaction_type, compare_to_baseline=False):
+        self.transaction_type = transaction_type
+        self.compare_to_baseline = compare_to_baseline
+        self.keys = []
+        self.labels = []
+        self.frames = []
+        self.consecutive = []
+        self.against_baseline = []
+
+    def copy(self):
+        # Shares the frames and diffs, which are never modified, but not the lists holding them
+        timeline = VersionTimeline(self.transaction_type, self.compare_to_baseline)
+        timeline.keys, timeline.labels, timeline.frames = list(self.keys), list(self.labels), list(self.frames)
+        timeline.consecutive, timeline.against_baseline = list(self.consecutive), list(self.against_baseline)
+        return timeline
+
+    def add_version(self, key, label, processed_df):
+        if self.frames:
+            step = len(self.frames)
+            self.consecutive.append(diff_versions(self.frames[-1], processed_df, self.labels[-1], label, step))
+            if self.compare_to_baseline:
+                self.against_baseline.append(diff_versions(self.frames[0], processed_df, self.labels[0], label, step))
+        self.keys.append(key)
+        self.labels.append(label)
+        self.frames.append(processed_df)
+
+    def truncate(self, count):
+        del self.keys[count:], self.labels[count:], self.frames[count:]
+        del self.consecutive[max(count - 1, 0):], self.against_baseline[max(count - 1, 0):]
+
+    def sync(self, versions, load):
+        # versions is the wanted [(key, label), ...]; only versions after the first
+        # mismatch with the current timeline are loaded (load(key) -> processed frame) and diffed
+        common = 0
+        while common < min(len(self.keys), len(versions)) and self.keys[common] == versions[common][0]:
+            common += 1
+        self.truncate(common)
+        for key, label in versions[common:]:
+            self.add_version(key, label, load(key))
+
+    def changes(self, baseline=False):
+        steps = self.against_baseline if baseline else self.consecutive
+        if not steps:
+            return pd.DataFrame(columns=STEP_COLUMNS + CHANGE_COLUMNS)
+        return pd.concat(steps, ignore_index=True)
+
+    def summary(self):
+        rows = []
+        for step, changes_df in enumerate(self.consecutive, start=1):
+            counts = changes_df['Change Type'].value_counts()
+            rows.append({
+                'Step': step,
+                'From Version': self.labels[step - 1],
+                'To Version': self.labels[step],
+                **{change_type: int(counts.get(change_type, 0)) for change_type in CHANGE_ORDER},
+            })
+        return pd.DataFrame(rows, columns=STEP_COLUMNS + list(CHANGE_ORDER))
+
+    def cell_timeline(self):
+        # One row per cell that changed at least once, one column per consecutive step
+        changes_df = self.changes()
+        step_labels = [f"{i + 1}: {self.labels[i]} → {self.labels[i + 1]}" for i in range(len(self.consecutive))]
+        if changes_df.empty:
+            return pd.DataFrame(columns=['Category', 'Variable', 'Column', 'Changes'] + step_labels)
+        descriptions = [describe_change(*values) for values in
+                        zip(changes_df['Change Type'], changes_df['Column'], changes_df['From'], changes_df['To'])]
+        cells = pd.DataFrame({
+            'Category': changes_df['Category'],
+            'Variable': changes_df['Variable'],
+            'Column': changes_df['Column'],
+            'Step': [step_labels[step - 1] for step in changes_df['Step']],
+            'Description': descriptions,
+        })
+        timeline = cells.groupby(['Category', 'Variable', 'Column', 'Step'], sort=False)['Description'].first().unstack('Step')
+        timeline = timeline.reindex(columns=step_labels)
+        timeline.insert(0, 'Changes', timeline.notna().sum(axis=1))
+        timeline.columns.name = None
+        return timeline.reset_index()
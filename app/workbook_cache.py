@@ -0,0 +1,236 @@
+# app/workbook_cache.py
+
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from utils import load_transaction_types, process_workbook
+from diagnostics import diagnostics
+
+DEFAULT_MEMORY_BUDGET = int(os.environ.get('WORKBOOK_CACHE_BYTES', 1024 ** 3))
+PARSE_WORKERS = int(os.environ.get('WORKBOOK_PARSE_WORKERS', 2))
+
+def content_key(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+_progress_queue = None
+
+def _init_parse_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+def parse_workbook_bytes(file_bytes, key):
+    # Runs in a parse worker; the frame comes back pickled together with its attrs indexes,
+    # and stage progress is sent back over the queue tagged with the workbook key
+    def forward(stage, details):
+        _progress_queue.put((key, stage, details))
+    with diagnostics.listen(forward):
+        return process_workbook(io.BytesIO(file_bytes))
+
+class CachedWorkbook:
+    def __init__(self, key, file_bytes):
+        self.key = key
+        self.file_bytes = file_bytes
+        self.transaction_types = None
+        self.df = None
+        self.hierarchy = None
+        self.pending = None
+        self.pending_pool = None
+        self.progress = None
+        self.nbytes = 0
+
+    def open(self):
+        # BytesIO over an unmodified bytes object shares its buffer rather than copying it
+        return io.BytesIO(self.file_bytes)
+
+    def update_size(self):
+        size = len(self.file_bytes)
+        if self.df is not None:
+            size += int(self.df.memory_usage(deep=True).sum())
+        if self.hierarchy is not None:
+            size += sum(sys.getsizeof(label) for label in self.hierarchy)
+        if self.transaction_types is not None:
+            size += sum(sys.getsizeof(t) for t in self.transaction_types)
+        self.nbytes = size
+
+class WorkbookCache:
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, parse_workers=PARSE_WORKERS):
+        self.memory_budget = memory_budget
+        self.parse_workers = parse_workers
+        self._parse_pool = None
+        self._progress_queue = None
+        self._entries = OrderedDict()
+        self._keys_by_id = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key_for(self, file_bytes):
+        # Streamlit hands back the same bytes object on every rerun, so a cached entry
+        # holding that exact object lets us skip re-hashing the upload
+        with self._lock:
+            key = self._keys_by_id.get(id(file_bytes))
+            entry = self._entries.get(key) if key else None
+            if entry is not None and entry.file_bytes is file_bytes:
+                return key
+        return content_key(file_bytes)
+
+    def _entry(self, file_bytes):
+        key = self.key_for(file_bytes)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = CachedWorkbook(key, file_bytes)
+            elif entry.file_bytes is not file_bytes:
+                # Same content in a new object: track the latest one for key_for
+                self._keys_by_id.pop(id(entry.file_bytes), None)
+                entry.file_bytes = file_bytes
+            self._entries.move_to_end(key)
+            self._keys_by_id[id(file_bytes)] = key
+        return entry
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _store(self, entry):
+        entry.update_size()
+        with self._lock:
+            if entry.key not in self._entries:
+                return
+            self._entries.move_to_end(entry.key)
+            total = sum(e.nbytes for e in self._entries.values())
+            while total > self.memory_budget and len(self._entries) > 1:
+                key, evicted = self._entries.popitem(last=False)
+                self._keys_by_id.pop(id(evicted.file_bytes), None)
+                total -= evicted.nbytes
+                self.evictions += 1
+                logging.debug(f"Evicted cached workbook {key[:12]} ({evicted.nbytes} bytes)")
+
+    def get_transaction_types(self, file_bytes):
+        entry = self._entry(file_bytes)
+        self._record(entry.transaction_types is not None)
+        if entry.transaction_types is None:
+            entry.transaction_types = load_transaction_types(entry.open())
+            self._store(entry)
+        return entry.transaction_types
+
+    def prefetch(self, file_bytes):
+        # Starts parsing the workbook in a worker process without waiting for it;
+        # get_processed_workbook picks up the result
+        if self.parse_workers < 1:
+            return
+        entry = self._entry(file_bytes)
+        with self._lock:
+            if entry.df is not None or entry.pending is not None:
+                return
+            try:
+                pool = self._pool()
+                entry.pending = pool.submit(parse_workbook_bytes, entry.file_bytes, entry.key)
+                entry.pending_pool = pool
+            except BrokenProcessPool as e:
+                # get_processed_workbook parses this upload in process; the next prefetch
+                # starts a new pool
+                logging.error(f"Parse worker pool is broken, parsing in process instead: {str(e)}")
+                self._discard_pool(self._parse_pool)
+
+    def _pool(self):
+        # Called with the lock held
+        if self._parse_pool is None:
+            # Workers are spawned, not forked: a fork of the threaded Streamlit server can
+            # copy a lock another thread holds (logging, this cache) and hang the child
+            context = multiprocessing.get_context('spawn')
+            progress_queue = context.Queue()
+            self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=context,
+                                                   initializer=_init_parse_worker, initargs=(progress_queue,))
+            self._progress_queue = progress_queue
+            threading.Thread(target=self._receive_progress, args=(progress_queue,), daemon=True).start()
+        return self._parse_pool
+
+    def _discard_pool(self, pool):
+        # A worker that dies (e.g. killed for memory) breaks the whole pool for good, so it is
+        # shut down and replaced on the next prefetch. Called with the lock held.
+        if pool is None or pool is not self._parse_pool:
+            return
+        self._parse_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        self._progress_queue.put(None)
+
+    def _receive_progress(self, progress_queue):
+        while True:
+            message = progress_queue.get()
+            if message is None:
+                return
+            key, stage, details = message
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.progress = (stage, details)
+
+    def _wait_for_worker(self, entry, pending):
+        # Relays the worker's progress to this thread's listener while waiting; a cancelled
+        # job stops waiting here and the parse still lands in the cache for later callers
+        while True:
+            try:
+                return pending.result(timeout=0.2)
+            except TimeoutError:
+                stage, details = entry.progress or ('parse', {})
+                diagnostics.progress(stage, **details)
+
+    def get_processed_workbook(self, file_bytes):
+        # The cached DataFrame is shared between reruns and sessions; callers must not mutate it
+        entry = self._entry(file_bytes)
+        self._record(entry.df is not None)
+        if entry.df is None:
+            df = hierarchy = None
+            pending = entry.pending
+            if pending is not None:
+                try:
+                    with diagnostics.stage('parse', reader='worker') as record:
+                        df, hierarchy = self._wait_for_worker(entry, pending)
+                        record.update(rows=df.shape[0], columns=df.shape[1])
+                except BrokenProcessPool as e:
+                    logging.error(f"Parse worker pool is broken, parsing in process instead: {str(e)}")
+                    with self._lock:
+                        self._discard_pool(entry.pending_pool)
+                except Exception as e:
+                    logging.error(f"Parse worker failed, parsing in process instead: {str(e)}")
+            if df is None:
+                df, hierarchy = process_workbook(entry.open())
+            entry.df, entry.hierarchy, entry.pending, entry.pending_pool = df, hierarchy, None, None
+            self._store(entry)
+        return entry.df, entry.hierarchy
+
+    def get_processed_workbooks(self, *file_bytes_list):
+        # Parses all uncached workbooks in parallel worker processes
+        for file_bytes in file_bytes_list:
+            self.prefetch(file_bytes)
+        return [self.get_processed_workbook(file_bytes) for file_bytes in file_bytes_list]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': sum(e.nbytes for e in self._entries.values()),
+                'memory_budget': self.memory_budget,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_id.clear()
+
+workbook_cache = WorkbookCache()
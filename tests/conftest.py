@@ -0,0 +1,7 @@
+# tests/conftest.py
+
+import os
+import sys
+
+# The app modules import each other by bare name, as when run with `streamlit run app/main.py`
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
@@ -0,0 +1,21 @@
+# tests/test_cli.py
+
+import os
+from cli import main, output_names
+from synthetic_workbook import SyntheticModelSpec, write_synthetic_models
+
+def test_output_names_tell_apart_workbooks_with_the_same_file_name():
+    names = output_names(['models/2024-05/model.xlsx', 'models/2024-06/model.xlsx', 'models/2024-06/other.xlsx'])
+    assert names == ['2024-05_model', '2024-06_model', 'other']
+    assert output_names(['a/model.xlsx', 'a/model.xlsx']) == ['model', 'model_2']
+
+def test_process_keeps_versions_with_the_same_file_name_apart(tmp_path):
+    for month, seed in (('2024-05', 1), ('2024-06', 2)):
+        os.makedirs(tmp_path / month)
+        write_synthetic_models(SyntheticModelSpec(rows=40, transaction_types=2, seed=seed), tmp_path / month / 'model.xlsx')
+    output_dir = tmp_path / 'out'
+    assert main(['--output-dir', str(output_dir), '--workers', '2', 'process',
+                 str(tmp_path / '2024-05'), str(tmp_path / '2024-06')]) == 0
+    assert sorted(os.listdir(output_dir)) == ['2024-05_model', '2024-06_model']
+    extracts = [(output_dir / name / 'Transaction_000.csv').read_text() for name in ('2024-05_model', '2024-06_model')]
+    assert extracts[0] != extracts[1]
@@ -0,0 +1,158 @@
+# tests/test_diff_engine.py
+
+import numpy as np
+import pandas as pd
+import pytest
+import row_fingerprints
+from openpyxl import Workbook
+from diff_engine import CHANGE_COLUMNS, compare_models, compare_transaction_frames, generate_difference_explanation
+from type_similarity import compare_encoded, encode_transaction_types
+from synthetic_workbook import METADATA_COLUMNS, SyntheticModelSpec, write_synthetic_models
+from utils import process_excel_file, process_transaction_data
+
+def write_uneven_types_model(path):
+    # Buy has Dr and Cr, Sell also has an Amount sub-column
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = 'Trn Model'
+    sheet.append(METADATA_COLUMNS + ['Buy', None, 'Sell', None, None])
+    sheet.append([None] * len(METADATA_COLUMNS) + ['Dr', 'Cr', 'Dr', 'Cr', 'Amount'])
+    rows = [
+        ('Assets', None, [None] * 5),
+        (None, 'cash', ['GL100', 'GL200', 'GL100', 'GL201', 5]),
+        (None, 'bank', ['GL110', 'GL210', 'GL110', 'GL210', None]),
+        (None, 'loan', ['GL120', 'GL220', 'GL121', 'GL220', 'Pro rata']),
+    ]
+    for code, (label, variable, values) in enumerate(rows):
+        sheet.append([label, code, None, variable, None, None, None, None] + values)
+    workbook.save(path)
+
+@pytest.mark.parametrize('type1, type2', [('Buy', 'Sell'), ('Sell', 'Buy')])
+def test_types_with_different_sub_columns_are_compared_on_all_of_them(tmp_path, type1, type2):
+    path = tmp_path / 'uneven.xlsx'
+    write_uneven_types_model(path)
+    df = process_excel_file(str(path))
+
+    diff_df1, diff_df2 = compare_models(df, type1, df, type2)
+    assert list(diff_df1.columns) == list(diff_df2.columns)
+    assert 'Amount' in diff_df1.columns
+
+    changes = generate_difference_explanation(diff_df1, diff_df2, type1, type2)
+    cell_changes = changes[changes['Column'] != 'Entire Row']
+    assert set(cell_changes['Column']) == {'Cr', 'Dr', 'Amount'}
+    expected_type = {'Buy': 'Added', 'Sell': 'Removed'}[type1]
+    assert set(cell_changes.loc[cell_changes['Column'] == 'Amount', 'Change Type']) == {expected_type}
+
+    # The detailed view counts as many differing cells as the similarity matrix
+    encoded1, encoded2 = encode_transaction_types(df, [type1, type2])
+    differences, _ = compare_encoded(encoded1, encoded2)
+    assert len(cell_changes) == differences
+
+def per_row_difference_explanation(df1, df2, type1, type2):
+    # generate_difference_explanation as the checker tabs had it before the vectorized engine:
+    # scalar lookups for every common row and column. Rows are walked in index order rather
+    # than set order and the sort is stable, which fixes the order of ties the old code left
+    # to chance; the vectorized version orders them the same way.
+    changes = []
+    added_rows = [row for row in df2.index if row not in set(df1.index)]
+    removed_rows = [row for row in df1.index if row not in set(df2.index)]
+    for row in added_rows:
+        changes.append({'Category': df2.loc[row, 'Category'], 'Variable': df2.loc[row, 'Variable'], 'Column': 'Entire Row',
+                        'Change Type': 'Added', 'From': '', 'To': f"New row in {type2}"})
+    for row in removed_rows:
+        changes.append({'Category': df1.loc[row, 'Category'], 'Variable': df1.loc[row, 'Variable'], 'Column': 'Entire Row',
+                        'Change Type': 'Removed', 'From': f"Existing row in {type1}", 'To': ''})
+    for row in [row for row in df1.index if row in set(df2.index)]:
+        for col in df1.columns:
+            if col in ['Category', 'Variable']:
+                continue
+            val1 = df1.loc[row, col]
+            val2 = df2.loc[row, col]
+            if pd.isna(val1) and not pd.isna(val2):
+                change = ('Added', 'NaN', str(val2))
+            elif not pd.isna(val1) and pd.isna(val2):
+                change = ('Removed', str(val1), 'NaN')
+            elif not pd.isna(val1) and not pd.isna(val2) and val1 != val2:
+                change = ('Changed', str(val1), str(val2))
+            else:
+                continue
+            changes.append({'Category': df1.loc[row, 'Category'], 'Variable': df1.loc[row, 'Variable'], 'Column': col,
+                            'Change Type': change[0], 'From': change[1], 'To': change[2]})
+    changes_df = pd.DataFrame(changes, columns=CHANGE_COLUMNS)
+    changes_df['Change Order'] = changes_df['Change Type'].map({'Removed': 1, 'Changed': 2, 'Added': 3})
+    changes_df.sort_values(by=['Change Order', 'Category', 'Variable'], inplace=True, kind='stable')
+    return changes_df.drop(columns=['Change Order'])
+
+def assert_same_explanation(changes_df, expected):
+    assert len(changes_df) > 0
+    pd.testing.assert_frame_equal(changes_df.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+
+def explanation_frame(rows):
+    df = pd.DataFrame(rows, columns=['Unique_ID', 'Category', 'Variable', 'Dr', 'Cr', 'Amount'])
+    return df.set_index('Unique_ID')
+
+def test_explanation_matches_per_row_walk_on_mixed_cells():
+    # Mixed types in one column, NaN against '', and rows only one side has
+    df1 = explanation_frame([
+        ('A.x', 'A', 'x', 1, 'GL100', np.nan),
+        ('A.y', 'A', 'y', '1', '', 2.5),
+        ('B.x', 'B', 'x', True, np.nan, 'Pro rata'),
+        ('B.gone', 'B', 'gone', 4, 'GL200', 3),
+        ('C.z', 'C', 'z', 2 ** 60, 'Y', -1.0),
+    ])
+    df2 = explanation_frame([
+        ('C.z', 'C', 'z', 2 ** 60 + 1, 'Y', -1),
+        ('A.x', 'A', 'x', 1.0, 'GL101', 7),
+        ('B.new', 'B', 'new', np.nan, 'N', 1),
+        ('A.y', 'A', 'y', 1, np.nan, np.nan),
+        ('B.x', 'B', 'x', 'True', '', 'Pro rata'),
+    ])
+    assert_same_explanation(generate_difference_explanation(df1, df2, 'Buy', 'Sell'),
+                            per_row_difference_explanation(df1, df2, 'Buy', 'Sell'))
+
+def test_explanation_matches_per_row_walk_on_edited_models(tmp_path):
+    spec = SyntheticModelSpec(rows=300, transaction_types=3, sub_columns=3, edit_pct=5.0, seed=4)
+    write_synthetic_models(spec, tmp_path / 'a.xlsx', tmp_path / 'b.xlsx')
+    df1 = process_excel_file(str(tmp_path / 'a.xlsx'))
+    df2 = process_excel_file(str(tmp_path / 'b.xlsx'))
+    for transaction_type in spec.type_names():
+        diff_df1, diff_df2 = compare_transaction_frames(process_transaction_data(df1, transaction_type),
+                                                        process_transaction_data(df2, transaction_type))
+        assert_same_explanation(generate_difference_explanation(diff_df1, diff_df2, 'Sheet 1', 'Sheet 2'),
+                                per_row_difference_explanation(diff_df1, diff_df2, 'Sheet 1', 'Sheet 2'))
+
+def compare_without_fingerprints(df1, transaction_type1, df2, transaction_type2):
+    return compare_transaction_frames(process_transaction_data(df1, transaction_type1),
+                                      process_transaction_data(df2, transaction_type2))
+
+def assert_same_diff(df1, df2, transaction_types):
+    for transaction_type in transaction_types:
+        skipped = compare_models(df1, transaction_type, df2, transaction_type)
+        expected = compare_without_fingerprints(df1, transaction_type, df2, transaction_type)
+        for frame, expected_frame in zip(skipped, expected):
+            # The skip extracts fewer rows, so its frames are numbered by sheet row instead
+            pd.testing.assert_frame_equal(frame.reset_index(drop=True), expected_frame.reset_index(drop=True))
+        assert len(skipped[0]) > 0
+
+@pytest.fixture
+def edited_models(tmp_path):
+    spec = SyntheticModelSpec(rows=400, transaction_types=4, sub_columns=3, edit_pct=3.0, seed=5)
+    write_synthetic_models(spec, tmp_path / 'a.xlsx', tmp_path / 'b.xlsx')
+    return spec, str(tmp_path / 'a.xlsx'), str(tmp_path / 'b.xlsx')
+
+def test_fingerprint_skip_gives_the_full_diff(edited_models):
+    spec, path1, path2 = edited_models
+    assert_same_diff(process_excel_file(path1), process_excel_file(path2), spec.type_names())
+
+def test_fingerprint_collisions_are_caught_cell_by_cell(edited_models, monkeypatch):
+    # Every populated cell hashes alike, so edited rows collide with their originals
+    spec, path1, path2 = edited_models
+    original = row_fingerprints.cell_hashes
+    monkeypatch.setattr(row_fingerprints, 'cell_hashes',
+                        lambda values: (original(values) != row_fingerprints.MISSING_HASH).astype(np.uint64))
+    df1, df2 = process_excel_file(path1), process_excel_file(path2)
+    fingerprint1 = row_fingerprints.transaction_fingerprint(df1, spec.type_names()[0])
+    fingerprint2 = row_fingerprints.transaction_fingerprint(df2, spec.type_names()[0])
+    matches = fingerprint2.unique_ids.get_indexer(fingerprint1.unique_ids)
+    assert (fingerprint1.hashes == fingerprint2.hashes[matches]).mean() > 0.9
+    assert_same_diff(df1, df2, spec.type_names())
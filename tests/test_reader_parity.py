@@ -0,0 +1,116 @@
+# tests/test_reader_parity.py
+
+import pandas as pd
+import pytest
+import utils
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment
+from benchmark import per_row_hierarchy_tree
+from synthetic_workbook import SyntheticModelSpec, write_synthetic_models
+from utils import (build_hierarchy, build_hierarchy_tree, extract_hierarchical_data, fill_hierarchical_data,
+                   generate_column_labels, generate_row_identifiers, process_excel_file, read_trn_model)
+
+def legacy_hierarchy(path):
+    # The hierarchy as create_hierarchy built it before the single-pass reader: a full
+    # (not read-only) load of the workbook and a per-row walk of the column-A outline
+    workbook = load_workbook(path, data_only=True)
+    hierarchy = []
+    current_path = []
+    for value, indent in fill_hierarchical_data(extract_hierarchical_data(workbook['Trn Model'])):
+        current_path = current_path[:indent] + [''] * (indent - len(current_path)) + [value]
+        hierarchy.append('_'.join(filter(None, current_path)))
+    return hierarchy
+
+def legacy_frame(path):
+    # process_excel_file before the single-pass reader: pd.read_excel plus create_hierarchy
+    df = pd.read_excel(path, sheet_name='Trn Model')
+    df.index = generate_row_identifiers(df, legacy_hierarchy(path))
+    df.index.name = 'Unique_ID'
+    df.columns = generate_column_labels(df)[0]
+    return df.loc[:, ~df.columns.str.startswith('Unnamed_Unnamed')]
+
+def write_edge_case_model(path):
+    # Blank and whitespace-only labels, indents that skip levels, mixed cell types in one
+    # column and trailing blank rows
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = 'Trn Model'
+    sheet.append(['Line Item', 'Code', 'Description', 'Variable', 'Unit', 'Source', 'Owner', 'Notes', 'Buy', None, 'Sell'])
+    sheet.append([None] * 8 + ['Dr', 'Cr', 'Amount'])
+    rows = [
+        ('Assets', 0, [None, 1, None, None, None, None, None, None, None, None, None]),
+        (None, 0, [None, 2, 'x', 'cash', 'GBP', None, None, None, 10, 2.5, 'GL100']),
+        ('Current', 2, [None, 3, None, None, None, None, None, None, None, None, None]),
+        ('   ', 0, [None, 4, 'x', 'bank', None, None, None, None, 'Y', 7, -3.25]),
+        ('Liabilities', 0, [None, 5, None, None, None, None, None, None, None, None, None]),
+        (None, 0, [None, 6, 'x', 'loan', None, None, None, None, 2 ** 60, True, None]),
+        ('Tax', 1, [None, 7, 'x', 0, None, None, None, None, 1.0, None, 'Pro rata']),
+        (None, 0, [None, 8, None, 'vat', None, None, None, None, None, None, None]),
+    ]
+    for label, indent, values in rows:
+        values[0] = label
+        sheet.append(values)
+        if indent:
+            sheet.cell(row=sheet.max_row, column=1).alignment = Alignment(indent=indent)
+    sheet.append([None] * 11)
+    workbook.save(path)
+
+SPECS = [
+    SyntheticModelSpec(rows=300, depth=4, indent_pattern='nested', transaction_types=6, sub_columns=3, seed=1),
+    SyntheticModelSpec(rows=300, depth=4, indent_pattern='random', transaction_types=4, sub_columns=4, seed=2),
+    SyntheticModelSpec(rows=200, depth=1, indent_pattern='flat', transaction_types=5, sub_columns=2, seed=3),
+    SyntheticModelSpec(rows=200, depth=3, indent_pattern='nested', transaction_types=3, sub_columns=1,
+                       fill_ratio=0.9, seed=4),
+]
+
+@pytest.fixture(params=[*SPECS, 'edge cases'], ids=lambda p: p if isinstance(p, str) else f"{p.indent_pattern}-{p.seed}")
+def workbook_path(request, tmp_path):
+    path = tmp_path / 'model.xlsx'
+    if isinstance(request.param, str):
+        write_edge_case_model(path)
+    else:
+        write_synthetic_models(request.param, path)
+    return str(path)
+
+def test_single_pass_read_matches_read_excel(workbook_path):
+    df, hierarchical_data = read_trn_model(workbook_path)
+    pd.testing.assert_frame_equal(df, pd.read_excel(workbook_path, sheet_name='Trn Model'))
+    # The header row plus one entry per frame row; blank rows after the data never get an identifier
+    rows = len(df) + 1
+    assert build_hierarchy(hierarchical_data)[:rows] == legacy_hierarchy(workbook_path)[:rows]
+
+def test_hierarchy_tree_matches_per_row_build(workbook_path):
+    _, hierarchical_data = read_trn_model(workbook_path)
+    tree = build_hierarchy_tree(hierarchical_data)
+    expected = per_row_hierarchy_tree(hierarchical_data)
+    assert tree.paths == expected.paths
+    assert list(tree.row_nodes) == list(expected.row_nodes)
+
+def test_processed_frame_matches_legacy_path(workbook_path):
+    df = process_excel_file(workbook_path, streaming=False)
+    legacy = legacy_frame(workbook_path)
+    assert list(df.index) == list(legacy.index)
+    assert list(df.columns) == list(legacy.columns)
+    # Value columns are stored as float64 after load; compare cell by cell as objects
+    pd.testing.assert_frame_equal(df.astype(object).fillna(''), legacy.astype(object).fillna(''), check_dtype=False)
+
+def test_streaming_path_matches_eager_path(workbook_path, monkeypatch):
+    # Every workbook takes the streaming reader, which builds the frame a few columns at a time
+    monkeypatch.setattr(utils, 'STREAMING_MIN_FILE_BYTES', 0)
+    monkeypatch.setattr(utils, 'STREAMING_BATCH_CELLS', 500)
+    assert utils.use_streaming_reader(workbook_path)
+    eager_df, eager_data = read_trn_model(workbook_path)
+    streamed_df, streamed_data = utils.read_trn_model_streaming(workbook_path)
+    pd.testing.assert_frame_equal(streamed_df, eager_df)
+    # Blank labels may come back as '' or None; both are filled from the label above
+    assert fill_hierarchical_data(streamed_data) == fill_hierarchical_data(eager_data)
+
+    df, hierarchy = utils.process_workbook(workbook_path)
+    expected, expected_hierarchy = utils.process_workbook(workbook_path, streaming=False)
+    assert not df.empty
+    pd.testing.assert_frame_equal(df, expected)
+    assert hierarchy == expected_hierarchy
+    assert dict(df.attrs['column_index']) == dict(expected.attrs['column_index'])
+    tree, expected_tree = df.attrs['hierarchy_tree'], expected.attrs['hierarchy_tree']
+    assert tree.paths == expected_tree.paths
+    assert list(tree.row_nodes) == list(expected_tree.row_nodes)
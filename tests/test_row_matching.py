@@ -0,0 +1,76 @@
+# tests/test_row_matching.py
+
+import pytest
+from openpyxl import Workbook
+from diff_engine import compare_models, generate_difference_explanation
+from row_matching import MOVED
+from synthetic_workbook import METADATA_COLUMNS
+from utils import process_excel_file
+
+SUB_COLUMNS = ['Dr', 'Cr', 'Amount', 'Rate']
+
+def write_model(path, blocks):
+    # blocks is [(label, [(variable, [Dr, Cr, Amount, Rate]), ...]), ...] for one type, Buy
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = 'Trn Model'
+    sheet.append(METADATA_COLUMNS + ['Buy'] + [None] * (len(SUB_COLUMNS) - 1))
+    sheet.append([None] * len(METADATA_COLUMNS) + SUB_COLUMNS)
+    code = 0
+    for label, rows in blocks:
+        sheet.append([label, code] + [None] * (len(METADATA_COLUMNS) - 2 + len(SUB_COLUMNS)))
+        for variable, values in rows:
+            code += 1
+            sheet.append([None, code, None, variable, None, None, None, None] + values)
+        code += 1
+    workbook.save(path)
+
+def explain(tmp_path, blocks1, blocks2):
+    write_model(tmp_path / 'a.xlsx', blocks1)
+    write_model(tmp_path / 'b.xlsx', blocks2)
+    df1 = process_excel_file(str(tmp_path / 'a.xlsx'))
+    df2 = process_excel_file(str(tmp_path / 'b.xlsx'))
+    diff_df1, diff_df2 = compare_models(df1, 'Buy', df2, 'Buy', match_moved=True)
+    changes = generate_difference_explanation(diff_df1, diff_df2, 'Sheet 1', 'Sheet 2')
+    return sorted(zip(changes['Variable'], changes['Column'], changes['Change Type'], changes['From'], changes['To']))
+
+def change_types(changes):
+    return {(variable, change_type) for variable, _, change_type, _, _ in changes}
+
+UNCHANGED = ('Liabilities', [('loan', ['GL300', 'GL400', 5, 0.1])])
+
+def test_same_variable_and_values_pair_across_a_renamed_label(tmp_path):
+    rows = [('cash', ['GL100', 'GL200', 10, 0.5]), ('bank', ['GL110', 'GL210', 20, None])]
+    changes = explain(tmp_path, [('Assets', rows), UNCHANGED], [('Holdings', rows), UNCHANGED])
+    assert changes == [('bank', 'Entire Row', MOVED, 'Assets.bank', 'Holdings.bank'),
+                       ('cash', 'Entire Row', MOVED, 'Assets.cash', 'Holdings.cash')]
+
+def test_renamed_variable_pairs_when_its_values_occur_once_in_the_category(tmp_path):
+    changes = explain(tmp_path,
+                      [('Assets', [('cash', ['GL100', 'GL200', 10, 0.5]), ('bank', ['GL110', None, None, None])]), UNCHANGED],
+                      [('Assets', [('money', ['GL100', 'GL200', 10, 0.5]), ('deposits', ['GL110', None, None, None])]), UNCHANGED])
+    # A row with a single filled cell is too likely to match by chance
+    assert changes == [('bank', 'Dr', 'Removed', 'GL110', 'NaN'),
+                       ('deposits', 'Dr', 'Added', 'NaN', 'GL110'),
+                       ('money', 'Entire Row', MOVED, 'Assets.cash', 'Assets.money')]
+
+def test_ambiguous_duplicates_stay_removed_and_added(tmp_path):
+    values = ['GL100', 'GL200', 10, 0.5]
+    changes = explain(tmp_path, [('Assets', [('cash', values), ('bank', values)]), UNCHANGED],
+                      [('Assets', [('money', values), ('deposits', values)]), UNCHANGED])
+    assert change_types(changes) == {('bank', 'Removed'), ('cash', 'Removed'), ('deposits', 'Added'), ('money', 'Added')}
+
+def test_similar_rows_with_the_same_variable_pair_and_keep_their_cell_changes(tmp_path):
+    # A renamed block whose rows were also edited: reported as Moved plus ordinary changes
+    changes = explain(tmp_path,
+                      [('Assets', [('cash', ['GL100', 'GL200', 10, 0.5]), ('bank', ['GL110', 'GL210', 20, 0.25])]), UNCHANGED],
+                      [('Holdings', [('cash', ['GL100', 'GL200', 11, 0.5]), ('bank', ['GL110', 'GL210', 20, None])]), UNCHANGED])
+    assert changes == [('bank', 'Entire Row', MOVED, 'Assets.bank', 'Holdings.bank'),
+                       ('bank', 'Rate', 'Removed', '0.25', 'NaN'),
+                       ('cash', 'Amount', 'Changed', '10', '11'),
+                       ('cash', 'Entire Row', MOVED, 'Assets.cash', 'Holdings.cash')]
+
+def test_rows_below_the_similarity_threshold_stay_removed_and_added(tmp_path):
+    changes = explain(tmp_path, [('Assets', [('cash', ['GL100', 'GL200', 10, 0.5])]), UNCHANGED],
+                      [('Holdings', [('cash', ['GL100', 'GL201', 11, 0.75])]), UNCHANGED])
+    assert change_types(changes) == {('cash', 'Removed'), ('cash', 'Added')}
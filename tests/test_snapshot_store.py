@@ -0,0 +1,63 @@
+# tests/test_snapshot_store.py
+
+import datetime
+import os
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from snapshot_store import SnapshotStore
+from synthetic_workbook import METADATA_COLUMNS, SyntheticModelSpec, write_synthetic_models
+from utils import process_workbook
+
+def write_typed_cells_model(path):
+    # Cells Arrow cannot hold in a mixed column: booleans, dates, times and ints past 2**53
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = 'Trn Model'
+    sheet.append(METADATA_COLUMNS + ['Buy', None, None, 'Sell'])
+    sheet.append([None] * len(METADATA_COLUMNS) + ['Dr', 'Cr', 'Amount', 'Dr'])
+    sheet.append(['Assets', 0] + [None] * (len(METADATA_COLUMNS) + 2))
+    rows = [
+        ('cash', ['GL100', True, 2 ** 60, 1.5]),
+        ('bank', [datetime.datetime(2024, 5, 31, 17, 30), datetime.date(2024, 6, 1), 'Pro rata', 2]),
+        ('loan', [datetime.time(9, 15), False, None, -3.25]),
+    ]
+    for code, (variable, values) in enumerate(rows, start=1):
+        sheet.append([None, code, None, variable, None, None, None, None] + values)
+    workbook.save(path)
+
+def assert_round_trip(tmp_path, path):
+    df, hierarchy = process_workbook(str(path))
+    store = SnapshotStore(root=str(tmp_path / 'snapshots'))
+    meta = store.save('baseline', df, hierarchy, os.path.basename(path), 'abc123')
+    loaded, loaded_hierarchy = SnapshotStore(root=str(tmp_path / 'snapshots')).load('baseline', meta['version'])
+
+    pd.testing.assert_frame_equal(loaded, df)
+    assert [type(v) for v in loaded.to_numpy().ravel()] == [type(v) for v in df.to_numpy().ravel()]
+    assert loaded_hierarchy == list(hierarchy)
+    assert loaded.attrs['column_index'] == df.attrs['column_index']
+    assert dict(loaded.attrs.get('numeric_columns', {})) == dict(df.attrs.get('numeric_columns', {}))
+    tree, loaded_tree = df.attrs['hierarchy_tree'], loaded.attrs['hierarchy_tree']
+    assert loaded_tree.paths == tree.paths
+    assert np.array_equal(loaded_tree.row_nodes, tree.row_nodes)
+    assert not any(name.endswith('.pkl') for _, _, files in os.walk(tmp_path / 'snapshots') for name in files)
+
+def test_synthetic_model_round_trips(tmp_path):
+    path = tmp_path / 'model.xlsx'
+    write_synthetic_models(SyntheticModelSpec(rows=300, transaction_types=5, seed=6), path)
+    assert_round_trip(tmp_path, path)
+
+def test_cells_outside_arrow_round_trip_without_pickle(tmp_path):
+    path = tmp_path / 'typed.xlsx'
+    write_typed_cells_model(path)
+    assert_round_trip(tmp_path, path)
+
+def test_saves_in_the_same_second_get_their_own_version(tmp_path, monkeypatch):
+    path = tmp_path / 'model.xlsx'
+    write_synthetic_models(SyntheticModelSpec(rows=50, transaction_types=2, seed=7), path)
+    df, hierarchy = process_workbook(str(path))
+    store = SnapshotStore(root=str(tmp_path / 'snapshots'))
+    monkeypatch.setattr('time.time', lambda: 1_700_000_000.0)
+    versions = {store.save('baseline', df, hierarchy)['version'] for _ in range(3)}
+    assert len(versions) == 3
+    assert len(store.versions('baseline')) == 3
@@ -0,0 +1,20 @@
+# tests/test_type_similarity.py
+
+import pandas as pd
+import type_similarity
+from synthetic_workbook import SyntheticModelSpec, write_synthetic_models
+from type_similarity import compute_similarity_matrix
+from utils import process_excel_file
+
+def test_worker_processes_give_the_in_process_matrix(tmp_path, monkeypatch):
+    path = tmp_path / 'model.xlsx'
+    write_synthetic_models(SyntheticModelSpec(rows=200, transaction_types=8, seed=3), path)
+    df = process_excel_file(str(path))
+    transaction_types = sorted(df.attrs['column_index'])
+
+    differences, similarity = compute_similarity_matrix(df, transaction_types, max_workers=1)
+    monkeypatch.setattr(type_similarity, 'SIMILARITY_PARALLEL_MIN_CELLS', 0)
+    parallel_differences, parallel_similarity = compute_similarity_matrix(df, transaction_types, max_workers=2)
+    pd.testing.assert_frame_equal(parallel_differences, differences)
+    pd.testing.assert_frame_equal(parallel_similarity, similarity)
+    assert (differences.to_numpy() > 0).any()
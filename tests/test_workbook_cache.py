@@ -0,0 +1,49 @@
+# tests/test_workbook_cache.py
+
+import io
+import time
+import pandas as pd
+from synthetic_workbook import SyntheticModelSpec, write_synthetic_models
+from utils import process_workbook
+from workbook_cache import WorkbookCache
+
+def workbook_bytes(tmp_path, seed):
+    path = tmp_path / f"model_{seed}.xlsx"
+    write_synthetic_models(SyntheticModelSpec(rows=60, transaction_types=3, seed=seed), path)
+    return path.read_bytes()
+
+def kill_workers(pool):
+    for process in list(pool._processes.values()):
+        process.kill()
+    deadline = time.monotonic() + 30
+    while not pool._broken and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert pool._broken
+
+def test_dead_parse_worker_falls_back_and_the_pool_is_replaced(tmp_path):
+    first = workbook_bytes(tmp_path, 1)
+    cache = WorkbookCache(parse_workers=1)
+
+    # A worker dies while parsing: the upload is parsed in process and the pool is dropped
+    cache.prefetch(first)
+    broken_pool = cache._parse_pool
+    kill_workers(broken_pool)
+    df, _ = cache.get_processed_workbook(first)
+    pd.testing.assert_frame_equal(df, process_workbook(io.BytesIO(first))[0])
+    assert cache._parse_pool is None
+
+    # A pool that broke after its last submit turns the next submit down: that upload parses
+    # in process too, and the prefetch after it starts a fresh pool
+    second, third, fourth = (workbook_bytes(tmp_path, seed) for seed in (2, 3, 4))
+    cache.prefetch(second)
+    kill_workers(cache._parse_pool)
+    cache.prefetch(third)
+    assert cache._parse_pool is None
+    for file_bytes in (second, third):
+        df, _ = cache.get_processed_workbook(file_bytes)
+        assert not df.empty
+    cache.prefetch(fourth)
+    assert cache._parse_pool is not None and not cache._parse_pool._broken
+    df, _ = cache.get_processed_workbook(fourth)
+    pd.testing.assert_frame_equal(df, process_workbook(io.BytesIO(fourth))[0])
+    cache._parse_pool.shutdown()